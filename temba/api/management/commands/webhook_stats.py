@@ -1,12 +1,9 @@
-from array import array
-from collections import defaultdict
 from datetime import timedelta
-from urllib.parse import urlparse
 
 from django.core.management.base import BaseCommand, CommandParser
 from django.utils import timezone
 
-from temba.request_logs.models import HTTPLog
+from temba.request_logs.models import HTTPLog, WebhookCount
 
 
 class Command(BaseCommand):  # pragma: no cover
@@ -15,15 +12,11 @@ class Command(BaseCommand):  # pragma: no cover
     COMMAND_SUMMARY = "summary"
     COMMAND_SLOWEST = "slowest"
 
-    KEY_HOST = "host"  # host only
-    KEY_HOST_AND_PATH = "host_path"  # host and path
-    KEY_HOST_AND_PATH_0 = "host_path_0"  # host and first part of the path
-
     SORT_ALPHA = "alpha"
     SORT_TIMEOUTS = "timeouts"
 
     # https://docs.djangoproject.com/en/2.0/releases/2.0/#call-command-validates-the-options-it-receives
-    stealth_options = ("key_by", "sort_by", "max_age")
+    stealth_options = ("sort_by", "max_age")
 
     def add_arguments(self, parser):
         cmd = self
@@ -31,16 +24,7 @@ class Command(BaseCommand):  # pragma: no cover
             dest="command", help="Command to perform", parser_class=lambda **kw: CommandParser(cmd, **kw)
         )
 
-        summary_parser = subparsers.add_parser("summary", help="Summarizes URL based statistics")
-        summary_parser.add_argument(
-            "--key",
-            type=str,
-            action="store",
-            dest="key_by",
-            default=self.KEY_HOST_AND_PATH_0,
-            choices=(self.KEY_HOST, self.KEY_HOST_AND_PATH, self.KEY_HOST_AND_PATH_0),
-            help="Key to aggregate requests over",
-        )
+        summary_parser = subparsers.add_parser("summary", help="Summarizes host based statistics")
         summary_parser.add_argument(
             "--sort",
             type=str,
@@ -71,62 +55,21 @@ class Command(BaseCommand):  # pragma: no cover
 
     def handle(self, command, *args, **kwargs):
         if command == self.COMMAND_SUMMARY:
-            self.handle_summary(kwargs["max_age"], kwargs["key_by"], kwargs["sort_by"])
+            self.handle_summary(kwargs["max_age"], kwargs["sort_by"])
         else:
             self.handle_slowest(kwargs["max_age"])
 
-    def handle_summary(self, max_age, key_by, sort_by):
-        results = HTTPLog.objects.exclude(flow=None)
+    def handle_summary(self, max_age, sort_by):
+        counts = WebhookCount.objects.all()
 
         if max_age > 0:
+            # counts are hourly so include the hour which contains the cutoff
             created_after = timezone.now() - timedelta(minutes=max_age)
-            results = results.filter(created_on__gt=created_after)
+            counts = counts.filter(hour__gt=created_after - timedelta(hours=1))
 
-        total_results = results.count()
-        self.stdout.write("Found %d webhook results to analyze..." % total_results)
-
-        item_statuses = defaultdict(lambda: defaultdict(int))
-        item_times = defaultdict(lambda: array("i"))
-
-        num_results = 0
-        for result in results.only("url", "status_code", "request_time"):
-            item_key = self._url_to_key(result.url, key_by)
-
-            item_statuses[item_key][result.status_code] += 1
-            item_times[item_key].append(result.request_time)
-
-            num_results += 1
-            if num_results % 10000 == 0:
-                self.stdout.write(" > Analyzed %d of %d results" % (num_results, total_results))
-
-        # calculate stats for each unique item
-        items = []
-        for key, status_counts in item_statuses.items():
-            times = item_times[key]
-            total_requests = len(times)
-            avg_time = sum(times) // total_requests
-
-            num_non200s = sum([count for code, count in status_counts.items() if code != -1 and int(code // 100) != 2])
-            num_timeouts = status_counts.get(-1, 0)
-
-            sorted_statuses = []
-            for code, count in status_counts.items():
-                if code > 0:
-                    sorted_statuses.append({"code": code, "count": count, "%": (100 * count // total_requests)})
-
-            sorted_statuses = sorted(sorted_statuses, key=lambda s: s["code"])
-
-            items.append(
-                {
-                    "key": key,
-                    "times": {"avg": avg_time, "min": min(times), "max": max(times)},
-                    "statuses": sorted_statuses,
-                    "failures": {
-                        "non200": {"count": num_non200s, "%": 100 * num_non200s // total_requests},
-                        "timeouts": {"count": num_timeouts, "%": 100 * num_timeouts // total_requests},
-                    },
-                }
-            )
+        items = WebhookCount.get_summaries(counts, key="host")
+
+        self.stdout.write("Summarized %d webhook calls" % sum(i["total"] for i in items))
 
         if sort_by == self.SORT_ALPHA:
             items = sorted(items, key=lambda i: i["key"])
@@ -151,11 +94,11 @@ class Command(BaseCommand):  # pragma: no cover
         for item in items:
             self.stdout.write(self.style.MIGRATE_HEADING(item["key"]))
             self.stdout.write(
-                " * times: avg=%s, min=%s, max=%s"
+                " * times: p50=%s, p95=%s, p99=%s"
                 % (
-                    self._num_style(item["times"]["avg"]),
-                    self._num_style(item["times"]["min"]),
-                    self._num_style(item["times"]["max"]),
+                    self._num_style(item["times"]["p50"]),
+                    self._num_style(item["times"]["p95"]),
+                    self._num_style(item["times"]["p99"]),
                 )
             )
 
@@ -173,24 +116,5 @@ class Command(BaseCommand):  # pragma: no cover
             )
             self.stdout.write("   * all: %s" % ", ".join(all_codes))
 
-    def _url_to_key(self, url, by_key):
-        parsed_url = urlparse(url)
-
-        if by_key == self.KEY_HOST:
-            return parsed_url.netloc
-        elif by_key == self.KEY_HOST_AND_PATH:
-            return parsed_url.netloc + parsed_url.path
-        elif by_key == self.KEY_HOST_AND_PATH_0:
-            key = parsed_url.netloc
-            if parsed_url.path:
-                path = parsed_url.path
-                if path[0] == "/":
-                    path = path[1:]
-
-                key += "/" + path.split("/")[0]
-            return key
-        else:
-            return url
-
     def _num_style(self, v):
         return self.style.NOTICE(str(v))
@@ -1,17 +1,22 @@
 import hmac
 import logging
-from hashlib import sha1
+import threading
+from hashlib import sha1, sha256
 
 from rest_framework.permissions import BasePermission
 from smartmin.models import SmartModel
 
 from django.conf import settings
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import Group, User as AuthUser
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from temba.orgs.models import Org, OrgRole, User
+from temba.utils import analytics
 from temba.utils.models import JSONAsTextField
 from temba.utils.uuid import uuid4
 
@@ -172,6 +177,12 @@ class APIToken(models.Model):
         "Prometheus": (OrgRole.ADMINISTRATOR,),
     }
 
+    CACHE_KEY = "api_token:%s"
+    CACHE_ORG_VERSION_KEY = "api_token_org_version:%d"
+    CACHE_USER_VERSION_KEY = "api_token_user_version:%d"
+    CACHE_TTL = 300  # cached tokens are also invalidated by version bumps so this just limits memory use
+    CACHE_REPORT_EVERY = 1000  # how many lookups between reporting cache hit and miss counts
+
     org = models.ForeignKey(Org, on_delete=models.PROTECT, related_name="api_tokens")
     user = models.ForeignKey(User, on_delete=models.PROTECT, related_name="api_tokens")
     role = models.ForeignKey(Group, on_delete=models.PROTECT)
@@ -179,6 +190,78 @@ class APIToken(models.Model):
     created = models.DateTimeField(default=timezone.now)
     is_active = models.BooleanField(default=True)
 
+    _cache_stats = {"hits": 0, "misses": 0}
+    _cache_stats_lock = threading.Lock()
+
+    @classmethod
+    def get_active(cls, key: str):
+        """
+        Gets the active token with the given key (with its org, user and role loaded) or None. Tokens are cached by a
+        hash of their key, and a cached token is only used if its org and user haven't changed since it was cached.
+        """
+        cache_key = cls.CACHE_KEY % sha256(key.encode()).hexdigest()
+        cached = cache.get(cache_key)
+
+        if cached:
+            token, versions = cached
+            if versions == cls._get_cache_versions(token.org_id, token.user_id):
+                cls._record_cache_lookup(hit=True)
+                return token
+
+        cls._record_cache_lookup(hit=False)
+
+        token = cls.objects.filter(is_active=True, key=key).select_related("org", "user", "role").first()
+        if token:
+            versions = cls._get_cache_versions(token.org_id, token.user_id)
+            cache.set(cache_key, (token, versions), timeout=cls.CACHE_TTL)
+
+        return token
+
+    @classmethod
+    def invalidate_cached(cls, *, org=None, user=None):
+        """
+        Invalidates cached tokens for the given org and/or user by bumping their version
+        """
+        keys = []
+        if org:
+            keys.append(cls.CACHE_ORG_VERSION_KEY % org.id)
+        if user:
+            keys.append(cls.CACHE_USER_VERSION_KEY % user.id)
+
+        for key in keys:
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, timeout=None)
+
+    @classmethod
+    def get_cache_stats(cls) -> dict:
+        """
+        Gets the counts of cache hits and misses since they were last reported
+        """
+        with cls._cache_stats_lock:
+            return dict(cls._cache_stats)
+
+    @classmethod
+    def _get_cache_versions(cls, org_id: int, user_id: int) -> tuple:
+        org_key, user_key = cls.CACHE_ORG_VERSION_KEY % org_id, cls.CACHE_USER_VERSION_KEY % user_id
+        versions = cache.get_many([org_key, user_key])
+        return versions.get(org_key, 0), versions.get(user_key, 0)
+
+    @classmethod
+    def _record_cache_lookup(cls, *, hit: bool):
+        with cls._cache_stats_lock:
+            cls._cache_stats["hits" if hit else "misses"] += 1
+
+            if cls._cache_stats["hits"] + cls._cache_stats["misses"] < cls.CACHE_REPORT_EVERY:
+                return
+
+            stats = dict(cls._cache_stats)
+            cls._cache_stats.update(hits=0, misses=0)
+
+        analytics.gauge("temba.api_token_cache_hits", stats["hits"])
+        analytics.gauge("temba.api_token_cache_misses", stats["misses"])
+
     @classmethod
     def get_or_create(cls, org, user, *, role: OrgRole = None, prometheus: bool = False, refresh: bool = False):
         """
@@ -252,10 +335,23 @@ class APIToken(models.Model):
         self.is_active = False
         self.save(update_fields=("is_active",))
 
+        cache.delete(self.CACHE_KEY % sha256(self.key.encode()).hexdigest())
+
     def __str__(self):
         return self.key
 
 
+@receiver(post_save, sender=Org)
+def invalidate_org_tokens(sender, instance, **kwargs):
+    APIToken.invalidate_cached(org=instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=AuthUser)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    APIToken.invalidate_cached(user=instance)
+
+
 def get_or_create_api_token(user):
     """
     Gets or creates an API token for this user. If user doen't have access to the API, this returns None.
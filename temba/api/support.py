@@ -27,9 +27,8 @@ class APITokenAuthentication(TokenAuthentication):
     model = APIToken
 
     def authenticate_credentials(self, key):
-        try:
-            token = self.model.objects.get(is_active=True, key=key)
-        except self.model.DoesNotExist:
+        token = self.model.get_active(key)
+        if not token:
             raise exceptions.AuthenticationFailed("Invalid token")
 
         if token.user.is_active:
@@ -52,12 +51,8 @@ class APIBasicAuthentication(BasicAuthentication):
     """
 
     def authenticate_credentials(self, userid, password, request=None):
-        try:
-            token = APIToken.objects.get(is_active=True, key=password)
-        except APIToken.DoesNotExist:
-            raise exceptions.AuthenticationFailed("Invalid token or email")
-
-        if token.user.username != userid:
+        token = APIToken.get_active(password)
+        if not token or token.user.username != userid:
             raise exceptions.AuthenticationFailed("Invalid token or email")
 
         if token.user.is_active:
@@ -1,4 +1,5 @@
 from datetime import timedelta
+from unittest.mock import call, patch
 
 from django.contrib.auth.models import Group
 from django.test import override_settings
@@ -54,6 +55,66 @@ class APITokenTest(TembaTest):
         self.assertRaises(ValueError, APIToken.get_or_create, self.org, self.admin, role=OrgRole.VIEWER)
         self.assertRaises(ValueError, APIToken.get_or_create, self.org, self.user)
 
+    def test_get_active(self):
+        token = APIToken.get_or_create(self.org, self.admin)
+
+        with self.assertNumQueries(1):
+            fetched = APIToken.get_active(token.key)
+
+        self.assertEqual(token, fetched)
+        self.assertEqual(self.org, fetched.org)
+        self.assertEqual(self.admin, fetched.user)
+        self.assertEqual(self.admins_group, fetched.role)
+
+        # subsequent lookups come from the cache
+        with self.assertNumQueries(0):
+            fetched = APIToken.get_active(token.key)
+            self.assertEqual(self.org, fetched.org)
+            self.assertEqual(self.admin, fetched.user)
+            self.assertEqual(self.admins_group, fetched.role)
+
+        self.assertIsNone(APIToken.get_active("1234567890"))
+
+        # changing the org invalidates it
+        self.org.name = "Nyaruka Ltd"
+        self.org.save(update_fields=("name",))
+
+        with self.assertNumQueries(1):
+            self.assertEqual("Nyaruka Ltd", APIToken.get_active(token.key).org.name)
+
+        # as does changing the user
+        self.admin.is_active = False
+        self.admin.save(update_fields=("is_active",))
+
+        with self.assertNumQueries(1):
+            self.assertFalse(APIToken.get_active(token.key).user.is_active)
+
+        # and releasing the token
+        token.release()
+
+        with self.assertNumQueries(1):
+            self.assertIsNone(APIToken.get_active(token.key))
+
+    def test_cache_stats(self):
+        token = APIToken.get_or_create(self.org, self.admin)
+
+        with patch("temba.api.models.APIToken._cache_stats", {"hits": 0, "misses": 0}):
+            APIToken.get_active(token.key)
+            APIToken.get_active(token.key)
+            APIToken.get_active(token.key)
+
+            self.assertEqual({"hits": 2, "misses": 1}, APIToken.get_cache_stats())
+
+            with patch("temba.api.models.APIToken.CACHE_REPORT_EVERY", 4):
+                with patch("temba.utils.analytics.gauge") as mock_gauge:
+                    APIToken.get_active(token.key)
+
+                    mock_gauge.assert_has_calls(
+                        [call("temba.api_token_cache_hits", 3), call("temba.api_token_cache_misses", 1)]
+                    )
+
+            self.assertEqual({"hits": 0, "misses": 0}, APIToken.get_cache_stats())
+
     def test_get_orgs_for_role(self):
         self.assertEqual(set(APIToken.get_orgs_for_role(self.admin, OrgRole.ADMINISTRATOR)), {self.org})
         self.assertEqual(set(APIToken.get_orgs_for_role(self.admin, OrgRole.SURVEYOR)), {self.org, self.org2})
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from temba.archives.models import Archive
+from temba.orgs.models import Org
+
+
+class Command(BaseCommand):
+    help = "Builds indexes for archives which don't have them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--org", type=int, action="store", dest="org_id", help="ID of a single org to index")
+        parser.add_argument("--reindex", action="store_true", help="Rebuild indexes for archives which have them")
+
+    def handle(self, org_id: int, reindex: bool, **options):
+        archives = Archive.objects.all()
+
+        if org_id:
+            org = Org.objects.filter(id=org_id).first()
+            if not org:
+                raise CommandError(f"No such org with id {org_id}")
+
+            archives = archives.filter(org=org)
+
+        if not reindex:
+            archives = archives.filter(index=None)
+
+        num_indexed = 0
+        for archive in archives.order_by("id"):
+            archive.rebuild_index()
+            num_indexed += 1
+
+        self.stdout.write(f"Indexed {num_indexed} archives")
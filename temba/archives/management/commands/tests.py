@@ -2,7 +2,7 @@ from datetime import date
 from io import StringIO
 from unittest.mock import patch
 
-from django.core.management import call_command
+from django.core.management import CommandError, call_command
 
 from temba.archives.models import Archive
 from temba.tests import TembaTest
@@ -28,3 +28,48 @@ class SearchArchivesTest(TembaTest):
 
         self.assertIn('"id": 1', out.getvalue())
         self.assertIn("Fetched 2 records in", out.getvalue())
+
+
+class IndexArchivesTest(TembaTest):
+    @patch("temba.utils.s3.client")
+    def test_command(self, mock_s3_client):
+        mock_s3 = MockS3Client()
+        mock_s3_client.return_value = mock_s3
+
+        archive1 = self.create_archive(
+            Archive.TYPE_FLOWRUN,
+            "D",
+            date(2020, 8, 1),
+            [{"id": 1, "modified_on": "2020-08-01T10:00:00Z", "flow": {"uuid": "f1", "name": "Survey"}}],
+            s3=mock_s3,
+        )
+        archive2 = self.create_archive(
+            Archive.TYPE_FLOWRUN,
+            "D",
+            date(2020, 8, 1),
+            [{"id": 2, "modified_on": "2020-08-01T11:00:00Z", "flow": {"uuid": "f2", "name": "Survey"}}],
+            s3=mock_s3,
+            org=self.org2,
+        )
+
+        out = StringIO()
+        call_command("index_archives", org_id=self.org.id, stdout=out)
+
+        self.assertEqual("Indexed 1 archives\n", out.getvalue())
+
+        archive1.refresh_from_db()
+        archive2.refresh_from_db()
+        self.assertEqual(["f1"], archive1.index["flow_uuids"])
+        self.assertIsNone(archive2.index)
+
+        # archives which are already indexed are skipped unless we're reindexing
+        out = StringIO()
+        call_command("index_archives", stdout=out)
+        self.assertEqual("Indexed 1 archives\n", out.getvalue())
+
+        out = StringIO()
+        call_command("index_archives", reindex=True, stdout=out)
+        self.assertEqual("Indexed 2 archives\n", out.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command("index_archives", org_id=123456)
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.7 on 2026-10-17 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("archives", "0016_squashed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archive",
+            name="index",
+            field=models.JSONField(null=True),
+        ),
+    ]
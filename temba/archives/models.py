@@ -1,13 +1,21 @@
 import base64
+import fcntl
 import gzip
 import hashlib
+import os
+import queue
 import re
 import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from gettext import gettext as _
 from urllib.parse import urlparse
 
+import iso8601
 from dateutil.relativedelta import relativedelta
+from django_redis import get_redis_connection
 
 from django.conf import settings
 from django.db import models
@@ -15,12 +23,16 @@ from django.db.models import Q
 from django.utils import timezone
 
 from temba.utils import json, s3, sizeof_fmt
+from temba.utils.bloom import BloomFilter
 from temba.utils.s3 import EventStreamReader
 
 KEY_PATTERN = re.compile(
     r"^(?P<org>\d+)/(?P<type>run|message)_(?P<period>(D|M)\d+)_(?P<hash>[0-9a-f]{32})\.jsonl\.gz$"
 )
 
+# the raw S3 select condition used to filter message records by label
+RAW_LABEL_CONDITION = re.compile(r"^'(?P<uuid>[0-9a-f-]{36})' IN s\.labels\[\*\]\.uuid\[\*\]$")
+
 
 class Archive(models.Model):
     DOWNLOAD_EXPIRES = 60 * 60 * 24  # Up to 24 hours
@@ -69,6 +81,9 @@ class Archive(models.Model):
     # when this archive's records where deleted (if any)
     deleted_on = models.DateTimeField(null=True)
 
+    # summary of the records in this archive used to skip archives which can't match a query
+    index = models.JSONField(null=True)
+
     def size_display(self):
         return sizeof_fmt(self.size)
 
@@ -157,10 +172,17 @@ class Archive(models.Model):
 
     @classmethod
     def iter_all_records(
-        cls, org, archive_type: str, after: datetime = None, before: datetime = None, where: dict = None
+        cls,
+        org,
+        archive_type: str,
+        after: datetime = None,
+        before: datetime = None,
+        where: dict = None,
+        prefetch: int = None,
     ):
         """
-        Creates a record iterator across archives of the given type for records which match the given criteria
+        Creates a record iterator across archives of the given type for records which match the given criteria. If
+        prefetch is non-zero, that many archives are fetched and decompressed ahead of the one being read.
         """
 
         if not where:
@@ -172,6 +194,14 @@ class Archive(models.Model):
 
         archives = cls._get_covering_period(org, archive_type, after, before)
 
+        # skip archives whose indexes tell us they have no matching records
+        archives = [a for a in archives if a.can_match(where)]
+
+        if prefetch is None:
+            prefetch = settings.ARCHIVE_PREFETCH
+        if prefetch > 0:
+            return iter(PrefetchingRecordReader(archives, where=where, prefetch=prefetch))
+
         def generator():
             for archive in archives:
                 for record in archive.iter_records(where=where):
@@ -179,12 +209,79 @@ class Archive(models.Model):
 
         return generator()
 
+    def can_match(self, where: dict) -> bool:
+        """
+        Returns whether this archive could have records matching the given conditions according to its index, which
+        can give false positives but never false negatives
+        """
+        if not self.index or not where:
+            return True
+
+        # an empty archive matches nothing
+        if not self.index["record_count"]:
+            return False
+
+        for field, val in where.items():
+            if field == "__raw__":
+                match = RAW_LABEL_CONDITION.match(val)
+                if match and match.group("uuid") not in self.index["label_uuids"]:
+                    return False
+
+            elif field in ("flow__uuid", "flow__uuid__in"):
+                uuids = {val} if field == "flow__uuid" else set(val)
+                if not uuids.intersection(self.index["flow_uuids"]):
+                    return False
+
+            elif field in ("contact__uuid", "contact__uuid__in"):
+                uuids = [val] if field == "contact__uuid" else val
+                contacts = BloomFilter.from_json(self.index["contact_uuids"])
+                if not any(str(u) in contacts for u in uuids):
+                    return False
+
+            elif field.startswith("modified_on__") and isinstance(val, datetime) and self.index["modified_on"]:
+                lookup = field.split("__")[1]
+                earliest, latest = (iso8601.parse_date(d) for d in self.index["modified_on"])
+
+                if (
+                    (lookup == "gt" and latest <= val)
+                    or (lookup == "gte" and latest < val)
+                    or (lookup == "lt" and earliest >= val)
+                    or (lookup == "lte" and earliest > val)
+                ):
+                    return False
+
+        return True
+
+    def rebuild_index(self):
+        """
+        Rebuilds the index of this archive from its records
+        """
+        indexer = ArchiveIndexer()
+        for record in self.iter_records():
+            indexer.add(record)
+
+        self.index = indexer.build()
+        self.save(update_fields=("index",))
+
     def iter_records(self, *, where: dict = None):
         """
-        Creates an iterator for the records in this archive, streaming and decompressing on the fly
+        Creates an iterator for the records in this archive, streaming and decompressing on the fly. If the archive
+        cache is enabled, filtering is done locally on the cached file unless there are raw conditions.
         """
 
         s3_client = s3.client()
+        cache = ArchiveCache.get()
+
+        if cache and not (where and "__raw__" in where):
+
+            def cached_generator():
+                # gzip doesn't close the file it wraps so we have to
+                with cache.open(self) as f:
+                    for record in jsonlgz_iterate(f):
+                        if not where or s3.matches_where(record, where):
+                            yield record
+
+            return cached_generator()
 
         if where:
             bucket, key = self.get_storage_location()
@@ -211,12 +308,23 @@ class Archive(models.Model):
     def rewrite(self, transform, delete_old=False):
         s3_client = s3.client()
         bucket, key = self.get_storage_location()
+        cache = ArchiveCache.get()
+
+        old_file = cache.open(self) if cache else s3_client.get_object(Bucket=bucket, Key=key)["Body"]
 
-        s3_obj = s3_client.get_object(Bucket=bucket, Key=key)
-        old_file = s3_obj["Body"]
+        indexer = ArchiveIndexer()
+
+        def index_and_transform(record):
+            record = transform(record)
+            if record is not None:
+                indexer.add(record)
+            return record
 
         new_file = tempfile.TemporaryFile()
-        new_hash, new_size = jsonlgz_rewrite(old_file, new_file, transform)
+        try:
+            new_hash, new_size = jsonlgz_rewrite(old_file, new_file, index_and_transform)
+        finally:
+            old_file.close()
 
         new_file.seek(0)
 
@@ -239,7 +347,8 @@ class Archive(models.Model):
         self.url = new_url
         self.hash = new_hash.hexdigest()
         self.size = new_size
-        self.save(update_fields=("url", "hash", "size"))
+        self.index = indexer.build()
+        self.save(update_fields=("url", "hash", "size", "index"))
 
         if delete_old:
             s3_client.delete_object(Bucket=bucket, Key=key)
@@ -261,6 +370,282 @@ class Archive(models.Model):
         unique_together = ("org", "archive_type", "start_date", "period")
 
 
+class ArchiveIndexer:
+    """
+    Builds the index of an archive from its records: the number of records, the distinct flow and label UUIDs, a bloom
+    filter of contact UUIDs and the range of modified_on values (message records don't have these)
+    """
+
+    def __init__(self):
+        self.record_count = 0
+        self.flow_uuids = set()
+        self.label_uuids = set()
+        self.contact_uuids = set()
+        self.earliest_modified_on = None
+        self.latest_modified_on = None
+
+    def add(self, record: dict):
+        self.record_count += 1
+
+        flow_uuid = (record.get("flow") or {}).get("uuid")
+        if flow_uuid:
+            self.flow_uuids.add(flow_uuid)
+
+        for label in record.get("labels") or ():
+            self.label_uuids.add(label["uuid"])
+
+        contact_uuid = (record.get("contact") or {}).get("uuid")
+        if contact_uuid:
+            self.contact_uuids.add(contact_uuid)
+
+        if record.get("modified_on"):
+            modified_on = iso8601.parse_date(record["modified_on"])
+
+            if not self.earliest_modified_on or modified_on < self.earliest_modified_on:
+                self.earliest_modified_on = modified_on
+            if not self.latest_modified_on or modified_on > self.latest_modified_on:
+                self.latest_modified_on = modified_on
+
+    def build(self) -> dict:
+        contacts = BloomFilter.create(len(self.contact_uuids))
+        for contact_uuid in self.contact_uuids:
+            contacts.add(contact_uuid)
+
+        modified_on = None
+        if self.earliest_modified_on:
+            modified_on = [self.earliest_modified_on.isoformat(), self.latest_modified_on.isoformat()]
+
+        return {
+            "record_count": self.record_count,
+            "flow_uuids": sorted(self.flow_uuids),
+            "label_uuids": sorted(self.label_uuids),
+            "contact_uuids": contacts.as_json(),
+            "modified_on": modified_on,
+        }
+
+
+class ArchiveCache:
+    """
+    Size bounded cache of archive files on local disk, keyed by their content hash so that cached files can't be stale.
+    Least recently used files are evicted when the cache grows beyond its maximum size, and workers wanting the same
+    archive take a file lock so that only one of them downloads it.
+    """
+
+    STATS_KEY = "archive_cache_stats"
+    NUM_LOCKS = 256
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def get(cls):
+        """
+        Gets the archive cache configured in settings, or None if it's disabled
+        """
+        if settings.ARCHIVE_CACHE_DIR:
+            return cls(settings.ARCHIVE_CACHE_DIR, settings.ARCHIVE_CACHE_SIZE)
+        return None
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """
+        Gets the hits, misses, hit rate and bytes saved of the archive caches of all workers
+        """
+        stats = get_redis_connection().hgetall(cls.STATS_KEY)
+        hits, misses = int(stats.get(b"hits", 0)), int(stats.get(b"misses", 0))
+
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if (hits + misses) else 0,
+            "bytes_saved": int(stats.get(b"bytes_saved", 0)),
+            "bytes_downloaded": int(stats.get(b"bytes_downloaded", 0)),
+        }
+
+    def open(self, archive):
+        """
+        Opens the gzipped file of the given archive, downloading it into the cache first if it's not already there
+        """
+        path = os.path.join(self.directory, f"{archive.hash}.jsonl.gz")
+
+        file = self._open_existing(path)
+        if not file:
+            # locks are striped by hash so that lock files don't accumulate with the archives passing through the cache
+            lock_path = os.path.join(self.directory, f"{int(archive.hash[:2], 16) % self.NUM_LOCKS}.lock")
+
+            with open(lock_path, "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    # another worker may have downloaded it while we waited for the lock
+                    file = self._open_existing(path)
+                    if not file:
+                        self._download(archive, path)
+                        file = open(path, "rb")
+                        self._record_access(hit=False, size=archive.size)
+                        self._evict(keep=path)
+                        return file
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+        self._record_access(hit=True, size=archive.size)
+        return file
+
+    def _open_existing(self, path: str):
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+        # update modified time as that's what eviction uses to find the least recently used files
+        os.utime(path)
+        return file
+
+    def _download(self, archive, path: str):
+        bucket, key = archive.get_storage_location()
+        body = s3.client().get_object(Bucket=bucket, Key=key)["Body"]
+
+        # download to a temporary file in the cache directory so that it can be moved into place atomically
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as temp:
+            hasher = hashlib.md5()
+            for chunk in iter(lambda: body.read(1024 * 1024), b""):
+                temp.write(chunk)
+                hasher.update(chunk)
+
+        if hasher.hexdigest() != archive.hash:
+            os.remove(temp.name)
+            raise ValueError(f"downloaded file for archive #{archive.id} doesn't match its hash")
+
+        os.replace(temp.name, path)
+
+    def _evict(self, keep: str):
+        """
+        Removes least recently used files until the cache is within its maximum size
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".jsonl.gz"):
+                try:
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                except FileNotFoundError:  # pragma: no cover
+                    pass
+
+        total_size = sum(f[1] for f in files)
+
+        for mtime, size, path in sorted(files):
+            if total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # pragma: no cover
+                pass
+
+            total_size -= size
+
+    def _record_access(self, *, hit: bool, size: int):
+        with get_redis_connection().pipeline() as pipe:
+            if hit:
+                pipe.hincrby(self.STATS_KEY, "hits", 1)
+                pipe.hincrby(self.STATS_KEY, "bytes_saved", size)
+            else:
+                pipe.hincrby(self.STATS_KEY, "misses", 1)
+                pipe.hincrby(self.STATS_KEY, "bytes_downloaded", size)
+            pipe.execute()
+
+
+class PrefetchingRecordReader:
+    """
+    Reads the records of a sequence of archives in order, with the archives after the one being read fetched and
+    decompressed on a thread pool. Each archive's records are passed back in chunks through a bounded buffer so memory
+    use is limited to roughly (prefetch + 1) * buffer_size * chunk_size records.
+    """
+
+    _END = object()
+
+    def __init__(
+        self, archives, *, where: dict = None, prefetch: int = 2, chunk_size: int = 1000, buffer_size: int = 5
+    ):
+        assert prefetch > 0, "prefetch must be greater than zero"
+
+        self.archives = archives
+        self.where = where
+        self.prefetch = prefetch
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+
+    def __iter__(self):
+        archives = iter(self.archives)
+        buffers = deque()
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.prefetch + 1, thread_name_prefix="archive-reader")
+
+        def submit_next():
+            archive = next(archives, None)
+            if archive:
+                buffer = queue.Queue(maxsize=self.buffer_size)
+                executor.submit(self._read, archive, buffer, stop)
+                buffers.append(buffer)
+
+        try:
+            for i in range(self.prefetch + 1):
+                submit_next()
+
+            while buffers:
+                buffer = buffers.popleft()
+                submit_next()
+
+                while True:
+                    chunk = buffer.get()
+                    if chunk is self._END:
+                        break
+                    if isinstance(chunk, Exception):
+                        raise chunk
+
+                    yield from chunk
+        finally:
+            # if we're being closed early, workers will be blocked on full buffers, so tell them to give up
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _read(self, archive, buffer: queue.Queue, stop: threading.Event):
+        """
+        Reads the records of a single archive into the given buffer, run on a worker thread
+        """
+        try:
+            chunk = []
+            for record in archive.iter_records(where=self.where):
+                chunk.append(record)
+
+                if len(chunk) == self.chunk_size:
+                    if not self._put(buffer, chunk, stop):
+                        return
+                    chunk = []
+
+            if chunk and not self._put(buffer, chunk, stop):
+                return
+
+            self._put(buffer, self._END, stop)
+
+        except Exception as e:
+            self._put(buffer, e, stop)
+
+    @staticmethod
+    def _put(buffer: queue.Queue, item, stop: threading.Event) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
 def jsonlgz_iterate(in_file):
     """
     Iterates over a records in a gzipped JSONL stream
@@ -2,18 +2,21 @@ import base64
 import gzip
 import hashlib
 import io
+import os
+import tempfile
 from datetime import date, datetime
 from unittest.mock import call, patch
 
 import pytz
 
+from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils import timezone
 
-from temba.tests import CRUDLTestMixin, TembaTest
+from temba.tests import CRUDLTestMixin, TembaTest, matchers
 from temba.tests.s3 import MockS3Client
 
-from .models import Archive, jsonlgz_rewrite
+from .models import Archive, ArchiveCache, ArchiveIndexer, PrefetchingRecordReader, jsonlgz_rewrite
 
 
 class ArchiveTest(TembaTest):
@@ -157,6 +160,159 @@ class ArchiveTest(TembaTest):
             [4, 5],
         )
 
+        # same results without prefetching
+        assert_records(Archive.iter_all_records(self.org, Archive.TYPE_MSG, prefetch=0), [1, 2, 3, 4, 5, 6])
+        assert_records(
+            Archive.iter_all_records(self.org, Archive.TYPE_MSG, where={"contact__name": "Bob"}, prefetch=0),
+            [1, 4, 5, 6],
+        )
+
+    @patch("temba.utils.s3.client")
+    def test_index(self, mock_s3_client):
+        mock_s3 = MockS3Client()
+        mock_s3_client.return_value = mock_s3
+
+        flow1_uuid, flow2_uuid = "7f8d6a1b-9c2e-4d3f-8a5b-1c2d3e4f5a6b", "0a1b2c3d-4e5f-4a6b-8c7d-9e0f1a2b3c4d"
+        bob_uuid, jim_uuid = "b7d1a2c3-5e6f-4a7b-9c8d-0e1f2a3b4c5d", "c8e2b3d4-6f7a-4b8c-8d9e-1f2a3b4c5d6e"
+        label_uuid = "d9f3c4e5-7a8b-4c9d-8e0f-2a3b4c5d6e7f"
+
+        archive1 = self.create_archive(
+            Archive.TYPE_MSG,
+            "D",
+            date(2020, 8, 1),
+            [
+                {
+                    "id": 1,
+                    "created_on": "2020-08-01T10:00:00Z",
+                    "modified_on": "2020-08-01T10:00:00Z",
+                    "contact": {"uuid": bob_uuid, "name": "Bob"},
+                    "flow": {"uuid": flow1_uuid, "name": "Registration"},
+                    "labels": [{"uuid": label_uuid, "name": "Spam"}],
+                },
+                {
+                    "id": 2,
+                    "created_on": "2020-08-01T15:00:00Z",
+                    "modified_on": "2020-08-02T09:00:00Z",
+                    "contact": {"uuid": bob_uuid, "name": "Bob"},
+                    "flow": None,
+                    "labels": [],
+                },
+            ],
+            s3=mock_s3,
+        )
+        archive2 = self.create_archive(
+            Archive.TYPE_MSG,
+            "D",
+            date(2020, 8, 2),
+            [
+                {
+                    "id": 3,
+                    "created_on": "2020-08-02T10:00:00Z",
+                    "modified_on": "2020-08-03T10:00:00Z",
+                    "contact": {"uuid": jim_uuid, "name": "Jim"},
+                    "flow": {"uuid": flow2_uuid, "name": "Survey"},
+                    "labels": [],
+                }
+            ],
+            s3=mock_s3,
+        )
+        archive3 = self.create_archive(Archive.TYPE_MSG, "D", date(2020, 8, 3), [], s3=mock_s3)
+
+        # archives without indexes can match anything
+        self.assertTrue(archive1.can_match({"flow__uuid": flow2_uuid}))
+
+        archive1.rebuild_index()
+        archive2.rebuild_index()
+        archive3.rebuild_index()
+
+        archive1.refresh_from_db()
+        self.assertEqual([flow1_uuid], archive1.index["flow_uuids"])
+        self.assertEqual(2, archive1.index["record_count"])
+        self.assertEqual([label_uuid], archive1.index["label_uuids"])
+        self.assertEqual(["2020-08-01T10:00:00+00:00", "2020-08-02T09:00:00+00:00"], archive1.index["modified_on"])
+
+        self.assertTrue(archive1.can_match(None))
+        self.assertTrue(archive1.can_match({"flow__uuid": flow1_uuid}))
+        self.assertFalse(archive1.can_match({"flow__uuid": flow2_uuid}))
+        self.assertTrue(archive1.can_match({"flow__uuid__in": [flow1_uuid, flow2_uuid]}))
+        self.assertTrue(archive1.can_match({"contact__uuid": bob_uuid}))
+        self.assertFalse(archive1.can_match({"contact__uuid": jim_uuid}))
+        self.assertTrue(archive1.can_match({"contact__uuid__in": [jim_uuid, bob_uuid]}))
+        self.assertTrue(archive1.can_match({"__raw__": f"'{label_uuid}' IN s.labels[*].uuid[*]"}))
+        self.assertFalse(archive2.can_match({"__raw__": f"'{label_uuid}' IN s.labels[*].uuid[*]"}))
+        self.assertTrue(archive2.can_match({"__raw__": "s.direction = 'in'"}))  # can't tell so must read
+        self.assertTrue(archive1.can_match({"modified_on__gte": datetime(2020, 8, 2, 9, 0, 0, 0, pytz.UTC)}))
+        self.assertFalse(archive1.can_match({"modified_on__gt": datetime(2020, 8, 2, 9, 0, 0, 0, pytz.UTC)}))
+        self.assertTrue(archive1.can_match({"modified_on__lte": datetime(2020, 8, 1, 10, 0, 0, 0, pytz.UTC)}))
+        self.assertFalse(archive1.can_match({"modified_on__lt": datetime(2020, 8, 1, 10, 0, 0, 0, pytz.UTC)}))
+        self.assertTrue(archive1.can_match({"contact__name": "Jim"}))
+        self.assertFalse(archive3.can_match({"contact__name": "Jim"}))
+
+        # only the archive which can match is read
+        mock_s3.calls.clear()
+
+        records = Archive.iter_all_records(self.org, Archive.TYPE_MSG, where={"contact__uuid": jim_uuid}, prefetch=0)
+        self.assertEqual([3], [r["id"] for r in records])
+        self.assertEqual(1, len(mock_s3.calls["select_object_content"]))
+
+        records = Archive.iter_all_records(
+            self.org, Archive.TYPE_MSG, where={"__raw__": f"'{label_uuid}' IN s.labels[*].uuid[*]"}
+        )
+        self.assertEqual([1], [r["id"] for r in records])
+        self.assertEqual(2, len(mock_s3.calls["select_object_content"]))
+
+        # rewriting an archive updates its index
+        archive1.rewrite(lambda r: r if r["id"] != 1 else None)
+        archive1.refresh_from_db()
+
+        self.assertEqual([], archive1.index["flow_uuids"])
+        self.assertEqual([], archive1.index["label_uuids"])
+        self.assertEqual(["2020-08-02T09:00:00+00:00", "2020-08-02T09:00:00+00:00"], archive1.index["modified_on"])
+
+    def test_indexer(self):
+        indexer = ArchiveIndexer()
+        self.assertEqual(
+            {
+                "record_count": 0,
+                "flow_uuids": [],
+                "label_uuids": [],
+                "contact_uuids": matchers.Dict(),
+                "modified_on": None,
+            },
+            indexer.build(),
+        )
+
+    @patch("temba.utils.s3.client")
+    def test_prefetching_record_reader(self, mock_s3_client):
+        mock_s3 = MockS3Client()
+        mock_s3_client.return_value = mock_s3
+
+        for d in range(1, 6):
+            self.create_archive(
+                Archive.TYPE_MSG, "D", date(2020, 8, d), [{"id": d * 10 + i} for i in range(5)], s3=mock_s3
+            )
+
+        archives = Archive.objects.filter(org=self.org).order_by("start_date")
+        expected = [d * 10 + i for d in range(1, 6) for i in range(5)]
+
+        # order is preserved regardless of how small the chunks and buffers are
+        for prefetch in (1, 2, 10):
+            reader = PrefetchingRecordReader(archives, prefetch=prefetch, chunk_size=2, buffer_size=1)
+            self.assertEqual(expected, [r["id"] for r in reader])
+
+        reader = PrefetchingRecordReader(archives, where={"id__gt": 33}, prefetch=2, chunk_size=2, buffer_size=1)
+        self.assertEqual([34, 40, 41, 42, 43, 44, 50, 51, 52, 53, 54], [r["id"] for r in reader])
+
+        # closing the iterator early stops the workers
+        records = iter(PrefetchingRecordReader(archives, prefetch=3, chunk_size=1, buffer_size=1))
+        self.assertEqual({"id": 10}, next(records))
+        records.close()
+
+        # errors from workers are raised by the reader
+        with patch("temba.archives.models.Archive.iter_records", side_effect=ValueError("boom")):
+            with self.assertRaises(ValueError):
+                list(PrefetchingRecordReader(archives, prefetch=2))
+
     def test_end_date(self):
         daily = self.create_archive(Archive.TYPE_FLOWRUN, "D", date(2018, 2, 1), [], needs_deletion=True)
         monthly = self.create_archive(Archive.TYPE_FLOWRUN, "M", date(2018, 1, 1), [])
@@ -213,6 +369,99 @@ class ArchiveTest(TembaTest):
         self.assertEqual([call(Bucket="s3-bucket", Key=key)], mock_s3.calls["delete_object"])
 
 
+class ArchiveCacheTest(TembaTest):
+    @patch("temba.utils.s3.client")
+    def test_cache(self, mock_s3_client):
+        mock_s3 = MockS3Client()
+        mock_s3_client.return_value = mock_s3
+
+        archive1 = self.create_archive(
+            Archive.TYPE_FLOWRUN,
+            "D",
+            date(2020, 8, 1),
+            [
+                {"id": 1, "created_on": "2020-08-01T09:00:00Z", "contact": {"name": "Bob"}},
+                {"id": 2, "created_on": "2020-08-01T10:00:00Z", "contact": {"name": "Jim"}},
+            ],
+            s3=mock_s3,
+        )
+        archive2 = self.create_archive(
+            Archive.TYPE_FLOWRUN, "D", date(2020, 8, 2), [{"id": 3, "contact": {"name": "Ann"}}], s3=mock_s3
+        )
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with override_settings(ARCHIVE_CACHE_DIR=cache_dir):
+                # first read downloads the archive
+                self.assertEqual([1, 2], [r["id"] for r in archive1.iter_records()])
+                self.assertEqual(1, len(mock_s3.calls["get_object"]))
+                self.assertTrue(os.path.exists(os.path.join(cache_dir, f"{archive1.hash}.jsonl.gz")))
+
+                # subsequent reads come from the cache, with filtering done locally
+                self.assertEqual([1, 2], [r["id"] for r in archive1.iter_records()])
+                self.assertEqual([2], [r["id"] for r in archive1.iter_records(where={"contact__name": "Jim"})])
+                self.assertEqual(1, len(mock_s3.calls["get_object"]))
+                self.assertEqual(0, len(mock_s3.calls["select_object_content"]))
+
+                # except when there are raw conditions
+                self.assertEqual([1], [r["id"] for r in archive1.iter_records(where={"__raw__": "s.id < 2"})])
+                self.assertEqual(1, len(mock_s3.calls["select_object_content"]))
+
+                self.assertEqual(
+                    {
+                        "hits": 2,
+                        "misses": 1,
+                        "hit_rate": 2 / 3,
+                        "bytes_saved": archive1.size * 2,
+                        "bytes_downloaded": archive1.size,
+                    },
+                    ArchiveCache.get_stats(),
+                )
+
+                opened = []
+                real_open = ArchiveCache.open
+
+                def tracking_open(cache, archive):
+                    opened.append(real_open(cache, archive))
+                    return opened[-1]
+
+                with patch.object(ArchiveCache, "open", tracking_open):
+                    # files opened from the cache are closed when reading finishes or is abandoned
+                    list(archive1.iter_records())
+                    records = archive1.iter_records()
+                    next(records)
+                    records.close()
+
+                    # rewriting reads from the cache too
+                    old_hash = archive1.hash
+                    archive1.rewrite(lambda r: r if r["contact"]["name"] != "Jim" else None)
+                    self.assertEqual(1, len(mock_s3.calls["get_object"]))
+
+                self.assertEqual(3, len(opened))
+                self.assertTrue(all(f.closed for f in opened))
+
+            # a cache only large enough for one archive evicts the least recently used
+            cache = ArchiveCache(cache_dir, max_size=archive2.size + 1)
+            old_path = os.path.join(cache_dir, f"{old_hash}.jsonl.gz")
+            os.utime(old_path, (0, 0))
+
+            cache.open(archive2).close()
+
+            self.assertFalse(os.path.exists(old_path))
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, f"{archive2.hash}.jsonl.gz")))
+            self.assertEqual(2, len(mock_s3.calls["get_object"]))
+
+            # a download which doesn't match the archive's hash is discarded
+            archive2.hash = "0" * 32
+            with self.assertRaises(ValueError):
+                cache.open(archive2)
+
+            self.assertEqual([], [f for f in os.listdir(cache_dir) if f.endswith(".tmp")])
+            self.assertFalse(os.path.exists(os.path.join(cache_dir, f"{archive2.hash}.jsonl.gz")))
+
+    def test_disabled(self):
+        self.assertIsNone(ArchiveCache.get())
+
+
 class ArchiveCRUDLTest(TembaTest, CRUDLTestMixin):
     def test_empty_list(self):
         response = self.assertListFetch(
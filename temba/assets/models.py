@@ -76,8 +76,8 @@ class BaseAssetStore:
         if not default_storage.exists(path):  # pragma: needs cover
             raise AssetFileNotFound()
 
-        # create a more friendly download filename
-        remainder, extension = path.rsplit(".", 1)
+        # create a more friendly download filename, allowing for compound extensions like .csv.gz
+        extension = next((e for e in self.extensions if path.endswith(f".{e}")), path.rsplit(".", 1)[1])
         filename = f"{self.key}_{pk}_{slugify(asset.org.name)}.{extension}"
 
         # if our storage backend is S3
@@ -175,6 +175,7 @@ class Campaign(TembaModel):
                 event.flow.restore(user)
 
             campaign.schedule_events_async()
+            campaign.org.invalidate_dependency_graph()
 
     def get_events(self):
         return self.events.filter(is_active=True).order_by("id")
@@ -1027,6 +1027,7 @@ class ChannelCount(SquashableModel):
     """
 
     squash_over = ("channel_id", "count_type", "day")
+    squash_batch_size = 1000
 
     INCOMING_MSG_TYPE = "IM"  # Incoming message
     OUTGOING_MSG_TYPE = "OM"  # Outgoing message
@@ -13,7 +13,7 @@ from temba import mailroom
 from temba.orgs.models import Org
 from temba.utils import chunk_list
 from temba.utils.analytics import track
-from temba.utils.celery import nonoverlapping_task
+from temba.utils.celery import nonoverlapping_task, record_rows
 
 from .models import Alert, Channel, ChannelCount, ChannelLog, SyncEvent
 
@@ -96,6 +96,7 @@ def trim_channel_log_task():
     ids = ChannelLog.objects.filter(created_on__lte=trim_before).values_list("id", flat=True)
     for chunk in chunk_list(ids, 1000):
         ChannelLog.objects.filter(id__in=chunk).delete()
+        record_rows(len(chunk))
 
 
 @nonoverlapping_task(
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.7 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contacts", "0170_exportcontactstask_file_format"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="contactimport",
+            name="timings",
+            field=models.JSONField(default=dict),
+        ),
+    ]
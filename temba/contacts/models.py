@@ -1,8 +1,12 @@
+import heapq
 import logging
 import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from datetime import date, datetime, timedelta
 from decimal import Decimal
-from itertools import chain
+from itertools import islice
 from pathlib import Path
 from typing import Any
 
@@ -20,6 +24,8 @@ from django.core.validators import validate_email
 from django.db import IntegrityError, models, transaction
 from django.db.models import Count, F, Max, Q, Sum, Value
 from django.db.models.functions import Concat, Lower
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -30,17 +36,36 @@ from temba.locations.models import AdminBoundary
 from temba.mailroom import ContactSpec, modifiers, queue_populate_dynamic_group
 from temba.orgs.models import DependencyMixin, Org
 from temba.utils import chunk_list, format_number, on_transaction_commit
-from temba.utils.export import BaseExport, BaseExportAssetStore, MultiSheetExporter
-from temba.utils.models import JSONField, LegacyUUIDMixin, SquashableModel, TembaModel
+from temba.utils.export import BaseExport, BaseExportAssetStore
+from temba.utils.models import JSONField, LegacyUUIDMixin, SquashableModel, TembaModel, iter_keyset_batches
 from temba.utils.text import decode_stream, unsnakify
 from temba.utils.urns import ParsedURN, parse_number, parse_urn
 from temba.utils.uuid import uuid4
 
-from .search import SearchException, elastic, parse_query
+from .search import SearchException, SearchSession, elastic, parse_query
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class NormalizedURN:
+    urn: str = None  # the normalized URN or None if it couldn't be normalized
+    identity: str = None  # the normalized URN without any display or query
+    error: str = None
+
+
+def _normalize_urn(urn: str, country_code: str, validate: bool) -> NormalizedURN:
+    try:
+        normalized = URN.normalize(urn, country_code)
+        scheme, path, query, display = URN.to_parts(normalized)
+    except ValueError as e:
+        return NormalizedURN(error=str(e))
+
+    error = None if not validate or URN.validate(normalized, country_code) else "invalid URN"
+
+    return NormalizedURN(urn=normalized, identity=URN.from_parts(scheme, path), error=error)
+
+
 class URN:
     """
     Support class for URN strings. We differ from the strict definition of a URN (https://tools.ietf.org/html/rfc2141)
@@ -97,6 +122,8 @@ class URN:
 
     VALID_SCHEMES = {s[0] for s in SCHEME_CHOICES}
 
+    NORMALIZE_POOL_THRESHOLD = 1000  # fewer distinct URNs than this aren't worth sending to a process pool
+
     FACEBOOK_PATH_REF_PREFIX = "ref:"
 
     def __init__(self):  # pragma: no cover
@@ -260,6 +287,34 @@ class URN:
 
         return cls.from_parts(scheme, norm_path, query, display)
 
+    @classmethod
+    def normalize_all(cls, urns, country_code=None, *, validate=False, processes=0) -> list:
+        """
+        Normalizes and optionally validates a list of URN strings, returning a NormalizedURN for each. Identical URNs
+        are only normalized once and if processes is given, distinct URNs are normalized across a pool of processes.
+        """
+        distinct = list(dict.fromkeys(urns))
+        country_code = str(country_code) if country_code else ""
+
+        if processes > 1 and len(distinct) >= cls.NORMALIZE_POOL_THRESHOLD:
+            chunksize = -(-len(distinct) // (processes * 4))
+
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = list(
+                    executor.map(
+                        _normalize_urn,
+                        distinct,
+                        [country_code] * len(distinct),
+                        [validate] * len(distinct),
+                        chunksize=chunksize,
+                    )
+                )
+        else:
+            results = [_normalize_urn(urn, country_code, validate) for urn in distinct]
+
+        by_urn = dict(zip(distinct, results))
+        return [by_urn[urn] for urn in urns]
+
     @classmethod
     def normalize_number(cls, number: str, country_code: str):
         """
@@ -643,6 +698,9 @@ class Contact(LegacyUUIDMixin, SmartModel):
             user.id,
             ContactSpec(name=name, language=language, urns=urns, fields=fields_by_key, groups=group_uuids),
         )
+
+        SearchSession.invalidate(org)
+
         return Contact.objects.get(id=response["contact"]["id"])
 
     @classmethod
@@ -709,15 +767,22 @@ class Contact(LegacyUUIDMixin, SmartModel):
             .select_related("schedule")
         )
 
-    def get_scheduled(self, *, reverse: bool = False) -> list:
+    def get_scheduled(self, *, reverse: bool = False, days: int = None) -> list:
         """
-        Gets this contact's upcoming scheduled events
+        Gets this contact's upcoming scheduled events. If days is given, only events in that many days are included and
+        repeating broadcasts and triggers are included for every time they will fire in that period.
         """
         from temba.campaigns.models import CampaignEvent
+        from temba.schedules.models import Schedule
+
+        now = timezone.now()
+        until = now + timedelta(days=days) if days else None
 
         fires = self.campaign_fires.filter(
-            event__is_active=True, event__campaign__is_archived=False, scheduled__gte=timezone.now()
+            event__is_active=True, event__campaign__is_archived=False, scheduled__gte=now
         ).select_related("event", "event__flow", "event__campaign")
+        if until:
+            fires = fires.filter(scheduled__lt=until)
 
         merged = []
         for fire in fires:
@@ -734,25 +799,36 @@ class Contact(LegacyUUIDMixin, SmartModel):
 
             merged.append(obj)
 
-        for broadcast in self.get_scheduled_broadcasts():
-            merged.append(
-                {
-                    "type": "scheduled_broadcast",
-                    "scheduled": broadcast.schedule.next_fire.isoformat(),
-                    "repeat_period": broadcast.schedule.repeat_period,
-                    "message": broadcast.get_text(self),
-                }
-            )
+        broadcasts = list(self.get_scheduled_broadcasts())
+        triggers = list(self.get_scheduled_triggers())
+        schedules = [b.schedule for b in broadcasts] + [t.schedule for t in triggers]
 
-        for trigger in self.get_scheduled_triggers():
-            merged.append(
-                {
-                    "type": "scheduled_trigger",
-                    "scheduled": trigger.schedule.next_fire.isoformat(),
-                    "repeat_period": trigger.schedule.repeat_period,
-                    "flow": trigger.flow.as_export_ref(),
-                }
-            )
+        if until:
+            fire_times = Schedule.get_fire_times(schedules, now, until)
+        else:
+            fire_times = {s.id: [s.next_fire] for s in schedules}
+
+        for broadcast in broadcasts:
+            for fire_time in fire_times[broadcast.schedule.id]:
+                merged.append(
+                    {
+                        "type": "scheduled_broadcast",
+                        "scheduled": fire_time.astimezone(timezone.utc).isoformat(),
+                        "repeat_period": broadcast.schedule.repeat_period,
+                        "message": broadcast.get_text(self),
+                    }
+                )
+
+        for trigger in triggers:
+            for fire_time in fire_times[trigger.schedule.id]:
+                merged.append(
+                    {
+                        "type": "scheduled_trigger",
+                        "scheduled": fire_time.astimezone(timezone.utc).isoformat(),
+                        "repeat_period": trigger.schedule.repeat_period,
+                        "flow": trigger.flow.as_export_ref(),
+                    }
+                )
 
         return sorted(merged, key=lambda k: k["scheduled"], reverse=reverse)
 
@@ -828,39 +904,39 @@ class Contact(LegacyUUIDMixin, SmartModel):
 
         session_events = self.get_session_events(after, before, include_event_types)
 
-        # chain all items together, sort by their event time, and slice
-        items = chain(
+        # each source is already ordered newest first, so merge them, stopping once we have enough items
+        items = heapq.merge(
             msgs,
             started_runs,
-            exited_runs,
+            sorted(exited_runs, key=get_event_time, reverse=True),
             ticket_events,
             channel_events,
             campaign_events,
             calls,
             transfers,
             session_events,
+            key=get_event_time,
+            reverse=True,
         )
 
-        # sort and slice
-        return sorted(items, key=get_event_time, reverse=True)[:limit]
+        return list(islice(items, limit))
 
     def get_session_events(self, after: datetime, before: datetime, types: set) -> list:
         """
-        Extracts events from this contacts sessions that overlap with the given time window
+        Extracts events from this contacts sessions that overlap with the given time window, newest first
         """
         sessions = self.sessions.filter(
             Q(created_on__gte=after, created_on__lt=before) | Q(ended_on__gte=after, ended_on__lt=before)
         )
         events = []
         for session in sessions:
-            for run in session.output_json.get("runs", []):
-                for event in run.get("events", []):
-                    event["session_uuid"] = str(session.uuid)
+            for event in session.get_events():
+                if event["type"] in types:
                     event_time = iso8601.parse_date(event["created_on"])
-                    if event["type"] in types and after <= event_time < before:
-                        events.append(event)
+                    if after <= event_time < before:
+                        events.append((event_time, event))
 
-        return events
+        return [e for t, e in sorted(events, key=lambda e: e[0], reverse=True)]
 
     def get_field_json(self, field):
         """
@@ -903,6 +979,10 @@ class Contact(LegacyUUIDMixin, SmartModel):
             elif field.value_type == ContactField.TYPE_NUMBER:
                 return Decimal(string_value)
             elif field.value_type in [ContactField.TYPE_STATE, ContactField.TYPE_DISTRICT, ContactField.TYPE_WARD]:
+                boundaries = getattr(self, "_boundaries_cache", None)
+                if boundaries is not None and string_value in boundaries:
+                    return boundaries[string_value]
+
                 return AdminBoundary.get_by_path(self.org, string_value)
 
         else:
@@ -1006,6 +1086,8 @@ class Contact(LegacyUUIDMixin, SmartModel):
             logger.error(f"Contact update failed: {str(e)}", exc_info=True)
             raise e
 
+        SearchSession.invalidate(org)
+
         def modified(contact):
             return len(response.get(contact.id, {}).get("events", [])) > 0
 
@@ -1141,6 +1223,8 @@ class Contact(LegacyUUIDMixin, SmartModel):
             self.modified_by = user
             self.save(update_fields=("name", "is_active", "fields", "modified_by", "modified_on"))
 
+        on_transaction_commit(lambda: SearchSession.invalidate(self.org))
+
         # the hard work of removing everything this contact owns can be given to a celery task
         if immediately:
             self._full_release()
@@ -1219,6 +1303,27 @@ class Contact(LegacyUUIDMixin, SmartModel):
             urn.org = contact.org
             getattr(contact, "_urns_cache").append(urn)
 
+    @classmethod
+    def bulk_boundary_cache_initialize(cls, org, contacts, fields):
+        """
+        Initializes the location caches on the given contacts by resolving the values of the given fields in one go
+        """
+        location_types = (ContactField.TYPE_STATE, ContactField.TYPE_DISTRICT, ContactField.TYPE_WARD)
+        fields = [f for f in fields if not f.is_system and f.value_type in location_types]
+        if not contacts or not fields:
+            return
+
+        paths = set()
+        for contact in contacts:
+            for field in fields:
+                path = contact.get_field_serialized(field)
+                if path:
+                    paths.add(path)
+
+        boundaries = AdminBoundary.get_by_paths(org, paths)
+        for contact in contacts:
+            setattr(contact, "_boundaries_cache", boundaries)
+
     def get_groups(self, *, manual_only=False):
         """
         Gets the groups that this contact is a member of, excluding the status groups.
@@ -1783,6 +1888,7 @@ class ContactGroupCount(SquashableModel):
     """
 
     squash_over = ("group_id",)
+    squash_batch_size = 1000
 
     group = models.ForeignKey(ContactGroup, on_delete=models.PROTECT, related_name="counts", db_index=True)
     count = models.IntegerField(default=0)
@@ -1840,8 +1946,10 @@ class ExportContactsTask(BaseExport):
     search = models.TextField(null=True, blank=True, help_text=_("The search query"))
 
     @classmethod
-    def create(cls, org, user, group=None, search=None, group_memberships=()):
-        export = cls.objects.create(org=org, group=group, search=search, created_by=user, modified_by=user)
+    def create(cls, org, user, group=None, search=None, group_memberships=(), file_format=BaseExport.FORMAT_XLSX):
+        export = cls.objects.create(
+            org=org, group=group, search=search, file_format=file_format, created_by=user, modified_by=user
+        )
         export.group_memberships.add(*group_memberships)
         return export
 
@@ -1918,21 +2026,21 @@ class ExportContactsTask(BaseExport):
 
         include_group_memberships = bool(self.group_memberships.exists())
 
+        # stream contact ids in pages rather than loading them all, so we only have an estimate of the total. Pages are
+        # keyed on (name, id) to keep exports in name order.
         if self.search:
-            contact_ids = elastic.query_contact_ids(self.org, self.search, group=group)
+            estimated_total, id_batches = elastic.query_contact_id_batches(self.org, self.search, group=group)
         else:
-            contact_ids = group.contacts.order_by("name", "id").values_list("id", flat=True)
+            estimated_total, id_batches = None, iter_keyset_batches(group.contacts.using("readonly"), "name")
 
         # create our exporter
-        exporter = MultiSheetExporter(
-            "Contact", [f["label"] for f in fields] + [g["label"] for g in group_fields], self.org.timezone
-        )
+        exporter = self.get_exporter("Contact", [f["label"] for f in fields] + [g["label"] for g in group_fields])
 
         total_exported_contacts = 0
         start = time.time()
 
         # write out contacts in batches to limit memory usage
-        for batch_ids in chunk_list(contact_ids, 1000):
+        for batch_ids in id_batches:
             # fetch all the contacts for our batch
             batch_contacts = (
                 Contact.objects.filter(id__in=batch_ids).prefetch_related("org", "groups").using("readonly")
@@ -1942,6 +2050,9 @@ class ExportContactsTask(BaseExport):
             contact_by_id = {c.id: c for c in batch_contacts}
 
             Contact.bulk_urn_cache_initialize(batch_contacts, using="readonly")
+            Contact.bulk_boundary_cache_initialize(
+                self.org, batch_contacts, [f["field"] for f in fields if f["field"]]
+            )
 
             for contact_id in batch_ids:
                 contact = contact_by_id[contact_id]
@@ -1963,16 +2074,20 @@ class ExportContactsTask(BaseExport):
 
                 # output some status information every 10,000 contacts
                 if total_exported_contacts % ExportContactsTask.LOG_PROGRESS_PER_ROWS == 0:
+                    if estimated_total is None:
+                        estimated_total = group.get_member_count()
+                    estimated_total = max(estimated_total, total_exported_contacts)
+
                     elapsed = time.time() - start
-                    predicted = elapsed // (total_exported_contacts / len(contact_ids))
+                    predicted = elapsed // (total_exported_contacts / estimated_total)
 
                     logger.info(
                         "Export of %s contacts - %d%% (%s/%s) complete in %0.2fs (predicted %0.0fs)"
                         % (
                             self.org.name,
-                            total_exported_contacts * 100 // len(contact_ids),
+                            total_exported_contacts * 100 // estimated_total,
                             "{:,}".format(total_exported_contacts),
-                            "{:,}".format(len(contact_ids)),
+                            "{:,}".format(estimated_total),
                             time.time() - start,
                             predicted,
                         )
@@ -2023,6 +2138,7 @@ def get_import_upload_path(instance: Any, filename: str):
 class ContactImport(SmartModel):
     MAX_RECORDS = 25_000
     BATCH_SIZE = 100
+    NORMALIZE_CHUNK_SIZE = 10_000  # number of rows whose URNs are normalized together
     EXPLICIT_CLEAR = "--"
 
     # how many sequential URNs triggers flagging
@@ -2051,6 +2167,7 @@ class ContactImport(SmartModel):
     started_on = models.DateTimeField(null=True)
     status = models.CharField(max_length=1, default=STATUS_PENDING, choices=STATUS_CHOICES)
     finished_on = models.DateTimeField(null=True)
+    timings = models.JSONField(default=dict)  # milliseconds spent in each stage of starting
 
     @classmethod
     def try_to_parse(cls, org: Org, file, filename: str) -> tuple[list, int]:
@@ -2261,50 +2378,113 @@ class ContactImport(SmartModel):
         # parse each row, creating batch tasks for mailroom
         data = pyexcel.iget_array(file_stream=file, file_type=file_type, start_row=1)
 
+        # set redis key which mailroom batch tasks can decrement to know when import has completed, holding an extra
+        # count of our own so that batches which complete while we're still parsing can't complete the import
+        r = get_redis_connection()
+        remaining_key = f"contact_import_batches_remaining:{self.id}"
+        r.set(remaining_key, 1, ex=24 * 60 * 60)
+
         urns = []
-        batches = []
+        timings = defaultdict(float)
 
-        for batch_specs, batch_start, batch_end in self._batches_generator(data):
-            batches.append(self.batches.create(specs=batch_specs, record_start=batch_start, record_end=batch_end))
+        # each batch is queued as soon as it's created so mailroom can start on it while we parse the rest
+        completed = False
+        try:
+            for batch_specs, batch_start, batch_end in self._batches_generator(data, timings):
+                start = time.perf_counter()
+                batch = self.batches.create(specs=batch_specs, record_start=batch_start, record_end=batch_end)
+                timings["db"] += time.perf_counter() - start
 
-            for spec in batch_specs:
-                urns.extend(spec.get("urns", []))
+                start = time.perf_counter()
+                r.incr(remaining_key)
+                batch.import_async()
+                timings["queue"] += time.perf_counter() - start
 
-        # set redis key which mailroom batch tasks can decrement to know when import has completed
-        r = get_redis_connection()
-        r.set(f"contact_import_batches_remaining:{self.id}", len(batches), ex=24 * 60 * 60)
+                for spec in batch_specs:
+                    urns.extend(spec.get("urns", []))
 
-        # start each batch...
-        for batch in batches:
-            batch.import_async()
+            completed = True
+        finally:
+            if not completed:
+                # mailroom will still import any batches already queued, but without the key they can't complete us
+                r.delete(remaining_key)
+                self._fail()
+
+        self.timings = {stage: int(secs * 1000) for stage, secs in timings.items()}
+        self.save(update_fields=("timings",))
+
+        # release our own count, and if every batch already completed, it's up to us to complete the import
+        if r.decr(remaining_key) == 0:
+            self._complete()
 
         # flag org if the set of imported URNs looks suspicious
         if not self.org.is_verified() and self._detect_spamminess(urns):
             self.org.flag()
 
-    def _batches_generator(self, row_iter):
+    def _complete(self):
+        """
+        Marks this import as complete. Normally done by mailroom when it completes the last batch.
+        """
+        from temba.notifications.models import Notification
+
+        self.status = self.STATUS_COMPLETE
+        self.finished_on = timezone.now()
+        self.save(update_fields=("status", "finished_on"))
+
+        Notification.import_finished(self)
+
+    def _fail(self):
+        """
+        Marks this import as failed, e.g. because we couldn't parse all of its file
+        """
+        self.status = self.STATUS_FAILED
+        self.finished_on = timezone.now()
+        self.save(update_fields=("status", "finished_on"))
+
+    def _batches_generator(self, row_iter, timings: dict = None):
         """
         Generator which takes an iterable of raw rows and returns tuples of 1. a batches of specs, 2. the record index
-        at which the batch starts, 3. the record number at which the batch ends
+        at which the batch starts, 3. the record number at which the batch ends. If a timings dict is provided, the
+        seconds spent parsing rows and converting them to specs are added to it.
         """
+        timings = timings if timings is not None else defaultdict(float)
         record = 0
         batch_specs = []
         batch_start = record
         row = 1  # 1-based rows like Excel uses
 
-        for raw_row in row_iter:
-            row_data = self._parse_row(raw_row, len(self.mappings), tz=self.org.timezone)
-            spec = self._row_to_spec(row_data)
-            row += 1
-            if spec:
-                spec["_import_row"] = row
+        # rows are read in larger chunks so that their URNs can be normalized together
+        chunks = chunk_list(row_iter, ContactImport.NORMALIZE_CHUNK_SIZE)
+        while True:
+            start = time.perf_counter()
+            raw_rows = next(chunks, None)
+            if raw_rows is None:
+                break
+
+            rows = [self._parse_row(raw_row, len(self.mappings), tz=self.org.timezone) for raw_row in raw_rows]
+            timings["parse"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            chunk_specs = []
+
+            for row_data in rows:
+                spec = self._row_to_spec(row_data)
+                row += 1
+                if spec:
+                    spec["_import_row"] = row
+                    chunk_specs.append(spec)
+
+            self._normalize_urns(chunk_specs)
+            timings["spec"] += time.perf_counter() - start
+
+            for spec in chunk_specs:
                 batch_specs.append(spec)
                 record += 1
 
-            if len(batch_specs) == ContactImport.BATCH_SIZE:
-                yield batch_specs, batch_start, record
-                batch_specs = []
-                batch_start = record
+                if len(batch_specs) == ContactImport.BATCH_SIZE:
+                    yield batch_specs, batch_start, record
+                    batch_specs = []
+                    batch_start = record
 
         if batch_specs:
             yield batch_specs, batch_start, record
@@ -2388,12 +2568,7 @@ class ContactImport(SmartModel):
                 if value:
                     if "urns" not in spec:
                         spec["urns"] = []
-                    urn = URN.from_parts(scheme, value)
-                    try:
-                        urn = URN.normalize(urn, country_code=self.org.default_country_code)
-                    except ValueError:
-                        pass
-                    spec["urns"].append(urn)
+                    spec["urns"].append(URN.from_parts(scheme, value))  # normalized later with the rest of the chunk
 
             elif mapping["type"] in ("field", "new_field"):
                 if "fields" not in spec:
@@ -2407,6 +2582,20 @@ class ContactImport(SmartModel):
 
         return spec
 
+    def _normalize_urns(self, specs: list[dict]):
+        """
+        Normalizes the URNs in the given specs in place, leaving any which can't be normalized as they are
+        """
+        urns = [urn for spec in specs for urn in spec.get("urns", [])]
+        normalized = URN.normalize_all(
+            urns, self.org.default_country_code, processes=settings.CONTACT_IMPORT_URN_PROCESSES
+        )
+        normalized = iter(normalized)
+
+        for spec in specs:
+            if "urns" in spec:
+                spec["urns"] = [next(normalized).urn or urn for urn in spec["urns"]]
+
     @classmethod
     def _parse_row(cls, row: list[str], size: int, tz=None) -> list[str]:
         """
@@ -2515,4 +2704,13 @@ class ContactExportAssetStore(BaseExportAssetStore):
     key = "contact_export"
     directory = "contact_exports"
     permission = "contacts.contact_export"
-    extensions = ("xlsx", "csv")
+    extensions = ("xlsx", "csv", "csv.gz")
+
+
+@receiver(post_save, sender=ContactField)
+@receiver(post_delete, sender=ContactField)
+@receiver(post_save, sender=ContactGroup)
+@receiver(post_delete, sender=ContactGroup)
+def clear_parsed_queries_on_change(sender, **kwargs):
+    # parsed queries reference fields and groups so can't be reused once they've changed
+    on_transaction_commit(mailroom.parsed_queries.clear)
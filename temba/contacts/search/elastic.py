@@ -20,6 +20,40 @@ def query_contact_ids(org, query, *, group=None):
     return [int(r.id) for r in results.scan()]
 
 
+def query_contact_id_batches(org, query, *, group=None, batch_size=1000):
+    """
+    Returns an estimated total and an iterator over batches of contact ids for the given query, paging through results
+    ordered by id using search_after rather than materializing the whole result set
+    """
+    parsed = parse_query(org, query, group=group)
+    search = (
+        es_Search(index="contacts")
+        .source(include=["id"])
+        .params(routing=org.id)
+        .using(ES)
+        .query(parsed.elastic_query)
+        .sort("id")
+        .extra(size=batch_size)
+    )
+
+    first = search.extra(track_total_hits=True).execute()
+    total = getattr(first.hits, "total", None)
+    estimated_total = total.value if total else len(first.hits)
+
+    def iter_batches(response):
+        while True:
+            hits = list(response.hits)
+            if hits:
+                yield [int(h.id) for h in hits]
+
+            if len(hits) < batch_size:
+                break
+
+            response = search.extra(search_after=list(hits[-1].meta.sort)).execute()
+
+    return estimated_total, iter_batches(first)
+
+
 def get_last_modified():
     """
     Gets the last modified contact if there are any contacts
@@ -1,7 +1,14 @@
+import hashlib
+from dataclasses import asdict
+
+from django_redis import get_redis_connection
+
+from django.conf import settings
 from django.utils.encoding import force_str
 from django.utils.translation import gettext_lazy as _
 
 from temba import mailroom
+from temba.utils import json
 
 
 class SearchException(Exception):
@@ -66,6 +73,104 @@ def search_contacts(
         raise SearchException.from_mailroom_exception(e)
 
 
+class SearchSession:
+    """
+    Short lived cache of the pages of results of a contact search for a (org, group, query, sort) combination, so that
+    paging back and forth, re-sorting and bulk actions can reuse pages already fetched from mailroom. Sessions are keyed
+    by a per-org version which is bumped when contacts are changed from here, and pages aren't cached for a short time
+    after that so that results fetched before the search index has caught up with the change aren't reused.
+    """
+
+    KEY = "contact_search_session:%s"
+    VERSION_KEY = "contact_search_version:%d"
+    VERSION_TTL = 86400  # much longer than any session so a reset version can't match an old session
+    SETTLING_KEY = "contact_search_settling:%d"
+
+    def __init__(self, org, query: str, *, group=None, sort: str = None):
+        self.org = org
+        self.query = query
+        self.group = group
+        self.sort = sort
+
+        version, settling = get_redis_connection().mget(self.VERSION_KEY % org.id, self.SETTLING_KEY % org.id)
+        version = int(version or 0)
+        self.settling = bool(settling)
+
+        ident = f"{org.id}|{version}|{group.uuid if group else ''}|{query or ''}|{sort or ''}"
+        self.key = self.KEY % hashlib.md5(ident.encode()).hexdigest()
+
+    @classmethod
+    def invalidate(cls, org):
+        """
+        Invalidates all existing search sessions for the given org
+        """
+        key = cls.VERSION_KEY % org.id
+        settle = settings.CONTACT_SEARCH_SESSION_SETTLE
+
+        with get_redis_connection().pipeline() as pipe:
+            pipe.incr(key)
+            pipe.expire(key, cls.VERSION_TTL)
+            if settle:
+                pipe.set(cls.SETTLING_KEY % org.id, 1, ex=settle)
+            pipe.execute()
+
+    def search(self, *, offset: int = 0, exclude_ids=()) -> mailroom.SearchResults:
+        """
+        Gets the page of results at the given offset, from the session if it's there. Excluding contacts shifts every
+        page after them so in that case we always search and previously cached pages are discarded.
+        """
+        ttl = settings.CONTACT_SEARCH_SESSION_TTL
+        r = get_redis_connection()
+        page_field = f"page:{offset}"
+
+        if ttl and not exclude_ids:
+            cached = r.hget(self.key, page_field)
+            if cached:
+                r.hincrby(self.key, "hits", 1)
+                return self._deserialize(cached)
+
+        results = search_contacts(
+            self.org, self.query, group=self.group, sort=self.sort, offset=offset, exclude_ids=exclude_ids
+        )
+
+        if ttl:
+            with r.pipeline() as pipe:
+                if exclude_ids:
+                    stale = [f for f in r.hkeys(self.key) if f.startswith(b"page:")]
+                    if stale:
+                        pipe.hdel(self.key, *stale)
+
+                # pages fetched just after contacts were changed may not include those changes yet
+                if not self.settling:
+                    pipe.hset(self.key, page_field, self._serialize(results))
+                    pipe.expire(self.key, ttl)
+
+                pipe.execute()
+
+        return results
+
+    @property
+    def hits(self) -> int:
+        """
+        Gets the number of searches this session has saved
+        """
+        return int(get_redis_connection().hget(self.key, "hits") or 0)
+
+    @staticmethod
+    def _serialize(results: mailroom.SearchResults) -> str:
+        return json.dumps(asdict(results))
+
+    @staticmethod
+    def _deserialize(value: bytes) -> mailroom.SearchResults:
+        data = json.loads(value)
+        return mailroom.SearchResults(
+            query=data["query"],
+            total=data["total"],
+            contact_ids=data["contact_ids"],
+            metadata=mailroom.QueryMetadata(**data["metadata"]),
+        )
+
+
 def preview_start(
     org, flow, include: mailroom.QueryInclusions, exclude: mailroom.QueryExclusions, sample_size: int
 ) -> mailroom.StartPreview:
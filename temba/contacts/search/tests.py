@@ -1,7 +1,12 @@
+from django_redis import get_redis_connection
+
+from django.test.utils import override_settings
+
+from temba.contacts.models import Contact
 from temba.mailroom import MailroomException
 from temba.tests import TembaTest, mock_mailroom
 
-from . import SearchException, elastic
+from . import SearchException, SearchSession, elastic
 
 
 class SearchExceptionTest(TembaTest):
@@ -101,6 +106,98 @@ class SearchExceptionTest(TembaTest):
             self.assertEqual(message, str(e))
 
 
+class SearchSessionTest(TembaTest):
+    @mock_mailroom
+    def test_search(self, mr_mocks):
+        frank = self.create_contact("Frank", phone="+250788000001")
+        joe = self.create_contact("Joe", phone="+250788000002")
+
+        mr_mocks.contact_search("age > 18", cleaned="age > 18", contacts=[frank, joe], total=120, fields=["age"])
+
+        session = SearchSession(self.org, "age > 18", group=self.org.active_contacts_group, sort="-created_on")
+        self.assertEqual(0, session.hits)
+
+        results = session.search(offset=0)
+        self.assertEqual("age > 18", results.query)
+        self.assertEqual(120, results.total)
+        self.assertEqual([frank.id, joe.id], results.contact_ids)
+        self.assertEqual(1, len(mr_mocks.calls["contact_search"]))
+
+        # fetching the same page again is served from the session
+        self.assertEqual(results, session.search(offset=0))
+        self.assertEqual(1, len(mr_mocks.calls["contact_search"]))
+        self.assertEqual(1, session.hits)
+
+        # as it is for a new session for the same search
+        session2 = SearchSession(self.org, "age > 18", group=self.org.active_contacts_group, sort="-created_on")
+        self.assertEqual(results, session2.search(offset=0))
+        self.assertEqual(1, len(mr_mocks.calls["contact_search"]))
+        self.assertEqual(2, session2.hits)
+
+        # but not for a different page or sort
+        session.search(offset=50)
+        SearchSession(self.org, "age > 18", group=self.org.active_contacts_group, sort="name").search(offset=0)
+        self.assertEqual(3, len(mr_mocks.calls["contact_search"]))
+
+        # excluding contacts always searches and discards previously cached pages
+        session.search(offset=0, exclude_ids=[joe.id])
+        self.assertEqual(4, len(mr_mocks.calls["contact_search"]))
+
+        session.search(offset=50)
+        self.assertEqual(5, len(mr_mocks.calls["contact_search"]))
+
+        session.search(offset=0)
+        self.assertEqual(5, len(mr_mocks.calls["contact_search"]))
+        self.assertEqual(3, session.hits)
+
+        # unless sessions are disabled
+        with override_settings(CONTACT_SEARCH_SESSION_TTL=0):
+            session.search(offset=0)
+            self.assertEqual(6, len(mr_mocks.calls["contact_search"]))
+
+    @mock_mailroom
+    def test_invalidate(self, mr_mocks):
+        frank = self.create_contact("Frank", phone="+250788000001")
+
+        mr_mocks.contact_search("age > 18", cleaned="age > 18", contacts=[frank], total=1, fields=["age"])
+
+        def search(org):
+            SearchSession(org, "age > 18", group=org.active_contacts_group).search(offset=0)
+            return len(mr_mocks.calls["contact_search"])
+
+        self.assertEqual(1, search(self.org))
+        self.assertEqual(1, search(self.org))
+        self.assertEqual(2, search(self.org2))
+
+        # modifying a contact invalidates sessions for that org only
+        frank.block(self.admin)
+
+        self.assertEqual(3, search(self.org))
+        self.assertEqual(3, search(self.org2))
+
+        # and pages aren't cached until the search index has had time to catch up with the change
+        self.assertEqual(4, search(self.org))
+
+        get_redis_connection().delete(SearchSession.SETTLING_KEY % self.org.id)
+
+        self.assertEqual(5, search(self.org))
+        self.assertEqual(5, search(self.org))
+
+        # creating a contact also invalidates sessions
+        Contact.create(self.org, self.admin, "Joe", "eng", [], {}, [])
+
+        self.assertEqual(6, search(self.org))
+
+        get_redis_connection().delete(SearchSession.SETTLING_KEY % self.org.id)
+
+        # as does releasing one
+        with override_settings(CONTACT_SEARCH_SESSION_SETTLE=0):
+            frank.release(self.admin)
+
+        self.assertEqual(7, search(self.org))
+        self.assertEqual(7, search(self.org))
+
+
 class TestElastic(TembaTest):
     @mock_mailroom
     def test_query_elasticsearch_for_ids_bad_query(self, mr_mocks):
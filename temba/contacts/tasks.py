@@ -11,7 +11,7 @@ from django.utils import timezone
 from celery import shared_task
 
 from temba.utils import chunk_list
-from temba.utils.celery import nonoverlapping_task
+from temba.utils.celery import instrumented_task, nonoverlapping_task
 
 from .models import Contact, ContactGroup, ContactGroupCount, ContactImport, ExportContactsTask
 from .search import elastic
@@ -40,7 +40,7 @@ def import_contacts_task(import_id):
     ContactImport.objects.select_related("org", "created_by").get(id=import_id).start()
 
 
-@shared_task(track_started=True, name="export_contacts_task")
+@instrumented_task(track_started=True, name="export_contacts_task")
 def export_contacts_task(task_id):
     """
     Export contacts to a file and e-mail a link to the user
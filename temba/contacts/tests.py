@@ -8,6 +8,7 @@ from uuid import UUID
 
 import iso8601
 import pytz
+from django_redis import get_redis_connection
 from openpyxl import load_workbook
 
 from django.conf import settings
@@ -58,6 +59,7 @@ from .models import (
     ContactImportBatch,
     ContactURN,
     ExportContactsTask,
+    NormalizedURN,
 )
 from .tasks import check_elasticsearch_lag, squash_contactgroupcounts
 from .templatetags.contacts import contact_field, history_class, history_icon, msg_status_badge
@@ -173,6 +175,16 @@ class ContactCRUDLTest(CRUDLTestMixin, TembaTest):
         self.assertEqual(response.context["save_dynamic_search"], True)
         self.assertIsNone(response.context["search_error"])
         self.assertEqual(list(response.context["contact_fields"].values_list("name", flat=True)), ["Home", "Age"])
+        self.assertEqual(0, response.context["search_cache_hits"])
+
+        # requesting the same page of results again doesn't repeat the search
+        num_searches = len(mr_mocks.calls["contact_search"])
+
+        response = self.client.get(list_url + "?search=age+%3D+18")
+        self.assertEqual(list(response.context["object_list"]), [frank])
+        self.assertEqual(num_searches, len(mr_mocks.calls["contact_search"]))
+        self.assertEqual(1, response.context["search_cache_hits"])
+        self.assertContains(response, "Reused cached results for 1 page.")
 
         mr_mocks.contact_search("age = 18", contacts=[frank], total=10020)
 
@@ -659,6 +671,19 @@ class ContactCRUDLTest(CRUDLTestMixin, TembaTest):
             response.json(),
         )
 
+        # can also request events in the next N days, with repeating events included each time they fire
+        response = self.requestView(schedule_url + "?days=4", self.admin)
+        self.assertEqual(
+            ["campaign_event", "scheduled_broadcast", "scheduled_broadcast", "scheduled_trigger"],
+            [r["type"] for r in response.json()["results"]],
+        )
+        self.assertEqual(
+            bcast1.schedule.next_fire.astimezone(timezone.utc).isoformat(), response.json()["results"][1]["scheduled"]
+        )
+
+        response = self.requestView(schedule_url + "?days=xx", self.admin)
+        self.assertEqual(5, len(response.json()["results"]))
+
         # fires for archived campaigns shouldn't appear
         campaign.archive(self.admin)
 
@@ -1957,6 +1982,46 @@ class ContactTest(TembaTest):
             self.assertEqual(["tel:+250782222222"], [u.urn for u in self.frank.get_urns()])
             self.assertEqual([], [u.urn for u in self.billy.get_urns()])
 
+    def test_bulk_boundary_cache_initialize(self):
+        self.setUpLocations()
+
+        state = self.create_field("state", "State", value_type=ContactField.TYPE_STATE)
+        district = self.create_field("district", "District", value_type=ContactField.TYPE_DISTRICT)
+        color = self.create_field("color", "Color")
+
+        self.set_contact_field(self.joe, "state", "Kigali City")
+        self.set_contact_field(self.joe, "district", "Nyarugenge")
+        self.set_contact_field(self.frank, "state", "Eastern Province")
+        self.set_contact_field(self.frank, "color", "Red")
+
+        contacts = list(Contact.objects.filter(id__in=(self.joe.id, self.frank.id, self.billy.id)).order_by("id"))
+
+        with patch("temba.locations.models.AdminBoundary.get_by_paths", wraps=AdminBoundary.get_by_paths) as mock:
+            Contact.bulk_boundary_cache_initialize(self.org, contacts, [state, district, color])
+
+            # all location values resolved with a single lookup
+            self.assertEqual(1, mock.call_count)
+            self.assertEqual(
+                {"Rwanda > Kigali City", "Rwanda > Kigali City > Nyarugenge", "Rwanda > Eastern Province"},
+                set(mock.call_args[0][1]),
+            )
+
+        joe, frank, billy = contacts
+
+        with patch("temba.locations.models.AdminBoundary.get_by_path") as mock_get_by_path:
+            self.assertEqual(self.state1, joe.get_field_value(state))
+            self.assertEqual(self.district3, joe.get_field_value(district))
+            self.assertEqual(self.state2, frank.get_field_value(state))
+            self.assertIsNone(frank.get_field_value(district))
+            self.assertIsNone(billy.get_field_value(state))
+
+            mock_get_by_path.assert_not_called()
+
+        # no location fields means nothing to do
+        billy = Contact.objects.get(id=self.billy.id)
+        Contact.bulk_boundary_cache_initialize(self.org, [billy], [color])
+        self.assertFalse(hasattr(billy, "_boundaries_cache"))
+
     @patch("temba.contacts.search.omnibox.search_contacts")
     @mock_mailroom
     def test_omnibox(self, mr_mocks, mock_search_contacts):
@@ -5205,6 +5270,36 @@ class URNTest(TembaTest):
         # external ids are case sensitive
         self.assertEqual(URN.normalize("ext: eXterNAL123 "), "ext:eXterNAL123")
 
+    def test_normalize_all(self):
+        urns = ["tel:0788383383", "twitter: @jimmyJO", "xxxx", "tel:0788383383", "tel:MTN", "twitterid:12345#@jimmyJO"]
+
+        with patch("temba.contacts.models.URN.normalize", wraps=URN.normalize) as mock_normalize:
+            normalized = URN.normalize_all(urns, "RW")
+
+        # identical URNs are only normalized once
+        self.assertEqual(5, mock_normalize.call_count)
+        self.assertEqual(
+            [
+                NormalizedURN("tel:+250788383383", "tel:+250788383383"),
+                NormalizedURN("twitter:jimmyjo", "twitter:jimmyjo"),
+                NormalizedURN(error="URN strings must contain scheme and path components"),
+                NormalizedURN("tel:+250788383383", "tel:+250788383383"),
+                NormalizedURN("tel:mtn", "tel:mtn"),
+                NormalizedURN("twitterid:12345#jimmyjo", "twitterid:12345"),
+            ],
+            normalized,
+        )
+
+        # with validation
+        self.assertEqual(
+            [None, None, "URN strings must contain scheme and path components", None, "invalid URN", None],
+            [n.error for n in URN.normalize_all(urns, "RW", validate=True)],
+        )
+
+        # and fanned out across processes
+        with patch("temba.contacts.models.URN.NORMALIZE_POOL_THRESHOLD", 2):
+            self.assertEqual(normalized, URN.normalize_all(urns, "RW", processes=2))
+
     def test_validate(self):
         self.assertFalse(URN.validate("xxxx", None))  # un-parseable URNs don't validate
 
@@ -5853,6 +5948,60 @@ class ContactImportTest(TembaTest):
             imp.get_info(),
         )
 
+    @mock_mailroom
+    def test_batches_streamed(self, mr_mocks):
+        r = get_redis_connection()
+        queued = []
+
+        def import_async(batch):
+            # each batch should be queued before the next is even created
+            self.assertEqual(len(queued), batch.contact_import.batches.filter(id__lt=batch.id).count())
+            queued.append(batch.id)
+
+        with patch("temba.contacts.models.ContactImport.BATCH_SIZE", 2):
+            with patch("temba.contacts.models.ContactImportBatch.import_async", import_async):
+                imp = self.create_contact_import("media/test_imports/simple.xlsx")
+                imp.start()
+
+        self.assertEqual(list(imp.batches.order_by("id").values_list("id", flat=True)), queued)
+        self.assertEqual(2, int(r.get(f"contact_import_batches_remaining:{imp.id}")))
+        self.assertEqual({"parse", "spec", "db", "queue"}, set(imp.timings.keys()))
+        self.assertEqual("O", imp.status)
+
+        # simulate mailroom completing every batch while we're still parsing
+        def import_async_and_complete(batch):
+            r.decr(f"contact_import_batches_remaining:{batch.contact_import_id}")
+
+        with patch("temba.contacts.models.ContactImportBatch.import_async", import_async_and_complete):
+            imp = self.create_contact_import("media/test_imports/simple.xlsx")
+            imp.start()
+
+        # so we're the ones who complete the import
+        imp.refresh_from_db()
+        self.assertEqual("C", imp.status)
+        self.assertIsNotNone(imp.finished_on)
+        self.assertEqual(1, imp.notifications.filter(notification_type="import:finished", user=self.admin).count())
+
+        # simulate parsing failing after some batches have been queued
+        def failing_batches(imp, data, timings):
+            yield [{"name": "Bob"}], 0, 1
+            raise ValueError("boom")
+
+        with patch("temba.contacts.models.ContactImportBatch.import_async") as mock_import_async:
+            with patch("temba.contacts.models.ContactImport._batches_generator", failing_batches):
+                imp = self.create_contact_import("media/test_imports/simple.xlsx")
+
+                with self.assertRaises(ValueError):
+                    imp.start()
+
+        # the queued batch is still imported by mailroom but it can't complete the import which has failed
+        self.assertEqual(1, mock_import_async.call_count)
+        self.assertIsNone(r.get(f"contact_import_batches_remaining:{imp.id}"))
+
+        imp.refresh_from_db()
+        self.assertEqual("F", imp.status)
+        self.assertIsNotNone(imp.finished_on)
+
     @mock_mailroom
     def test_batches_with_fields(self, mr_mocks):
         self.create_field("goats", "Goats", ContactField.TYPE_NUMBER)
@@ -6434,3 +6583,14 @@ class ContactImportCRUDLTest(TembaTest, CRUDLTestMixin):
         read_url = reverse("contacts.contactimport_read", args=[imp.id])
 
         self.assertReadFetch(read_url, allow_viewers=True, allow_editors=True, context_object=imp)
+
+        # only staff users can see the timings of each stage
+        self.login(self.admin)
+        response = self.client.get(read_url)
+        self.assertNotIn("timings", response.context)
+
+        self.admin.is_staff = True
+        self.admin.save(update_fields=("is_staff",))
+
+        response = self.client.get(read_url)
+        self.assertEqual({"parse", "spec", "db", "queue"}, set(response.context["timings"].keys()))
@@ -71,7 +71,7 @@ from .models import (
     ContactURN,
     ExportContactsTask,
 )
-from .search import SearchException, parse_query, search_contacts
+from .search import SearchException, SearchSession, parse_query, search_contacts
 from .search.omnibox import omnibox_query, omnibox_results_to_dict
 from .tasks import export_contacts_task
 
@@ -190,6 +190,7 @@ class ContactListView(SpaMixin, OrgPermsMixin, BulkActionMixin, SmartListView):
     sort_direction = None
 
     search_error = None
+    search_session = None
 
     def pre_process(self, request, *args, **kwargs):
         """
@@ -303,10 +304,10 @@ class ContactListView(SpaMixin, OrgPermsMixin, BulkActionMixin, SmartListView):
             else:
                 exclude_ids = []
 
+            self.search_session = SearchSession(org, search_query, group=self.group, sort=sort_on)
+
             try:
-                results = search_contacts(
-                    org, search_query, group=self.group, sort=sort_on, offset=offset, exclude_ids=exclude_ids
-                )
+                results = self.search_session.search(offset=offset, exclude_ids=exclude_ids)
                 self.parsed_query = results.query if len(results.query) > 0 else None
                 self.save_dynamic_search = results.metadata.allow_as_group
 
@@ -351,6 +352,9 @@ class ContactListView(SpaMixin, OrgPermsMixin, BulkActionMixin, SmartListView):
             context["search"] = self.parsed_query
             context["save_dynamic_search"] = self.save_dynamic_search
 
+        if self.search_session:
+            context["search_cache_hits"] = self.search_session.hits
+
         return context
 
     def get_groups(self, org) -> tuple:
@@ -531,6 +535,14 @@ class ExportForm(Form):
             attrs={"widget_only": True, "placeholder": _("Optional: Choose groups to show in your export")}
         ),
     )
+    file_format = forms.ChoiceField(
+        choices=ExportContactsTask.FORMAT_CHOICES,
+        initial=ExportContactsTask.FORMAT_XLSX,
+        required=False,
+        label=_("Format"),
+        help_text=_("Compressed CSV has no limit on rows per sheet and is better suited to very large exports."),
+        widget=SelectWidget(),
+    )
 
     def __init__(self, org, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -543,6 +555,9 @@ class ExportForm(Form):
             "Include group membership only for these groups. " "(Leave blank to ignore group memberships)."
         )
 
+    def clean_file_format(self):
+        return self.cleaned_data["file_format"] or ExportContactsTask.FORMAT_XLSX
+
 
 class ContactCRUDL(SmartCRUDL):
     model = Contact
@@ -711,7 +726,9 @@ class ContactCRUDL(SmartCRUDL):
                 ):  # pragma: needs cover
                     analytics.track(self.request.user, "temba.contact_exported")
 
-                export = ExportContactsTask.create(org, user, group, search, group_memberships)
+                export = ExportContactsTask.create(
+                    org, user, group, search, group_memberships, file_format=form.cleaned_data["file_format"]
+                )
 
                 # schedule the export job
                 on_transaction_commit(lambda: export_contacts_task.delay(export.pk))
@@ -911,11 +928,17 @@ class ContactCRUDL(SmartCRUDL):
         permission = "contacts.contact_read"
         slug_url_kwarg = "uuid"
 
+        MAX_DAYS = 30
+
         def get_queryset(self):
             return Contact.objects.filter(is_active=True).select_related("org")
 
         def render_to_response(self, context, **response_kwargs):
-            return JsonResponse({"results": self.object.get_scheduled()})
+            # can optionally be limited to a number of days, with repeating events included for each time they fire
+            days = self.request.GET.get("days", "")
+            days = min(int(days), self.MAX_DAYS) if days.isdigit() and int(days) > 0 else None
+
+            return JsonResponse({"results": self.object.get_scheduled(days=days)})
 
     class History(OrgObjPermsMixin, SmartReadView):
         slug_url_kwarg = "uuid"
@@ -2118,6 +2141,10 @@ class ContactImportCRUDL(SmartCRUDL):
             context = super().get_context_data(**kwargs)
             context["info"] = self.import_info
             context["is_finished"] = self.is_import_finished()
+
+            # staff can see how long each stage of starting the import took
+            if self.request.user.is_staff:
+                context["timings"] = self.object.timings
             return context
 
         @cached_property
@@ -1,9 +1,11 @@
 from django.urls import reverse
 
-from temba.tests import TembaTest
+from temba import mailroom
+from temba.tests import CRUDLTestMixin, TembaTest
+from temba.utils.celery import instrument_task, record_rows
 
 
-class DashboardTest(TembaTest):
+class DashboardTest(CRUDLTestMixin, TembaTest):
     def setUp(self):
         super().setUp()
 
@@ -89,3 +91,20 @@ class DashboardTest(TembaTest):
         self.assertEqual("Android", response.context["channel_types"][0]["channel__name"])
         self.assertEqual(7, len(response.context["channel_types"]))
         self.assertEqual("Other", response.context["channel_types"][6]["channel__name"])
+
+    def test_task_stats(self):
+        task_stats_url = reverse("dashboard.dashboard_task_stats")
+
+        with instrument_task("trim_sessions"):
+            record_rows(10)
+
+        mailroom.endpoint_stats.reset()
+        mailroom.endpoint_stats.record("contact/search", 0.5, error=False)
+
+        response = self.assertStaffOnly(task_stats_url)
+        self.assertEqual(["trim_sessions"], [s["name"] for s in response.context["stats"]])
+        self.assertContains(response, "trim_sessions")
+        self.assertEqual(["contact/search"], [e for e, s in response.context["mailroom_stats"]])
+        self.assertContains(response, "contact/search")
+
+        mailroom.endpoint_stats.reset()
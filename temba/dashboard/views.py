@@ -7,9 +7,13 @@ from django.db.models import Q, Sum
 from django.http import JsonResponse
 from django.utils import timezone
 
+from temba import mailroom
+from temba.archives.models import ArchiveCache
 from temba.channels.models import Channel, ChannelCount
 from temba.orgs.models import Org
 from temba.orgs.views import OrgPermsMixin
+from temba.utils.celery import get_task_stats
+from temba.utils.views import StaffOnlyMixin
 
 
 class Home(OrgPermsMixin, SmartTemplateView):
@@ -193,3 +197,19 @@ class RangeDetails(OrgPermsMixin, SmartTemplateView):
             context["direction"] = direction
 
         return context
+
+
+class TaskStats(StaffOnlyMixin, SmartTemplateView):
+    """
+    Staff view of the recorded stats of instrumented celery tasks, the archive cache and this process's mailroom requests
+    """
+
+    title = "Tasks"
+    template_name = "dashboard/task_stats.haml"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["stats"] = get_task_stats()
+        context["archive_cache"] = ArchiveCache.get_stats()
+        context["mailroom_stats"] = sorted(mailroom.endpoint_stats.get().items())
+        return context
@@ -1,38 +1,6 @@
-from collections import defaultdict
-
 from django.core.management.base import BaseCommand
-from django.db import transaction
-
-from temba.flows.models import Flow, FlowNodeCount, FlowRun
-
-
-def recalc_node_counts(flow):
-    node_counts = defaultdict(int)
-
-    all_runs = (
-        flow.runs.filter(status__in=(FlowRun.STATUS_ACTIVE, FlowRun.STATUS_WAITING))
-        .exclude(current_node_uuid=None)
-        .only("id", "current_node_uuid")
-        .order_by("id")
-    )
-    max_id = 0
 
-    while True:
-        batch = list(all_runs.filter(id__gt=max_id)[:1000])
-        if not batch:
-            break
-        max_id = batch[-1].id
-
-        for run in batch:
-            node_counts[run.current_node_uuid] += 1
-
-    records = []
-    for node_uuid, count in node_counts.items():
-        records.append(FlowNodeCount(flow=flow, node_uuid=node_uuid, count=count))
-
-    with transaction.atomic():
-        FlowNodeCount.objects.filter(flow=flow).delete()
-        FlowNodeCount.objects.bulk_create(records)
+from temba.flows.models import Flow, FlowNodeCount
 
 
 class Command(BaseCommand):
@@ -46,4 +14,6 @@ class Command(BaseCommand):
 
         print(f"Re-calculating flow node counts for '{flow.name}' (#{flow.id})...")
 
-        recalc_node_counts(flow)
+        deltas = FlowNodeCount.reconcile(flow.id)
+
+        print(f"Corrected counts for {len(deltas)} nodes")
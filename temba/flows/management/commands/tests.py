@@ -160,6 +160,13 @@ class RecalcNodeCountsTest(TembaTest):
 
         check_node_count_rebuild(flow, 2)
 
+        # drifted counts are corrected
+        FlowNodeCount.objects.create(flow=flow, node_uuid=name_split["uuid"], count=3)
+
+        call_command("recalc_node_counts", flow_id=flow.id)
+
+        self.assertEqual(2, sum(FlowNodeCount.get_totals(flow).values()))
+
 
 class UndoFootgunTest(TembaTest):
     def test_group_changes(self):
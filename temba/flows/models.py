@@ -1,5 +1,5 @@
 import logging
-from array import array
+import time
 from collections import defaultdict
 from datetime import datetime
 
@@ -8,13 +8,12 @@ import pytz
 from django_redis import get_redis_connection
 from packaging.version import Version
 from smartmin.models import SmartModel
-from xlsxlite.writer import XLSXBook
 
 from django.conf import settings
 from django.contrib.auth.models import Group, User
 from django.contrib.postgres.fields import ArrayField
-from django.core.files.temp import NamedTemporaryFile
-from django.db import models, transaction
+from django.core.cache import cache
+from django.db import connection, models, transaction
 from django.db.models import Max, Prefetch, Q, Sum
 from django.db.models.functions import Lower, TruncDate
 from django.utils import timezone
@@ -32,8 +31,15 @@ from temba.orgs.models import DependencyMixin, Org
 from temba.templates.models import Template
 from temba.tickets.models import Ticketer, Topic
 from temba.utils import analytics, chunk_list, json, on_transaction_commit, s3
-from temba.utils.export import BaseExportAssetStore, BaseItemWithContactExport
-from temba.utils.models import JSONAsTextField, JSONField, LegacyUUIDMixin, SquashableModel, TembaModel
+from temba.utils.export import BaseExport, BaseExportAssetStore, BaseItemWithContactExport
+from temba.utils.models import (
+    JSONAsTextField,
+    JSONField,
+    LegacyUUIDMixin,
+    SquashableModel,
+    TembaModel,
+    iter_keyset_batches,
+)
 from temba.utils.uuid import uuid4
 
 from . import legacy
@@ -59,6 +65,12 @@ class FlowVersionConflictException(FlowException):
 FLOW_LOCK_TTL = 60  # 1 minute
 FLOW_LOCK_KEY = "org:%d:lock:flow:%d:definition"
 
+# count summaries are cached in redis and stamped with the flow's watermark which is moved when its counts are squashed
+FLOW_CATEGORY_COUNTS_KEY = "flow_category_counts:%d"
+FLOW_CATEGORY_COUNTS_TTL = 24 * 60 * 60  # 1 day
+FLOW_PATH_HOURLY_KEY = "flow_path_hourly:%d"
+FLOW_PATH_HOURLY_TTL = 24 * 60 * 60  # 1 day
+
 
 class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
     CONTACT_CREATION = "contact_creation"
@@ -438,6 +450,9 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
     def apply_action_archive(cls, user, flows):
         from temba.campaigns.models import CampaignEvent
 
+        # interrupts for all archived flows are queued together
+        batch = mailroom.TaskBatch()
+
         for flow in flows:
             # don't archive flows that belong to campaigns
             has_events = CampaignEvent.objects.filter(
@@ -445,7 +460,9 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
             ).exists()
 
             if not has_events:
-                flow.archive(user)
+                flow.archive(user, batch=batch)
+
+        on_transaction_commit(batch.flush)
 
     @classmethod
     def apply_action_restore(cls, user, flows):
@@ -507,6 +524,32 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
 
         return dict(counts=result_list)
 
+    def get_cached_category_counts(self):
+        """
+        Gets the category counts from the summary cached in redis, which is only recalculated when this flow's counts
+        have been squashed since it was cached, or the flow's results have changed
+        """
+        r = get_redis_connection()
+        summary_key = FLOW_CATEGORY_COUNTS_KEY % self.id
+
+        watermark = FlowCategoryCount.get_watermark(self.id)
+        cached = r.get(summary_key)
+        keys = [result["key"] for result in self.metadata["results"]]
+
+        if cached:
+            cached = json.loads(cached)
+            if cached["watermark"] == watermark and cached["keys"] == keys:
+                return cached["summary"]
+
+        summary = self.get_category_counts()
+
+        r.set(
+            summary_key,
+            json.dumps({"watermark": watermark, "keys": keys, "summary": summary}),
+            ex=FLOW_CATEGORY_COUNTS_TTL,
+        )
+        return summary
+
     def lock(self):
         """
         Locks on this flow to let us make changes to the definition in a thread safe way
@@ -616,13 +659,13 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
         # won't see any new database objects
         self.save_revision(user, cloned_definition)
 
-    def archive(self, user):
+    def archive(self, user, *, batch=None):
         self.is_archived = True
         self.modified_by = user
         self.save(update_fields=("is_archived", "modified_by", "modified_on"))
 
         # queue mailroom to interrupt sessions where contact is currently in this flow
-        mailroom.queue_interrupt(self.org, flow=self)
+        mailroom.queue_interrupt(self.org, flow=self, batch=batch)
 
         # archive our triggers as well
         for trigger in self.triggers.all():
@@ -951,6 +994,8 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
             m2m.clear()
             m2m.add(*objects)
 
+        self.org.invalidate_dependency_graph()
+
     def get_dependents(self):
         dependents = super().get_dependents()
         dependents["campaign_event"] = self.campaign_events.filter(is_active=True)
@@ -1047,6 +1092,7 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
         self.path_counts.all().delete()
         self.node_counts.all().delete()
         self.exit_counts.all().delete()
+        self.webhook_counts.all().delete()
         self.labels.clear()
 
         super().delete()
@@ -1110,6 +1156,9 @@ class FlowSession(models.Model):
     # the flow of the waiting run
     current_flow = models.ForeignKey("flows.Flow", related_name="sessions", null=True, on_delete=models.PROTECT)
 
+    EVENTS_CACHE_KEY = "session_events:%s"
+    EVENTS_CACHE_TTL = 60 * 60  # 1 hour
+
     @property
     def output_json(self):
         """
@@ -1123,6 +1172,28 @@ class FlowSession(models.Model):
         else:
             return self.output
 
+    def get_events(self) -> list:
+        """
+        Gets the events of all the runs in this session. Ended sessions can't change so their events are cached.
+        """
+        cache_key = self.EVENTS_CACHE_KEY % self.uuid
+
+        if self.ended_on:
+            events = cache.get(cache_key)
+            if events is not None:
+                return events
+
+        events = []
+        for run in self.output_json.get("runs", []):
+            for event in run.get("events", []):
+                event["session_uuid"] = str(self.uuid)
+                events.append(event)
+
+        if self.ended_on:
+            cache.set(cache_key, events, self.EVENTS_CACHE_TTL)
+
+        return events
+
     def delete(self):
         for run in self.runs.all():
             run.delete()
@@ -1482,6 +1553,7 @@ class FlowCategoryCount(SquashableModel):
     """
 
     squash_over = ("flow_id", "node_uuid", "result_key", "result_name", "category_name")
+    squash_watermark_over = "flow_id"
 
     flow = models.ForeignKey(Flow, on_delete=models.PROTECT, related_name="category_counts")
 
@@ -1533,6 +1605,8 @@ class FlowPathCount(SquashableModel):
     """
 
     squash_over = ("flow_id", "from_uuid", "to_uuid", "period")
+    squash_batch_size = 1000
+    squash_watermark_over = "flow_id"
 
     flow = models.ForeignKey(Flow, on_delete=models.PROTECT, related_name="path_counts")
 
@@ -1569,6 +1643,48 @@ class FlowPathCount(SquashableModel):
         totals = list(counts.values_list("from_uuid", "to_uuid").annotate(replies=Sum("count")))
         return {"%s:%s" % (t[0], t[1]): t[2] for t in totals}
 
+    @classmethod
+    def get_hourly_totals(cls, flow, from_uuids) -> dict:
+        """
+        Gets the total counts by hour of paths from the given exits. Hourly totals of squashed counts are cached in
+        redis until the flow's watermark moves, so only unsquashed counts are read from the database every time.
+        """
+        r = get_redis_connection()
+        cache_key = FLOW_PATH_HOURLY_KEY % flow.id
+
+        watermark = cls.get_watermark(flow.id)
+        from_uuids = sorted(str(u) for u in from_uuids)
+        counts = cls.objects.filter(flow=flow, from_uuid__in=from_uuids)
+
+        cached = r.get(cache_key)
+        cached = json.loads(cached) if cached else None
+
+        if cached and cached["watermark"] == watermark and cached["from_uuids"] == from_uuids:
+            squashed = cached["totals"]
+        else:
+            squashed = [
+                (int(period.timestamp()), total)
+                for period, total in counts.filter(is_squashed=True)
+                .values_list("period")
+                .annotate(total=Sum("count"))
+                .order_by("period")
+            ]
+
+            r.set(
+                cache_key,
+                json.dumps({"watermark": watermark, "from_uuids": from_uuids, "totals": squashed}),
+                ex=FLOW_PATH_HOURLY_TTL,
+            )
+
+        totals = defaultdict(int)
+        for period, total in squashed:
+            totals[datetime.fromtimestamp(period, tz=pytz.utc)] += total
+
+        for period, total in counts.filter(is_squashed=False).values_list("period").annotate(total=Sum("count")):
+            totals[period] += total
+
+        return dict(totals)
+
     class Meta:
         index_together = ["flow", "from_uuid", "to_uuid", "period"]
 
@@ -1607,6 +1723,36 @@ class FlowNodeCount(SquashableModel):
         totals = list(cls.objects.filter(flow=flow).values_list("node_uuid").annotate(replies=Sum("count")))
         return {str(t[0]): t[1] for t in totals if t[1]}
 
+    @classmethod
+    def reconcile(cls, flow_id: int) -> dict:
+        """
+        Reconciles the node counts of the given flow with its active and waiting runs by inserting unsquashed rows
+        for the differences. Actual and recorded counts are read and corrected in a single statement so they're
+        consistent with each other, and concurrent increments from triggers aren't lost. Returns the applied deltas.
+        """
+        sql = """
+        WITH actual AS (
+            SELECT "current_node_uuid" AS "node_uuid", COUNT(*) AS "count" FROM %(runs_table)s
+            WHERE "flow_id" = %%s AND "status" IN ('A', 'W') AND "current_node_uuid" IS NOT NULL
+            GROUP BY "current_node_uuid"
+        ), recorded AS (
+            SELECT "node_uuid", SUM("count") AS "count" FROM %(table)s WHERE "flow_id" = %%s GROUP BY "node_uuid"
+        )
+        INSERT INTO %(table)s("flow_id", "node_uuid", "count", "is_squashed")
+        SELECT %%s, COALESCE(a."node_uuid", r."node_uuid"), COALESCE(a."count", 0) - COALESCE(r."count", 0), FALSE
+        FROM actual a FULL OUTER JOIN recorded r ON a."node_uuid" = r."node_uuid"
+        WHERE COALESCE(a."count", 0) != COALESCE(r."count", 0)
+        RETURNING "node_uuid", "count";
+        """ % {
+            "table": cls._meta.db_table,
+            "runs_table": FlowRun._meta.db_table,
+        }
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, (flow_id, flow_id, flow_id))
+
+            return {str(node_uuid): delta for node_uuid, delta in cursor.fetchall()}
+
 
 class FlowRunCount(SquashableModel):
     """
@@ -1615,6 +1761,7 @@ class FlowRunCount(SquashableModel):
     """
 
     squash_over = ("flow_id", "exit_type")
+    squash_batch_size = 1000
 
     flow = models.ForeignKey(Flow, on_delete=models.PROTECT, related_name="exit_counts")
 
@@ -1682,11 +1829,29 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
     config = JSONAsTextField(null=True, default=dict, help_text=_("Any configuration options for this flow export"))
 
     @classmethod
-    def create(cls, org, user, start_date, end_date, flows, with_fields, with_groups, responded_only, extra_urns):
+    def create(
+        cls,
+        org,
+        user,
+        start_date,
+        end_date,
+        flows,
+        with_fields,
+        with_groups,
+        responded_only,
+        extra_urns,
+        file_format=BaseExport.FORMAT_XLSX,
+    ):
         config = {ExportFlowResultsTask.RESPONDED_ONLY: responded_only, ExportFlowResultsTask.EXTRA_URNS: extra_urns}
 
         export = cls.objects.create(
-            org=org, created_by=user, start_date=start_date, end_date=end_date, modified_by=user, config=config
+            org=org,
+            created_by=user,
+            start_date=start_date,
+            end_date=end_date,
+            file_format=file_format,
+            modified_by=user,
+            config=config,
         )
         export.flows.add(*flows)
         export.with_fields.add(*with_fields)
@@ -1717,14 +1882,6 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
 
         return columns
 
-    def _add_runs_sheet(self, book, columns):
-        name = "Runs (%d)" % (book.num_runs_sheets + 1) if book.num_runs_sheets > 0 else "Runs"
-        sheet = book.add_sheet(name, index=book.num_runs_sheets)
-        book.num_runs_sheets += 1
-
-        self.append_row(sheet, columns)
-        return sheet
-
     def write_export(self):
         config = self.config
         responded_only = config.get(ExportFlowResultsTask.RESPONDED_ONLY, True)
@@ -1753,33 +1910,38 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
 
         runs_columns = self._get_runs_columns(extra_urn_columns, result_fields, show_submitted_by=show_submitted_by)
 
-        book = XLSXBook()
-        book.num_runs_sheets = 0
-        book.num_msgs_sheets = 0
-
-        # the current sheets
-        book.current_runs_sheet = self._add_runs_sheet(book, runs_columns)
-        book.current_msgs_sheet = None
+        exporter = self.get_exporter("Runs", runs_columns, numbered_sheets=False)
+        column_plan = self._get_result_column_plan(result_fields)
 
         start_date, end_date = self._get_date_range()
+        start = time.perf_counter()
+        num_runs = 0
 
         for batch in self._get_run_batches(start_date, end_date, flows, responded_only):
-            self._write_runs(
-                book,
-                batch,
-                extra_urn_columns,
-                show_submitted_by,
-                runs_columns,
-                result_fields,
-            )
+            self._write_runs(exporter, batch, extra_urn_columns, show_submitted_by, column_plan, len(result_fields))
+            num_runs += len(batch)
 
             self.modified_on = timezone.now()
             self.save(update_fields=("modified_on",))
 
-        temp = NamedTemporaryFile(delete=True)
-        book.finalize(to_file=temp)
-        temp.flush()
-        return temp, "xlsx"
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"Results export #{self.id} for org #{self.org.id}: wrote {num_runs} runs in {elapsed:.1f}s "
+            f"({num_runs / elapsed if elapsed else 0:.0f} rows/s)"
+        )
+
+        return exporter.save_file()
+
+    @staticmethod
+    def _get_result_column_plan(result_fields: list) -> dict:
+        """
+        Compiles the result columns of each flow into a map of flow UUID to a list of (result key, column offset) tuples,
+        where offset is the position of that result's category column in the result columns of a row.
+        """
+        plan = defaultdict(list)
+        for i, result_field in enumerate(result_fields):
+            plan[str(result_field["flow_uuid"])].append((result_field["key"], i * 3))
+        return plan
 
     def _get_run_batches(self, start_date, end_date, flows, responded_only: bool):
         logger.info(f"Results export #{self.id} for org #{self.org.id}: fetching runs from archives to export...")
@@ -1810,20 +1972,19 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
             yield matching
 
         # secondly get runs from database
-        runs = (
-            FlowRun.objects.filter(created_on__gte=start_date, created_on__lte=end_date, flow__in=flows)
-            .order_by("modified_on")
-            .using("readonly")
+        runs = FlowRun.objects.filter(created_on__gte=start_date, created_on__lte=end_date, flow__in=flows).using(
+            "readonly"
         )
         if responded_only:
             runs = runs.filter(responded=True)
-        run_ids = array(str("l"), runs.values_list("id", flat=True))
 
-        logger.info(
-            f"Results export #{self.id} for org #{self.org.id}: found {len(run_ids)} runs in database to export"
-        )
+        logger.info(f"Results export #{self.id} for org #{self.org.id}: fetching runs from database to export...")
+
+        # runs are paged by id rather than modified_on, which can change mid-export and make a run reappear in a later
+        # page, and we skip any we've already written from archives
+        for id_batch in iter_keyset_batches(runs, "id"):
+            id_batch = [i for i in id_batch if i not in seen]
 
-        for id_batch in chunk_list(run_ids, 1000):
             run_batch = (
                 FlowRun.objects.filter(id__in=id_batch)
                 .order_by("modified_on", "id")
@@ -1835,17 +1996,9 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
             )
 
             # convert this batch of runs to same format as records in our archives
-            yield [run.as_archive_json() for run in run_batch if run.id not in seen]
-
-    def _write_runs(
-        self,
-        book,
-        runs,
-        extra_urn_columns,
-        show_submitted_by,
-        runs_columns,
-        result_fields,
-    ):
+            yield [run.as_archive_json() for run in run_batch]
+
+    def _write_runs(self, exporter, runs, extra_urn_columns, show_submitted_by, column_plan, num_results):
         """
         Writes a batch of run JSON blobs to the export
         """
@@ -1860,38 +2013,40 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
         contacts_by_uuid = {str(c.uuid): c for c in contacts}
 
         Contact.bulk_urn_cache_initialize(contacts, using="readonly")
+        Contact.bulk_boundary_cache_initialize(self.org, contacts, self.with_fields.all())
 
-        for run in runs:
-            contact = contacts_by_uuid.get(run["contact"]["uuid"])
+        # contacts often have multiple runs in a batch so we only generate their columns once
+        contact_values_by_uuid = {}
 
-            # get this run's results by node name(ruleset label)
-            run_values = run["values"]
-            if isinstance(run_values, list):
-                results_by_key = {key: result for item in run_values for key, result in item.items()}
-            else:
-                results_by_key = {key: result for key, result in run_values.items()}
-
-            # generate contact info columns
-            contact_values = self._get_contact_columns(contact)
-
-            for extra_urn_column in extra_urn_columns:
-                urn_display = contact.get_urn_display(org=self.org, formatted=False, scheme=extra_urn_column["scheme"])
-                contact_values.append(urn_display)
-
-            # generate result columns for each ruleset
-            result_values = []
-            for result_field in result_fields:
-                node_result = {}
-                # check the result by ruleset label if the flow is the same
-                if result_field["flow_uuid"] == run["flow"]["uuid"]:
-                    node_result = results_by_key.get(result_field["key"], {})
-                node_category = node_result.get("category", "")
-                node_value = node_result.get("value", "")
-                node_input = node_result.get("input", "")
-                result_values += [node_category, node_value, node_input]
-
-            if book.current_runs_sheet.num_rows >= self.MAX_EXCEL_ROWS:  # pragma: no cover
-                book.current_runs_sheet = self._add_runs_sheet(book, runs_columns)
+        for run in runs:
+            contact_uuid = run["contact"]["uuid"]
+            contact_values = contact_values_by_uuid.get(contact_uuid)
+
+            if contact_values is None:
+                contact = contacts_by_uuid.get(contact_uuid)
+                contact_values = self._get_contact_columns(contact)
+
+                for extra_urn_column in extra_urn_columns:
+                    urn_display = contact.get_urn_display(
+                        org=self.org, formatted=False, scheme=extra_urn_column["scheme"]
+                    )
+                    contact_values.append(urn_display)
+
+                contact_values_by_uuid[contact_uuid] = contact_values
+
+            # get this run's results by key
+            results_by_key = run["values"]
+            if isinstance(results_by_key, list):
+                results_by_key = {key: result for item in results_by_key for key, result in item.items()}
+
+            # fill in result columns for only the results of this run's flow
+            result_values = [""] * (num_results * 3)
+            for key, offset in column_plan.get(run["flow"]["uuid"], ()):
+                node_result = results_by_key.get(key)
+                if node_result:
+                    result_values[offset] = node_result.get("category", "")
+                    result_values[offset + 1] = node_result.get("value", "")
+                    result_values[offset + 2] = node_result.get("input", "")
 
             # build the whole row
             runs_sheet_row = []
@@ -1908,7 +2063,7 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
             ]
             runs_sheet_row += result_values
 
-            self.append_row(book.current_runs_sheet, runs_sheet_row)
+            exporter.write_row(runs_sheet_row)
 
 
 @register_asset_store
@@ -1917,7 +2072,7 @@ class ResultsExportAssetStore(BaseExportAssetStore):
     key = "results_export"
     directory = "results_exports"
     permission = "flows.flow_export_results"
-    extensions = ("xlsx",)
+    extensions = ("xlsx", "csv.gz")
 
 
 class FlowStart(models.Model):
@@ -2076,6 +2231,7 @@ class FlowStartCount(SquashableModel):
     """
 
     squash_over = ("start_id",)
+    squash_batch_size = 1000
 
     start = models.ForeignKey(FlowStart, on_delete=models.PROTECT, related_name="counts", db_index=True)
     count = models.IntegerField(default=0)
@@ -12,8 +12,8 @@ from django.utils.timesince import timesince
 from celery import shared_task
 
 from temba.contacts.models import ContactField, ContactGroup
-from temba.utils import chunk_list
-from temba.utils.celery import nonoverlapping_task
+from temba.utils import analytics, chunk_list
+from temba.utils.celery import instrumented_task, nonoverlapping_task, record_rows
 
 from .models import (
     ExportFlowResultsTask,
@@ -30,6 +30,7 @@ from .models import (
 )
 
 FLOW_TIMEOUT_KEY = "flow_timeouts_%y_%m_%d"
+NODE_COUNT_DRIFT_KEY = "node_count_drift"
 logger = logging.getLogger(__name__)
 
 
@@ -47,7 +48,7 @@ def update_session_wait_expires(flow_id):
         batch.update(wait_expires_on=F("wait_started_on") + timedelta(minutes=flow.expires_after_minutes))
 
 
-@shared_task(track_started=True, name="export_flow_results_task")
+@instrumented_task(track_started=True, name="export_flow_results_task")
 def export_flow_results_task(export_id):
     """
     Export a flow to a file and e-mail a link to the user
@@ -67,6 +68,52 @@ def squash_flowcounts():
     FlowPathCount.squash()
 
 
+@nonoverlapping_task(track_started=True, name="reconcile_node_counts", lock_timeout=7200)
+def reconcile_node_counts():
+    """
+    Queues reconciliation of the node counts of every flow which has them, in batches which can run concurrently,
+    and reports the drift found by the previous reconciliation
+    """
+    r = get_redis_connection()
+
+    with r.pipeline() as pipe:
+        pipe.hgetall(NODE_COUNT_DRIFT_KEY)
+        pipe.delete(NODE_COUNT_DRIFT_KEY)
+        drift = pipe.execute()[0]
+
+    for name in ("flows", "drifted_flows", "drift"):
+        analytics.gauge(f"temba.node_count_reconcile_{name}", int(drift.get(name.encode(), 0)))
+
+    flow_ids = FlowNodeCount.objects.order_by("flow_id").values_list("flow_id", flat=True).distinct()
+
+    for id_batch in chunk_list(flow_ids, settings.NODE_COUNT_RECONCILE_BATCH_SIZE):
+        reconcile_flow_node_counts.delay(id_batch)
+
+
+@shared_task(track_started=True, name="reconcile_flow_node_counts")
+def reconcile_flow_node_counts(flow_ids):
+    """
+    Reconciles the node counts of the given flows, tracking how much they had drifted
+    """
+    num_drifted, drift = 0, 0
+
+    for flow_id in flow_ids:
+        deltas = FlowNodeCount.reconcile(flow_id)
+        if deltas:
+            num_drifted += 1
+            drift += sum(abs(d) for d in deltas.values())
+
+            logger.warning(f"Repaired drifted node counts for flow #{flow_id}", extra={"deltas": deltas})
+
+    r = get_redis_connection()
+
+    with r.pipeline() as pipe:
+        pipe.hincrby(NODE_COUNT_DRIFT_KEY, "flows", len(flow_ids))
+        pipe.hincrby(NODE_COUNT_DRIFT_KEY, "drifted_flows", num_drifted)
+        pipe.hincrby(NODE_COUNT_DRIFT_KEY, "drift", drift)
+        pipe.execute()
+
+
 @nonoverlapping_task(track_started=True, name="trim_flow_revisions")
 def trim_flow_revisions():
     start = timezone.now()
@@ -82,6 +129,8 @@ def trim_flow_revisions():
 
     r.set(FlowRevision.LAST_TRIM_KEY, int(timezone.now().timestamp()))
 
+    record_rows(count)
+
     elapsed = timesince(start)
     logger.info(f"Trimmed {count} flow revisions since {last_trim} in {elapsed}")
 
@@ -117,6 +166,7 @@ def trim_flow_sessions():
             print(f" > Deleted {num_deleted} flow sessions")
 
     logger.info(f"Deleted {num_deleted} flow sessions in {timesince(start)}")
+    record_rows(num_deleted)
 
 
 def trim_flow_starts():
@@ -159,3 +209,4 @@ def trim_flow_starts():
             logger.debug(f" > Deleted {num_deleted} flow starts")
 
     logger.info(f"Deleted {num_deleted} completed non-user created flow starts in {timesince(start)}")
+    record_rows(num_deleted)
@@ -4,7 +4,7 @@ import io
 import os
 import re
 from datetime import datetime, timedelta
-from unittest.mock import patch
+from unittest.mock import call, patch
 
 import pytz
 from django_redis import get_redis_connection
@@ -33,6 +33,7 @@ from temba.tests.s3 import MockS3Client, jsonlgz_encode
 from temba.tickets.models import Ticketer
 from temba.triggers.models import Trigger
 from temba.utils import json
+from temba.utils.models import iter_keyset_batches
 from temba.utils.uuid import uuid4
 
 from .checks import mailroom_url
@@ -53,7 +54,13 @@ from .models import (
     FlowVersionConflictException,
     get_flow_user,
 )
-from .tasks import squash_flowcounts, trim_flow_revisions, trim_flow_sessions_and_starts, update_session_wait_expires
+from .tasks import (
+    reconcile_node_counts,
+    squash_flowcounts,
+    trim_flow_revisions,
+    trim_flow_sessions_and_starts,
+    update_session_wait_expires,
+)
 from .views import FlowCRUDL
 
 
@@ -851,6 +858,53 @@ class FlowTest(TembaTest):
         squash_flowcounts()
         self.assertEqual(max_id, FlowRunCount.objects.all().order_by("-id").first().id)
 
+    @patch("temba.utils.analytics.gauge")
+    def test_reconcile_node_counts(self, mock_gauge):
+        flow = self.get_flow("favorites_v13")
+        flow2 = self.get_flow("pick_a_number")
+        nodes = flow.get_definition()["nodes"]
+        color_prompt, color_split, beer_split = nodes[0], nodes[2], nodes[5]
+
+        contact1 = self.create_contact("Bob", phone="+12065550001")
+        contact2 = self.create_contact("Jim", phone="+12065550002")
+        MockSessionWriter(contact1, flow).visit(color_prompt).visit(color_split).wait().save()
+        MockSessionWriter(contact2, flow).visit(color_prompt).visit(color_split).wait().save()
+
+        self.assertEqual({color_split["uuid"]: 2}, FlowNodeCount.get_totals(flow))
+
+        # simulate some drift - a missed decrement and a bogus count for a node with no runs
+        FlowNodeCount.objects.create(flow=flow, node_uuid=color_split["uuid"], count=1)
+        FlowNodeCount.objects.create(flow=flow, node_uuid=beer_split["uuid"], count=2)
+        FlowNodeCount.objects.create(flow=flow2, node_uuid=beer_split["uuid"], count=0)
+
+        max_id = FlowNodeCount.objects.order_by("id").last().id
+
+        reconcile_node_counts()
+
+        self.assertEqual({color_split["uuid"]: 2}, FlowNodeCount.get_totals(flow))
+        self.assertEqual({}, FlowNodeCount.get_totals(flow2))
+
+        # corrections are applied as deltas rather than replacing existing counts
+        self.assertEqual(
+            {(color_split["uuid"], -1), (beer_split["uuid"], -2)},
+            {(str(c.node_uuid), c.count) for c in FlowNodeCount.objects.filter(id__gt=max_id)},
+        )
+
+        # counts are now correct so nothing to do
+        self.assertEqual({}, FlowNodeCount.reconcile(flow.id))
+
+        # drift found by the previous reconciliation is reported by the next
+        mock_gauge.reset_mock()
+        reconcile_node_counts()
+
+        mock_gauge.assert_has_calls(
+            [
+                call("temba.node_count_reconcile_flows", 2),
+                call("temba.node_count_reconcile_drifted_flows", 1),
+                call("temba.node_count_reconcile_drift", 3),
+            ]
+        )
+
     def test_category_counts(self):
         def assertCount(counts, result_key, category_name, truth):
             found = False
@@ -1041,6 +1095,102 @@ class FlowTest(TembaTest):
         counts = favorites.get_category_counts()
         assertCount(counts, "beer", "Turbo King", 0)
 
+    def test_cached_category_counts(self):
+        flow = self.get_flow("favorites")
+        node_uuid = flow.get_definition()["nodes"][2]["uuid"]
+
+        def add_count(category, count):
+            FlowCategoryCount.objects.create(
+                flow=flow,
+                node_uuid=node_uuid,
+                result_key="color",
+                result_name="Color",
+                category_name=category,
+                count=count,
+            )
+
+        def get_color_counts():
+            counts = flow.get_cached_category_counts()["counts"]
+            return {c["name"]: c["count"] for c in counts[0]["categories"]}
+
+        add_count("Red", 2)
+        add_count("Blue", 1)
+
+        with self.assertNumQueries(1):
+            self.assertEqual({"Red": 2, "Blue": 1}, get_color_counts())
+
+        # summary now served from redis
+        with self.assertNumQueries(0):
+            self.assertEqual({"Red": 2, "Blue": 1}, get_color_counts())
+
+        # new counts aren't included until they've been squashed
+        add_count("Red", 3)
+
+        with self.assertNumQueries(0):
+            self.assertEqual({"Red": 2, "Blue": 1}, get_color_counts())
+
+        self.assertEqual(
+            {"Red": 5, "Blue": 1},
+            {c["name"]: c["count"] for c in flow.get_category_counts()["counts"][0]["categories"]},
+        )
+
+        FlowCategoryCount.squash()
+
+        with self.assertNumQueries(1):
+            self.assertEqual({"Red": 5, "Blue": 1}, get_color_counts())
+
+        # squashing without any unsquashed counts for this flow doesn't move its watermark
+        FlowCategoryCount.squash()
+
+        with self.assertNumQueries(0):
+            self.assertEqual({"Red": 5, "Blue": 1}, get_color_counts())
+
+        # but a change to the flow's results does invalidate its summary
+        flow.metadata["results"] = [r for r in flow.metadata["results"] if r["key"] != "beer"]
+        flow.save(update_fields=("metadata",))
+
+        with self.assertNumQueries(1):
+            self.assertEqual({"Red": 5, "Blue": 1}, get_color_counts())
+
+    def test_path_hourly_totals(self):
+        flow = self.get_flow("favorites")
+        exit1, exit2, exit3 = uuid4(), uuid4(), uuid4()
+        hour1 = datetime(2022, 3, 1, 13, 0, 0, 0, pytz.UTC)
+        hour2 = datetime(2022, 3, 1, 14, 0, 0, 0, pytz.UTC)
+
+        def add_count(from_uuid, period, count, is_squashed=False):
+            FlowPathCount.objects.create(
+                flow=flow, from_uuid=from_uuid, to_uuid=uuid4(), period=period, count=count, is_squashed=is_squashed
+            )
+
+        add_count(exit1, hour1, 3, is_squashed=True)
+        add_count(exit2, hour1, 2, is_squashed=True)
+        add_count(exit1, hour2, 1)
+        add_count(exit3, hour2, 5)
+
+        # squashed totals are read and cached, unsquashed totals are always read
+        with self.assertNumQueries(2):
+            self.assertEqual({hour1: 5, hour2: 1}, FlowPathCount.get_hourly_totals(flow, [exit1, exit2]))
+
+        with self.assertNumQueries(1):
+            self.assertEqual({hour1: 5, hour2: 1}, FlowPathCount.get_hourly_totals(flow, [exit1, exit2]))
+
+        # cached totals aren't used for a different set of exits
+        with self.assertNumQueries(2):
+            self.assertEqual({hour1: 3, hour2: 6}, FlowPathCount.get_hourly_totals(flow, [exit1, exit3]))
+
+        add_count(exit1, hour1, 4)
+        self.assertEqual({hour1: 7, hour2: 6}, FlowPathCount.get_hourly_totals(flow, [exit1, exit3]))
+
+        # squashing moves the flow's watermark so squashed totals are read again
+        FlowPathCount.squash()
+
+        with self.assertNumQueries(2):
+            self.assertEqual({hour1: 7, hour2: 6}, FlowPathCount.get_hourly_totals(flow, [exit1, exit3]))
+
+        with self.assertNumQueries(1):
+            self.assertEqual({hour1: 7, hour2: 6}, FlowPathCount.get_hourly_totals(flow, [exit1, exit3]))
+
     def test_category_counts_with_null_categories(self):
         flow = self.get_flow("color_v13")
         flow_nodes = flow.get_definition()["nodes"]
@@ -1186,6 +1336,9 @@ class FlowTest(TembaTest):
             ["name", "keyword_triggers", "expires_after_minutes", "ignore_triggers", "loc"],
         )
 
+        # cache the dependency graph with triggers
+        num_dependencies = len(self.org.resolve_dependencies([flow], [], include_triggers=True))
+
         # update flow triggers
         post_data = dict()
         post_data["name"] = "Flow With Keyword Triggers"
@@ -1193,6 +1346,9 @@ class FlowTest(TembaTest):
         post_data["expires_after_minutes"] = 60 * 12
         response = self.client.post(reverse("flows.flow_update", args=[flow.pk]), post_data, follow=True)
 
+        # two keyword triggers were archived and one added
+        self.assertEqual(num_dependencies - 1, len(self.org.resolve_dependencies([flow], [], include_triggers=True)))
+
         flow_with_keywords = Flow.objects.get(name=post_data["name"])
         self.assertEqual(200, response.status_code)
         self.assertEqual(response.request["PATH_INFO"], reverse("flows.flow_editor", args=[flow.uuid]))
@@ -3832,6 +3988,49 @@ class FlowRunTest(TembaTest):
 
 
 class FlowSessionTest(TembaTest):
+    def test_get_events(self):
+        contact = self.create_contact("Ben Haggerty", phone="+250788123123")
+        output = {
+            "runs": [
+                {"events": [{"type": "contact_name_changed", "created_on": "2022-09-01T10:00:00Z", "name": "Ben"}]},
+                {"events": [{"type": "error", "created_on": "2022-09-01T10:01:00Z", "text": "oops"}]},
+            ]
+        }
+        session = FlowSession.objects.create(
+            uuid=uuid4(),
+            org=self.org,
+            contact=contact,
+            output=output,
+            status=FlowSession.STATUS_WAITING,
+            wait_started_on=timezone.now(),
+            wait_expires_on=timezone.now() + timedelta(days=7),
+            wait_resume_on_expire=False,
+        )
+
+        expected = [
+            {
+                "type": "contact_name_changed",
+                "created_on": "2022-09-01T10:00:00Z",
+                "name": "Ben",
+                "session_uuid": str(session.uuid),
+            },
+            {"type": "error", "created_on": "2022-09-01T10:01:00Z", "text": "oops", "session_uuid": str(session.uuid)},
+        ]
+        self.assertEqual(expected, session.get_events())
+
+        # events of a waiting session aren't cached
+        session.output = {"runs": []}
+        self.assertEqual([], session.get_events())
+
+        # but those of an ended session are
+        session.output = output
+        session.status = FlowSession.STATUS_COMPLETED
+        session.ended_on = timezone.now()
+        self.assertEqual(expected, session.get_events())
+
+        session.output = {"runs": []}
+        self.assertEqual(expected, session.get_events())
+
     def test_trim(self):
         contact = self.create_contact("Ben Haggerty", phone="+250788123123")
         flow = self.get_flow("color")
@@ -5291,6 +5490,49 @@ class ExportFlowResultsTest(TembaTest):
         self.assertEqual(1, len(list(workbook.worksheets[0].rows)))
         self.assertEqual(11, len(list(workbook.worksheets[0].columns)))
 
+    def test_run_batches_paged_by_id(self):
+        flow = self.get_flow("color_v13")
+        runs = [
+            FlowRun.objects.create(org=self.org, flow=flow, contact=c, status=FlowRun.STATUS_WAITING)
+            for c in (self.contact, self.contact2, self.contact3)
+        ]
+        start_date, end_date = timezone.now() - timedelta(days=7), timezone.now()
+        export = ExportFlowResultsTask.create(
+            self.org,
+            self.admin,
+            start_date.date(),
+            end_date.date(),
+            [flow],
+            with_fields=(),
+            with_groups=(),
+            responded_only=False,
+            extra_urns=(),
+        )
+
+        # runs are paged by id so modifying a run mid-export can't move it into a later page
+        with patch("temba.flows.models.iter_keyset_batches", wraps=iter_keyset_batches) as mock_iter:
+            batches = export._get_run_batches(start_date, end_date, [flow], False)
+
+            exported = [r["id"] for r in next(batches)]
+            runs[0].save(update_fields=("modified_on",))
+            exported += [r["id"] for batch in batches for r in batch]
+
+        self.assertEqual("id", mock_iter.call_args[0][1])
+        self.assertEqual(sorted(r.id for r in runs), sorted(exported))
+
+    def test_result_column_plan(self):
+        result_fields = [
+            {"key": "color", "flow_uuid": "f1"},
+            {"key": "name", "flow_uuid": "f2"},
+            {"key": "age", "flow_uuid": "f1"},
+            {"key": "color", "flow_uuid": "f2"},
+        ]
+
+        self.assertEqual(
+            {"f1": [("color", 0), ("age", 6)], "f2": [("name", 3), ("color", 9)]},
+            ExportFlowResultsTask._get_result_column_plan(result_fields),
+        )
+
 
 class FlowLabelTest(TembaTest):
     def test_model(self):
@@ -5422,7 +5664,7 @@ class SimulationTest(TembaTest):
         url = reverse("flows.flow_simulate", args=[flow.id])
 
         with override_settings(MAILROOM_AUTH_TOKEN="sesame", MAILROOM_URL="https://mailroom.temba.io"):
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(200, '{"session": {}}')
                 response = self.client.post(url, payload, content_type="application/json")
 
@@ -5460,13 +5702,13 @@ class SimulationTest(TembaTest):
         url = reverse("flows.flow_simulate", args=[flow.pk])
 
         with override_settings(MAILROOM_AUTH_TOKEN="sesame", MAILROOM_URL="https://mailroom.temba.io"):
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(400, '{"session": {}}')
                 response = self.client.post(url, json.dumps(payload), content_type="application/json")
                 self.assertEqual(500, response.status_code)
 
             # start a flow
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(200, '{"session": {}}')
                 response = self.client.post(url, json.dumps(payload), content_type="application/json")
                 self.assertEqual(200, response.status_code)
@@ -5492,12 +5734,12 @@ class SimulationTest(TembaTest):
                 "flow": {},
             }
 
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(400, '{"session": {}}')
                 response = self.client.post(url, json.dumps(payload), content_type="application/json")
                 self.assertEqual(500, response.status_code)
 
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(200, '{"session": {}}')
                 response = self.client.post(url, json.dumps(payload), content_type="application/json")
                 self.assertEqual(200, response.status_code)
@@ -1,4 +1,5 @@
 import logging
+from collections import defaultdict
 from datetime import datetime, timedelta
 from urllib.parse import urlencode
 
@@ -20,7 +21,7 @@ from django import forms
 from django.conf import settings
 from django.contrib import messages
 from django.core.exceptions import ValidationError
-from django.db.models import Count, Max, Min, Sum
+from django.db.models import Count, Sum
 from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.urls import reverse
 from django.utils.encoding import force_str
@@ -47,7 +48,7 @@ from temba.orgs.views import (
     OrgObjPermsMixin,
     OrgPermsMixin,
 )
-from temba.triggers.models import Trigger
+from temba.triggers.models import Trigger, invalidate_trigger_index
 from temba.utils import analytics, gettext, json, languages, on_transaction_commit, str_to_bool
 from temba.utils.export.views import BaseExportView
 from temba.utils.fields import (
@@ -656,6 +657,8 @@ class FlowCRUDL(SmartCRUDL):
                 removed_keywords = existing_keywords.difference(keywords)
                 for keyword in removed_keywords:
                     obj.triggers.filter(keyword=keyword, groups=None, is_archived=False).update(is_archived=True)
+                    invalidate_trigger_index(org.id)
+                    org.invalidate_dependency_graph()
 
                 added_keywords = keywords.difference(existing_keywords)
                 archived_keywords = [
@@ -670,6 +673,8 @@ class FlowCRUDL(SmartCRUDL):
                     # first check if the added keyword is not amongst archived
                     if keyword in archived_keywords:  # pragma: needs cover
                         obj.triggers.filter(org=org, flow=obj, keyword=keyword, groups=None).update(is_archived=False)
+                        invalidate_trigger_index(org.id)
+                        org.invalidate_dependency_graph()
                     else:
                         Trigger.objects.create(
                             org=org,
@@ -1341,6 +1346,7 @@ class FlowCRUDL(SmartCRUDL):
                     with_groups=form.cleaned_data["with_groups"],
                     responded_only=responded_only,
                     extra_urns=form.cleaned_data.get(ExportFlowResultsTask.EXTRA_URNS, []),
+                    file_format=form.cleaned_data["file_format"],
                 )
                 on_transaction_commit(lambda: export_flow_results_task.delay(export.pk))
 
@@ -1396,31 +1402,22 @@ class FlowCRUDL(SmartCRUDL):
             flow = self.get_object()
             from temba.flows.models import FlowPathCount
 
-            from_uuids = flow.metadata["waiting_exit_uuids"]
-            dates = FlowPathCount.objects.filter(flow=flow, from_uuid__in=from_uuids).aggregate(
-                Max("period"), Min("period")
-            )
-            start_date = dates.get("period__min")
-            end_date = dates.get("period__max")
+            # all of our charts are built from the hourly totals of paths from waiting exits
+            hourly = FlowPathCount.get_hourly_totals(flow, flow.metadata["waiting_exit_uuids"])
+            start_date = min(hourly.keys(), default=None)
+            end_date = max(hourly.keys(), default=None)
 
-            # by hour of the day
-            hod = FlowPathCount.objects.filter(flow=flow, from_uuid__in=from_uuids).extra(
-                {"hour": "extract(hour from period::timestamp)"}
-            )
-            hod = hod.values("hour").annotate(count=Sum("count")).order_by("hour")
-            hod_dict = {int(h.get("hour")): h.get("count") for h in hod}
+            hod_dict, dow_dict = defaultdict(int), defaultdict(int)
+            for period, count in hourly.items():
+                hod_dict[period.hour] += count
+                dow_dict[period.isoweekday() % 7] += count  # Sunday is 0
 
+            # by hour of the day
             hours = []
             for x in range(0, 24):
                 hours.append({"bucket": datetime(1970, 1, 1, hour=x), "count": hod_dict.get(x, 0)})
 
             # by day of the week
-            dow = FlowPathCount.objects.filter(flow=flow, from_uuid__in=from_uuids).extra(
-                {"day": "extract(dow from period::timestamp)"}
-            )
-            dow = dow.values("day").annotate(count=Sum("count"))
-            dow_dict = {int(d.get("day")): d.get("count") for d in dow}
-
             dow = []
             for x in range(0, 7):
                 day_count = dow_dict.get(x, 0)
@@ -1452,19 +1449,26 @@ class FlowCRUDL(SmartCRUDL):
             if total_responses > self.HISTOGRAM_MIN:
                 # our main histogram
                 date_range = end_date - start_date
-                histogram = FlowPathCount.objects.filter(flow=flow, from_uuid__in=from_uuids)
                 if date_range < timedelta(days=21):
-                    histogram = histogram.extra({"bucket": "date_trunc('hour', period)"})
+                    bucket_size = "hour"
                     min_date = start_date - timedelta(hours=1)
                 elif date_range < timedelta(days=500):
-                    histogram = histogram.extra({"bucket": "date_trunc('day', period)"})
+                    bucket_size = "day"
                     min_date = end_date - timedelta(days=100)
                 else:
-                    histogram = histogram.extra({"bucket": "date_trunc('week', period)"})
+                    bucket_size = "week"
                     min_date = end_date - timedelta(days=500)
 
-                histogram = histogram.values("bucket").annotate(count=Sum("count")).order_by("bucket")
-                context["histogram"] = histogram
+                histogram = defaultdict(int)
+                for period, count in hourly.items():
+                    if bucket_size != "hour":
+                        period = period.replace(hour=0)
+                    if bucket_size == "week":
+                        period -= timedelta(days=period.weekday())
+
+                    histogram[period] += count
+
+                context["histogram"] = [{"bucket": b, "count": c} for b, c in sorted(histogram.items())]
 
                 # highcharts works in UTC, but we want to offset our chart according to the org timezone
                 context["min_date"] = min_date
@@ -1533,7 +1537,7 @@ class FlowCRUDL(SmartCRUDL):
         slug_url_kwarg = "uuid"
 
         def render_to_response(self, context, **response_kwargs):
-            return JsonResponse(self.get_object().get_category_counts())
+            return JsonResponse(self.get_object().get_cached_category_counts())
 
     class Results(SpaMixin, AllowOnlyActiveFlowMixin, OrgObjPermsMixin, ContentMenuMixin, SmartReadView):
         slug_url_kwarg = "uuid"
@@ -1564,7 +1568,7 @@ class FlowCRUDL(SmartCRUDL):
                     result_fields.append(result_field)
             context["result_fields"] = result_fields
 
-            context["categories"] = flow.get_category_counts()["counts"]
+            context["categories"] = flow.get_cached_category_counts()["counts"]
             context["utcoffset"] = int(datetime.now(flow.org.timezone).utcoffset().total_seconds() // 60)
             return context
 
@@ -8,7 +8,7 @@ from django.contrib.gis.geos import MultiPolygon, Polygon
 from django.core.management.base import BaseCommand
 from django.db import connection, transaction
 
-from temba.locations.models import AdminBoundary
+from temba.locations.models import AdminBoundary, invalidate_boundary_index
 
 
 class Command(BaseCommand):
@@ -221,3 +221,6 @@ WHERE NOT (abs.osm_id = ANY(%s)))
         if country:
             self.stdout.write(self.style.SUCCESS((f" ** updating paths for all of {country.name}")))
             country.update_path()
+
+        # boundaries may also have been removed directly so make sure nobody keeps using the old index
+        invalidate_boundary_index()
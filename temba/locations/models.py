@@ -1,12 +1,20 @@
 import logging
+import time
+from collections import defaultdict
 
 import geojson
+from django_redis import get_redis_connection
 from mptt.models import MPTTModel, TreeForeignKey
 from smartmin.models import SmartModel
 
 from django.contrib.gis.db import models
 from django.db.models import F, Value
 from django.db.models.functions import Concat
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from temba.utils import on_transaction_commit
+from temba.utils.uuid import uuid4
 
 logger = logging.getLogger(__name__)
 
@@ -101,6 +109,7 @@ class AdminBoundary(MPTTModel, models.Model):
 
     def update(self, **kwargs):
         AdminBoundary.objects.filter(id=self.id).update(**kwargs)
+        invalidate_boundary_index()
 
         # update our object values so that self is up to date
         for key, value in kwargs.items():
@@ -120,6 +129,7 @@ class AdminBoundary(MPTTModel, models.Model):
                 _update_child_paths(boundary)
 
         _update_child_paths(self)
+        invalidate_boundary_index()
 
     def release(self):
         for child_boundary in AdminBoundary.objects.filter(parent=self):  # pragma: no cover
@@ -152,17 +162,16 @@ class AdminBoundary(MPTTModel, models.Model):
 
     @classmethod
     def get_by_path(cls, org, path):
-        cache = getattr(org, "_abs", {})
-
-        if not cache:
-            setattr(org, "_abs", cache)
+        return cls.get_by_paths(org, [path])[path]
 
-        boundary = cache.get(path)
-        if not boundary:
-            boundary = AdminBoundary.objects.filter(path=path).first()
-            cache[path] = boundary
-
-        return boundary
+    @classmethod
+    def get_by_paths(cls, org, paths) -> dict:
+        """
+        Resolves the given paths to boundaries (or None) using the boundary index, with the org's aliases allowed
+        in place of names
+        """
+        index = get_boundary_index()
+        return {path: index.resolve(path, org.id) for path in paths}
 
     def __str__(self):
         return "%s" % self.name
@@ -187,3 +196,155 @@ class BoundaryAlias(SmartModel):
     @classmethod
     def create(cls, org, user, boundary, name):
         return cls.objects.create(org=org, boundary=boundary, name=name, created_by=user, modified_by=user)
+
+
+class BoundaryIndex:
+    """
+    Process-wide index of boundaries as a trie of path segments, with each country loaded the first time a path in it
+    is resolved. Org aliases are loaded for a country the first time a path segment doesn't match a boundary name.
+    """
+
+    VERSION_KEY = "boundary_index_version"
+    VERSION_TTL = 86400
+    VERSION_CHECK_INTERVAL = 5  # seconds between checks of the version in redis
+
+    class Node:
+        def __init__(self, boundary=None):
+            self.boundary = boundary
+            self.children = {}  # by name
+            self.aliases = defaultdict(dict)  # by org id and casefolded name
+
+    def __init__(self, version: str):
+        self.version = version
+        self.checked_on = time.monotonic()
+        self.countries = {}  # by name, None if there's no such country
+        self.aliases_loaded = set()
+
+    def resolve(self, path: str, org_id: int):
+        """
+        Resolves the given path to a boundary, or None if it can't be found
+        """
+        if not path:
+            return None
+
+        segments = path.split(AdminBoundary.PADDED_PATH_SEPARATOR)
+        country_name = segments[0]
+
+        if country_name not in self.countries:
+            self.countries[country_name] = self._load_country(country_name)
+
+        node = self.countries[country_name]
+        for segment in segments[1:]:
+            if node is None:
+                break
+
+            child = node.children.get(segment)
+            if not child:
+                if country_name not in self.aliases_loaded:
+                    self._load_aliases(country_name)
+
+                child = node.aliases[org_id].get(segment.casefold())
+
+            node = child
+
+        return node.boundary if node else None
+
+    def _load_country(self, name: str):
+        """
+        Loads all the boundaries in the country with the given name and returns the root node
+        """
+        tree_ids = AdminBoundary.objects.filter(level=AdminBoundary.LEVEL_COUNTRY, path=name).values("tree_id")
+        boundaries = AdminBoundary.objects.filter(tree_id__in=tree_ids).order_by("level", "id")
+
+        nodes = {}  # by boundary id
+        root = None
+        for boundary in boundaries:
+            node = self.Node(boundary)
+            nodes[boundary.id] = node
+
+            if boundary.level == AdminBoundary.LEVEL_COUNTRY:
+                root = root or node
+            elif boundary.parent_id in nodes:
+                nodes[boundary.parent_id].children.setdefault(boundary.name, node)
+
+        return root
+
+    def _load_aliases(self, country_name: str):
+        """
+        Loads the org aliases for all boundaries in the given country into their parent nodes
+        """
+        self.aliases_loaded.add(country_name)
+
+        root = self.countries[country_name]
+        if not root:
+            return
+
+        nodes = {}
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            nodes[node.boundary.id] = node
+            pending.extend(node.children.values())
+
+        aliases = BoundaryAlias.objects.filter(boundary_id__in=nodes.keys()).values_list(
+            "org_id", "boundary_id", "name"
+        )
+        for org_id, boundary_id, name in aliases:
+            parent_id = nodes[boundary_id].boundary.parent_id
+            if parent_id in nodes:
+                nodes[parent_id].aliases[org_id].setdefault(name.casefold(), nodes[boundary_id])
+
+
+# the boundary index held by this process
+_boundary_index = None
+
+
+def get_boundary_index() -> BoundaryIndex:
+    """
+    Gets the boundary index, replacing it with a new empty index if the current version has changed. The version in
+    redis is checked at most once every VERSION_CHECK_INTERVAL seconds.
+    """
+    global _boundary_index
+
+    if _boundary_index and time.monotonic() - _boundary_index.checked_on < BoundaryIndex.VERSION_CHECK_INTERVAL:
+        return _boundary_index
+
+    r = get_redis_connection()
+    version = r.get(BoundaryIndex.VERSION_KEY)
+    if version is None:
+        r.set(BoundaryIndex.VERSION_KEY, str(uuid4()), ex=BoundaryIndex.VERSION_TTL, nx=True)
+        version = r.get(BoundaryIndex.VERSION_KEY)
+
+    version = version.decode()
+
+    if not _boundary_index or _boundary_index.version != version:
+        _boundary_index = BoundaryIndex(version)
+    else:
+        _boundary_index.checked_on = time.monotonic()
+
+    return _boundary_index
+
+
+def invalidate_boundary_index():
+    """
+    Invalidates the boundary index once the current transaction commits, so that no process can load boundaries from
+    pre-commit data under the new version
+    """
+
+    def invalidate():
+        global _boundary_index
+
+        get_redis_connection().set(BoundaryIndex.VERSION_KEY, str(uuid4()), ex=BoundaryIndex.VERSION_TTL)
+
+        # other processes will notice the new version on their next check but this one can drop its index right away
+        _boundary_index = None
+
+    on_transaction_commit(invalidate)
+
+
+@receiver(post_save, sender=AdminBoundary)
+@receiver(post_delete, sender=AdminBoundary)
+@receiver(post_save, sender=BoundaryAlias)
+@receiver(post_delete, sender=BoundaryAlias)
+def invalidate_boundary_index_on_change(sender, **kwargs):
+    invalidate_boundary_index()
@@ -4,15 +4,16 @@ import tempfile
 from unittest.mock import Mock, mock_open, patch
 
 import responses
+from django_redis import get_redis_connection
 
 from django.core.management import call_command
-from django.test.utils import captured_stdout
+from django.test.utils import captured_stdout, override_settings
 from django.urls import reverse
 
 from temba.tests import TembaTest
 from temba.utils import json
 
-from .models import AdminBoundary, BoundaryAlias
+from .models import AdminBoundary, BoundaryAlias, BoundaryIndex, get_boundary_index
 
 
 class LocationTest(TembaTest):
@@ -284,6 +285,86 @@ class LocationTest(TembaTest):
         response = self.client.get(reverse("locations.adminboundary_boundaries", args=[word_only_ids.osm_id]))
         self.assertEqual(200, response.status_code)
 
+    def test_get_by_path(self):
+        self.setUpLocations()
+
+        # first lookup loads the whole country
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.district1, AdminBoundary.get_by_path(self.org, "Rwanda > Eastern Province > Gatsibo")
+            )
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                {
+                    "Rwanda": self.country,
+                    "Rwanda > Kigali City": self.state1,
+                    "Rwanda > Eastern Province > Rwamagana > Bukure": self.ward3,
+                    "Rwanda > Eastern Province > Gatsibo": self.district1,
+                },
+                AdminBoundary.get_by_paths(
+                    self.org,
+                    [
+                        "Rwanda",
+                        "Rwanda > Kigali City",
+                        "Rwanda > Eastern Province > Rwamagana > Bukure",
+                        "Rwanda > Eastern Province > Gatsibo",
+                    ],
+                ),
+            )
+
+        # paths which don't exist are cached too
+        with self.assertNumQueries(1):
+            self.assertIsNone(AdminBoundary.get_by_path(self.org, "Kenya > Nairobi"))
+            self.assertIsNone(AdminBoundary.get_by_path(self.org, "Kenya > Nairobi"))
+
+        # a path segment that doesn't match a name loads aliases once
+        with self.assertNumQueries(1):
+            self.assertIsNone(AdminBoundary.get_by_path(self.org, "Rwanda > Eastern Province > Gatsibo Town"))
+            self.assertIsNone(AdminBoundary.get_by_path(self.org, "Rwanda > Eastern Province > Kayonza"))
+
+        # adding an alias invalidates the index
+        BoundaryAlias.create(self.org, self.admin, self.district1, "Gatsibo Town")
+
+        self.assertEqual(
+            self.district1, AdminBoundary.get_by_path(self.org, "Rwanda > Eastern Province > gatsibo town")
+        )
+        self.assertIsNone(AdminBoundary.get_by_path(self.org2, "Rwanda > Eastern Province > Gatsibo Town"))
+
+        # as does updating a boundary
+        self.district1.update(name="Gatsibo II", path="Rwanda > Eastern Province > Gatsibo II")
+
+        self.assertIsNone(AdminBoundary.get_by_path(self.org, "Rwanda > Eastern Province > Gatsibo"))
+        self.assertEqual(self.district1, AdminBoundary.get_by_path(self.org, "Rwanda > Eastern Province > Gatsibo II"))
+
+    def test_boundary_index_version_check(self):
+        self.setUpLocations()
+
+        index = get_boundary_index()
+
+        # a new version set by another process isn't noticed until the next check of the version
+        get_redis_connection().set(BoundaryIndex.VERSION_KEY, "other")
+
+        self.assertIs(index, get_boundary_index())
+
+        with patch("temba.locations.models.BoundaryIndex.VERSION_CHECK_INTERVAL", 0):
+            index = get_boundary_index()
+            self.assertEqual("other", index.version)
+            self.assertIs(index, get_boundary_index())
+
+        # an invalidation in this process is noticed as soon as its transaction commits
+        with override_settings(CELERY_TASK_ALWAYS_EAGER=False):
+            with self.captureOnCommitCallbacks() as callbacks:
+                AdminBoundary.objects.get(osm_id="171591").update(name="Kigali")
+
+                self.assertIs(index, get_boundary_index())
+                self.assertEqual("other", get_redis_connection().get(BoundaryIndex.VERSION_KEY).decode())
+
+            for callback in callbacks:
+                callback()
+
+        self.assertIsNot(index, get_boundary_index())
+
     def test_adminboundary_create(self):
         # create a simple boundary
         boundary = AdminBoundary.create(osm_id="-1", name="Null Island", level=0)
@@ -584,6 +665,8 @@ class ImportGeoJSONtest(TembaTest):
 
         self.assertOSMIDs({"R1000", "R2000"})
 
+        index = get_boundary_index()
+
         # update features
         geojson_data = [self.data_geojson_level_0, self.data_geojson_level_1]
 
@@ -602,6 +685,9 @@ class ImportGeoJSONtest(TembaTest):
 
         self.assertOSMIDs({"R1000", "R2000"})
 
+        # and the boundary index will be rebuilt
+        self.assertIsNot(index, get_boundary_index())
+
     def test_remove_unseen_boundaries(self):
         # insert features in the database
         geojson_data = [self.data_geojson_level_0, self.data_geojson_level_1]
@@ -1,11 +1,15 @@
 import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
 from dataclasses import asdict, dataclass, field
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from django.conf import settings
 
-from temba.utils import json
+from temba.utils import analytics, json
 
 from .modifiers import Modifier
 
@@ -105,6 +109,134 @@ class StartPreview:
     metadata: QueryMetadata
 
 
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    Transport adapter which applies a default timeout to requests which don't specify their own
+    """
+
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+
+        return super().send(request, **kwargs)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Gets the process wide session used for requests to mailroom so that connections are pooled and kept alive. We
+    don't rely on cookies or other session state so it's safe to share between threads.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            adapter = TimeoutHTTPAdapter(
+                settings.MAILROOM_TIMEOUT, pool_connections=1, pool_maxsize=settings.MAILROOM_POOL_SIZE
+            )
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+
+        return _session
+
+
+class EndpointStats:
+    """
+    Per-endpoint counts, errors and latencies of requests made to mailroom by this process. Each request's latency is
+    also reported as a gauge.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"count": 0, "errors": 0, "total_time": 0.0, "max_time": 0.0})
+
+    def record(self, endpoint: str, elapsed: float, error: bool):
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats["count"] += 1
+            stats["total_time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+            if error:
+                stats["errors"] += 1
+
+        analytics.gauge(f"temba.mailroom_request_time.{endpoint.replace('/', '_')}", elapsed)
+
+    def get(self) -> dict:
+        """
+        Gets a snapshot of the stats as a dict of endpoint to count, errors, average time and max time
+        """
+        with self._lock:
+            return {
+                endpoint: {
+                    "count": s["count"],
+                    "errors": s["errors"],
+                    "avg_time": s["total_time"] / s["count"],
+                    "max_time": s["max_time"],
+                }
+                for endpoint, s in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+endpoint_stats = EndpointStats()
+
+
+class TTLMemo:
+    """
+    Thread-safe memo of values which expire after the number of seconds given by a setting
+    """
+
+    def __init__(self, ttl_setting: str, max_size: int = 1000):
+        self.ttl_setting = ttl_setting
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._values.get(key)
+            if item and item[1] > time.monotonic():
+                return item[0]
+            return None
+
+    def set(self, key, value):
+        ttl = getattr(settings, self.ttl_setting)
+        if not ttl:
+            return
+
+        now = time.monotonic()
+
+        with self._lock:
+            self._values[key] = (value, now + ttl)
+            self._values.move_to_end(key)
+
+            # evict expired items and then the oldest items if we're still over our max size
+            while self._values:
+                oldest_key, (_, expires) = next(iter(self._values.items()))
+                if expires > now and len(self._values) <= self.max_size:
+                    break
+                del self._values[oldest_key]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+parsed_queries = TTLMemo("MAILROOM_PARSE_QUERY_TTL")
+
+
 class MailroomClient:
     """
     Basic web client for mailroom
@@ -257,14 +389,23 @@ class MailroomClient:
         )
 
     def parse_query(self, org_id: int, query: str, parse_only: bool = False, group_uuid: str = "") -> ParsedQuery:
+        # the result depends on the org's fields and groups as well as the query, so memoized results are cleared when
+        # those change in this process, and other processes rely on the short TTL
+        key = (org_id, query, parse_only, group_uuid)
+        parsed = parsed_queries.get(key)
+        if parsed:
+            return parsed
+
         payload = {"org_id": org_id, "query": query, "parse_only": parse_only, "group_uuid": group_uuid}
 
         response = self._request("contact/parse_query", payload)
-        return ParsedQuery(
+        parsed = ParsedQuery(
             query=response["query"],
             elastic_query=response["elastic_query"],
             metadata=QueryMetadata(**response.get("metadata", {})),
         )
+        parsed_queries.set(key, parsed)
+        return parsed
 
     def ticket_assign(self, org_id: int, user_id: int, ticket_ids: list, assignee_id: int, note: str):
         payload = {
@@ -314,8 +455,17 @@ class MailroomClient:
         else:
             kwargs = dict(json=payload)
 
-        req_fn = requests.post if post else requests.get
-        response = req_fn("%s/mr/%s" % (self.base_url, endpoint), headers=headers, **kwargs)
+        session = get_session()
+        req_fn = session.post if post else session.get
+        start = time.perf_counter()
+
+        try:
+            response = req_fn("%s/mr/%s" % (self.base_url, endpoint), headers=headers, **kwargs)
+        except requests.RequestException:
+            endpoint_stats.record(endpoint, time.perf_counter() - start, error=True)
+            raise
+
+        endpoint_stats.record(endpoint, time.perf_counter() - start, error=response.status_code >= 400)
 
         return_val = response.json() if returns_json else response.content
 
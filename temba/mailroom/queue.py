@@ -1,4 +1,5 @@
 import time
+from collections import defaultdict
 from enum import Enum
 
 from django_redis import get_redis_connection
@@ -38,7 +39,39 @@ class BatchTask(Enum):
     INTERRUPT_CHANNEL = "interrupt_channel"
 
 
-def queue_msg_handling(msg):
+class TaskBatch:
+    """
+    Collects tasks passed to the queue functions with batch=... so that they can be queued together in a single redis
+    pipeline, with one add per org queue, e.g.
+
+        batch = TaskBatch()
+        for flow in flows:
+            queue_interrupt(org, flow=flow, batch=batch)
+
+        on_transaction_commit(batch.flush)
+    """
+
+    def __init__(self):
+        self.batch_tasks = []
+        self.handler_tasks = []
+
+    def flush(self):
+        """
+        Queues all collected tasks to mailroom
+        """
+        batch_tasks, self.batch_tasks = self.batch_tasks, []
+        handler_tasks, self.handler_tasks = self.handler_tasks, []
+
+        if batch_tasks:
+            _queue_batch_tasks(batch_tasks)
+        if handler_tasks:
+            _queue_handler_tasks(handler_tasks)
+
+    def __len__(self):
+        return len(self.batch_tasks) + len(self.handler_tasks)
+
+
+def queue_msg_handling(msg, *, batch=None):
     """
     Queues the passed in message for handling in mailroom
     """
@@ -57,10 +90,10 @@ def queue_msg_handling(msg):
         "new_contact": False,  # only used by courier
     }
 
-    _queue_handler_task(msg.org_id, msg.contact_id, ContactEvent.MSG, msg_task)
+    _queue_handler_task(msg.org_id, msg.contact_id, ContactEvent.MSG, msg_task, batch)
 
 
-def queue_mo_miss_event(event):
+def queue_mo_miss_event(event, *, batch=None):
     """
     Queues the passed in channel event to mailroom for handling
     """
@@ -77,10 +110,10 @@ def queue_mo_miss_event(event):
         "new_contact": False,  # only used by courier
     }
 
-    _queue_handler_task(event.org_id, event.contact_id, ContactEvent.MO_MISS, event_task)
+    _queue_handler_task(event.org_id, event.contact_id, ContactEvent.MO_MISS, event_task, batch)
 
 
-def queue_broadcast(broadcast):
+def queue_broadcast(broadcast, *, batch=None):
     """
     Queues the passed in broadcast for sending by mailroom
     """
@@ -98,19 +131,19 @@ def queue_broadcast(broadcast):
         "created_by_id": broadcast.created_by_id,
     }
 
-    _queue_batch_task(broadcast.org_id, BatchTask.SEND_BROADCAST, task, HIGH_PRIORITY)
+    _queue_batch_task(broadcast.org_id, BatchTask.SEND_BROADCAST, task, HIGH_PRIORITY, batch)
 
 
-def queue_populate_dynamic_group(group):
+def queue_populate_dynamic_group(group, *, batch=None):
     """
     Queues a task to populate the contacts for a dynamic group
     """
     task = {"group_id": group.id, "query": group.query, "org_id": group.org_id}
 
-    _queue_batch_task(group.org_id, BatchTask.POPULATE_DYNAMIC_GROUP, task, HIGH_PRIORITY)
+    _queue_batch_task(group.org_id, BatchTask.POPULATE_DYNAMIC_GROUP, task, HIGH_PRIORITY, batch)
 
 
-def queue_schedule_campaign_event(event):
+def queue_schedule_campaign_event(event, *, batch=None):
     """
     Queues a task to schedule a new campaign event for all contacts in the campaign
     """
@@ -118,10 +151,10 @@ def queue_schedule_campaign_event(event):
     org_id = event.campaign.org_id
     task = {"org_id": org_id, "campaign_event_id": event.id}
 
-    _queue_batch_task(org_id, BatchTask.SCHEDULE_CAMPAIGN_EVENT, task, HIGH_PRIORITY)
+    _queue_batch_task(org_id, BatchTask.SCHEDULE_CAMPAIGN_EVENT, task, HIGH_PRIORITY, batch)
 
 
-def queue_flow_start(start):
+def queue_flow_start(start, *, batch=None):
     """
     Queues the passed in flow start for starting by mailroom
     """
@@ -144,30 +177,31 @@ def queue_flow_start(start):
         "extra": start.extra,
     }
 
-    _queue_batch_task(org_id, BatchTask.START_FLOW, task, HIGH_PRIORITY)
+    _queue_batch_task(org_id, BatchTask.START_FLOW, task, HIGH_PRIORITY, batch)
 
 
-def queue_contact_import_batch(batch):
+def queue_contact_import_batch(import_batch, *, batch=None):
     """
     Queues a task to import a batch of contacts
     """
 
-    task = {"contact_import_batch_id": batch.id}
+    task = {"contact_import_batch_id": import_batch.id}
+    org_id = import_batch.contact_import.org_id
 
-    _queue_batch_task(batch.contact_import.org.id, BatchTask.IMPORT_CONTACT_BATCH, task, DEFAULT_PRIORITY)
+    _queue_batch_task(org_id, BatchTask.IMPORT_CONTACT_BATCH, task, DEFAULT_PRIORITY, batch)
 
 
-def queue_interrupt_channel(org, channel):
+def queue_interrupt_channel(org, channel, *, batch=None):
     """
     Queues an interrupt channel task for handling by mailroom
     """
 
     task = {"channel_id": channel.id}
 
-    _queue_batch_task(org.id, BatchTask.INTERRUPT_CHANNEL, task, HIGH_PRIORITY)
+    _queue_batch_task(org.id, BatchTask.INTERRUPT_CHANNEL, task, HIGH_PRIORITY, batch)
 
 
-def queue_interrupt(org, *, contacts=None, flow=None, session=None):
+def queue_interrupt(org, *, contacts=None, flow=None, session=None, batch=None):
     """
     Queues an interrupt task for handling by mailroom
     """
@@ -182,68 +216,96 @@ def queue_interrupt(org, *, contacts=None, flow=None, session=None):
     if session:
         task["session_ids"] = [session.id]
 
-    _queue_batch_task(org.id, BatchTask.INTERRUPT_SESSIONS, task, HIGH_PRIORITY)
+    _queue_batch_task(org.id, BatchTask.INTERRUPT_SESSIONS, task, HIGH_PRIORITY, batch)
 
 
-def _queue_batch_task(org_id, task_type, task, priority):
+def _queue_batch_task(org_id, task_type, task, priority, batch=None):
     """
-    Adds the passed in task to the mailroom batch queue
+    Adds the passed in task to the mailroom batch queue, or to the given batch to be queued when that's flushed
+    """
+
+    if batch is not None:
+        batch.batch_tasks.append((org_id, task_type, task, priority))
+    else:
+        _queue_batch_tasks([(org_id, task_type, task, priority)])
+
+
+def _queue_handler_task(org_id, contact_id, task_type, task, batch=None):
+    """
+    Adds the passed in task to the contact's queue for mailroom to process, or to the given batch to be queued when
+    that's flushed
+    """
+
+    if batch is not None:
+        batch.handler_tasks.append((org_id, contact_id, task_type, task))
+    else:
+        _queue_handler_tasks([(org_id, contact_id, task_type, task)])
+
+
+def _queue_batch_tasks(tasks):
+    """
+    Adds the passed in (org_id, task_type, task, priority) tuples to the mailroom batch queue in a single pipeline
     """
 
     r = get_redis_connection("default")
     pipe = r.pipeline()
-    _queue_task(pipe, org_id, BATCH_QUEUE, task_type, task, priority)
+    _queue_tasks(pipe, BATCH_QUEUE, tasks)
     pipe.execute()
 
 
-def _queue_handler_task(org_id, contact_id, task_type, task):
+def _queue_handler_tasks(tasks):
     """
-    Adds the passed in task to the contact's queue for mailroom to process
+    Adds the passed in (org_id, contact_id, task_type, task) tuples to their contacts' queues in a single pipeline
     """
 
-    contact_queue = CONTACT_QUEUE % (org_id, contact_id)
-    contact_task = _create_mailroom_task(org_id, task_type, task)
+    contact_tasks = defaultdict(list)
+    event_tasks = []
+
+    for org_id, contact_id, task_type, task in tasks:
+        contact_tasks[CONTACT_QUEUE % (org_id, contact_id)].append(
+            json.dumps(_create_mailroom_task(org_id, task_type, task))
+        )
+        event_tasks.append((org_id, HandlerTask.CONTACT_EVENT, {"contact_id": contact_id}, HIGH_PRIORITY))
 
     r = get_redis_connection("default")
     pipe = r.pipeline()
 
-    # push our concrete task to the contact's queue
-    pipe.rpush(contact_queue, json.dumps(contact_task))
+    # push our concrete tasks to the contacts' queues
+    for contact_queue, payloads in contact_tasks.items():
+        pipe.rpush(contact_queue, *payloads)
 
-    # then push a contact handling event to the org queue
-    event_task = {"contact_id": contact_id}
-    _queue_task(pipe, org_id, HANDLER_QUEUE, HandlerTask.CONTACT_EVENT, event_task, HIGH_PRIORITY)
+    # then push contact handling events to the org queues
+    _queue_tasks(pipe, HANDLER_QUEUE, event_tasks)
     pipe.execute()
 
 
-def _queue_task(pipe, org_id, queue, task_type, task, priority):
+def _queue_tasks(pipe, queue, tasks):
     """
-    Queues a task to mailroom
+    Queues tasks to mailroom
 
     Args:
         pipe: an open redis pipe
-        org_id: the id of the org for this task
-        queue: the queue the task should be added to
-        task_type: the type of the task
-        task: the task definition
-        priority: the priority of this task
+        queue: the queue the tasks should be added to
+        tasks: (org_id, task_type, task, priority) tuples for each task
 
     """
 
     # our score is the time in milliseconds since epoch + any priority modifier
-    score = int(round(time.time() * 1000)) + priority
+    now = int(round(time.time() * 1000))
 
-    # create our payload
-    payload = _create_mailroom_task(org_id, task_type, task)
+    # create our payloads, grouped by org
+    org_payloads = defaultdict(dict)
+    for org_id, task_type, task, priority in tasks:
+        org_payloads[org_id][json.dumps(_create_mailroom_task(org_id, task_type, task))] = now + priority
 
-    org_queue = QUEUE_PATTERN % (queue, org_id)
     active_queue = ACTIVE_PATTERN % queue
 
-    # push onto our org queue
-    pipe.zadd(org_queue, {json.dumps(payload): score})
+    for org_id, payloads in org_payloads.items():
+        # push onto our org queue
+        pipe.zadd(QUEUE_PATTERN % (queue, org_id), payloads)
 
-    # and mark that org as active
-    pipe.zincrby(active_queue, 0, org_id)
+        # and mark that org as active
+        pipe.zincrby(active_queue, 0, org_id)
 
 
 def _create_mailroom_task(org_id, task_type, task):
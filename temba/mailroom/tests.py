@@ -1,7 +1,9 @@
 from decimal import Decimal
 from unittest.mock import patch
 
+import requests
 from django_redis import get_redis_connection
+from redis.client import Pipeline
 
 from django.conf import settings
 from django.test import override_settings
@@ -11,27 +13,43 @@ from temba.campaigns.models import Campaign, CampaignEvent, EventFire
 from temba.channels.models import ChannelEvent, ChannelLog
 from temba.flows.models import FlowRun, FlowStart
 from temba.ivr.models import Call
-from temba.mailroom.client import ContactSpec, MailroomException, get_client
+from temba.mailroom.client import (
+    ContactSpec,
+    MailroomException,
+    endpoint_stats,
+    get_client,
+    get_session,
+    parsed_queries,
+)
 from temba.msgs.models import Broadcast, Msg
 from temba.tests import MockResponse, TembaTest, matchers, mock_mailroom
 from temba.tests.engine import MockSessionWriter
 from temba.tickets.models import Ticketer, TicketEvent
 from temba.utils import json
 
-from . import QueryExclusions, QueryInclusions, QueryMetadata, StartPreview, modifiers, queue_interrupt
+from . import (
+    QueryExclusions,
+    QueryInclusions,
+    QueryMetadata,
+    StartPreview,
+    TaskBatch,
+    modifiers,
+    queue_interrupt,
+    queue_msg_handling,
+)
 from .events import Event
 
 
 class MailroomClientTest(TembaTest):
     def test_version(self):
-        with patch("requests.get") as mock_get:
+        with patch("requests.Session.get") as mock_get:
             mock_get.return_value = MockResponse(200, '{"version": "5.3.4"}')
             version = get_client().version()
 
         self.assertEqual("5.3.4", version)
 
     def test_expression_migrate(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"migrated": "@fields.age"}')
             migrated = get_client().expression_migrate("@contact.age")
 
@@ -52,7 +70,7 @@ class MailroomClientTest(TembaTest):
     def test_flow_migrate(self):
         flow_def = {"nodes": [{"val": Decimal("1.23")}]}
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"name": "Migrated!"}')
             migrated = get_client().flow_migrate(flow_def, to_version="13.1.0")
 
@@ -68,7 +86,7 @@ class MailroomClientTest(TembaTest):
     def test_flow_inspect(self):
         flow_def = {"nodes": [{"val": Decimal("1.23")}]}
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"dependencies":[]}')
             info = get_client().flow_inspect(self.org.id, flow_def)
 
@@ -83,7 +101,7 @@ class MailroomClientTest(TembaTest):
     def test_flow_change_language(self):
         flow_def = {"nodes": [{"val": Decimal("1.23")}]}
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"language": "spa"}')
             migrated = get_client().flow_change_language(flow_def, language="spa")
 
@@ -96,7 +114,7 @@ class MailroomClientTest(TembaTest):
         self.assertEqual({"flow": flow_def, "language": "spa"}, json.loads(call[1]["data"]))
 
     def test_flow_preview_start(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_resp = {
                 "query": 'group = "Farmers" AND status = "active"',
                 "total": 2345,
@@ -151,7 +169,7 @@ class MailroomClientTest(TembaTest):
         )
 
     def test_contact_modify(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(
                 200,
                 """{
@@ -219,7 +237,7 @@ class MailroomClientTest(TembaTest):
                 },
             )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_msg_resend(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"msg_ids": [12345]}')
         response = get_client().msg_resend(org_id=self.org.id, msg_ids=[12345, 67890])
@@ -233,7 +251,7 @@ class MailroomClientTest(TembaTest):
         )
 
     def test_po_export(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, 'msgid "Red"\nmsgstr "Rojo"\n\n')
             response = get_client().po_export(self.org.id, [123, 234], "spa")
 
@@ -246,7 +264,7 @@ class MailroomClientTest(TembaTest):
         )
 
     def test_po_import(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"flows": []}')
             response = get_client().po_import(self.org.id, [123, 234], "spa", b'msgid "Red"\nmsgstr "Rojo"\n\n')
 
@@ -259,7 +277,7 @@ class MailroomClientTest(TembaTest):
             files={"po": b'msgid "Red"\nmsgstr "Rojo"\n\n'},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_parse_query(self, mock_post):
         mock_post.return_value = MockResponse(
             200, '{"query":"name ~ \\"frank\\"", "elastic_query": {}, "metadata": {"attributes":["name"]}}'
@@ -275,12 +293,37 @@ class MailroomClientTest(TembaTest):
             json={"query": "frank", "org_id": self.org.id, "parse_only": False, "group_uuid": ""},
         )
 
+        # parsing the same query again reuses the memoized result
+        self.assertEqual(parsed, get_client().parse_query(self.org.id, "frank"))
+        self.assertEqual(1, mock_post.call_count)
+
+        # until a field or group changes
+        self.create_field("age", "Age")
+
+        get_client().parse_query(self.org.id, "frank")
+        self.assertEqual(2, mock_post.call_count)
+
+        # unless memoizing is disabled
+        with override_settings(MAILROOM_PARSE_QUERY_TTL=0):
+            get_client().parse_query(self.org.id, "bob")
+            get_client().parse_query(self.org.id, "bob")
+
+        self.assertEqual(4, mock_post.call_count)
+
         mock_post.return_value = MockResponse(400, '{"error":"no such field age"}')
 
         with self.assertRaises(MailroomException):
             get_client().parse_query(1, "age > 10")
 
-    @patch("requests.post")
+        # errors aren't memoized
+        with self.assertRaises(MailroomException):
+            get_client().parse_query(1, "age > 10")
+
+        self.assertEqual(6, mock_post.call_count)
+
+        parsed_queries.clear()
+
+    @patch("requests.Session.post")
     def test_contact_create(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"contact": {"id": 1234, "name": "", "language": ""}}')
 
@@ -332,7 +375,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_resolve(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"contact": {"id": 1234}, "urn": {"id": 2345}}')
 
@@ -346,7 +389,7 @@ class MailroomClientTest(TembaTest):
             json={"org_id": self.org.id, "channel_id": 345, "urn": "tel:+1234567890"},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_interrupt(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"sessions": 1}')
 
@@ -359,7 +402,7 @@ class MailroomClientTest(TembaTest):
             json={"org_id": self.org.id, "user_id": 3, "contact_id": 345},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_search(self, mock_post):
         mock_post.return_value = MockResponse(
             200,
@@ -396,7 +439,7 @@ class MailroomClientTest(TembaTest):
             get_client().contact_search(1, "2752dbbc-723f-4007-8bc5-b3720835d3a9", "age > 10", "-created_on")
 
     def test_ticket_assign(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_assign(1, 12, [123, 345], 4, "please handle")
 
@@ -408,7 +451,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_ticket_add_note(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_add_note(1, 12, [123, 345], "please handle")
 
@@ -420,7 +463,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_ticket_change_topic(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_change_topic(1, 12, [123, 345], 67)
 
@@ -432,7 +475,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_ticket_close(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_close(1, 12, [123, 345], force=True)
 
@@ -444,7 +487,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_ticket_reopen(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_reopen(1, 12, [123, 345])
 
@@ -458,7 +501,7 @@ class MailroomClientTest(TembaTest):
     def test_request_failure(self):
         flow = self.get_flow("color")
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(400, '{"errors":["Bad request", "Doh!"]}')
 
             with self.assertRaises(MailroomException) as e:
@@ -469,6 +512,43 @@ class MailroomClientTest(TembaTest):
             {"endpoint": "flow/migrate", "request": matchers.Dict(), "response": {"errors": ["Bad request", "Doh!"]}},
         )
 
+    @patch("temba.utils.analytics.gauge")
+    def test_session_and_stats(self, mock_gauge):
+        session = get_session()
+        self.assertEqual(session, get_session())
+        self.assertEqual((5, 60), session.get_adapter("http://localhost:8090/mr/").timeout)
+
+        endpoint_stats.reset()
+
+        with patch("requests.Session.post") as mock_post:
+            mock_post.return_value = MockResponse(200, '{"msg_ids": [12345]}')
+            get_client().msg_resend(org_id=self.org.id, msg_ids=[12345])
+
+            mock_post.return_value = MockResponse(400, '{"error": "no such msg"}')
+            with self.assertRaises(MailroomException):
+                get_client().msg_resend(org_id=self.org.id, msg_ids=[12345])
+
+            mock_post.side_effect = requests.ConnectionError("connection refused")
+            with self.assertRaises(requests.ConnectionError):
+                get_client().ticket_reopen(org_id=self.org.id, user_id=self.admin.id, ticket_ids=[123])
+
+        stats = endpoint_stats.get()
+        self.assertEqual({"msg/resend", "ticket/reopen"}, set(stats.keys()))
+        self.assertEqual(2, stats["msg/resend"]["count"])
+        self.assertEqual(1, stats["msg/resend"]["errors"])
+        self.assertEqual(1, stats["ticket/reopen"]["count"])
+        self.assertEqual(1, stats["ticket/reopen"]["errors"])
+        self.assertGreaterEqual(stats["msg/resend"]["max_time"], stats["msg/resend"]["avg_time"])
+
+        # each request's latency is also reported as a gauge
+        self.assertEqual(
+            ["temba.mailroom_request_time.msg_resend"] * 2 + ["temba.mailroom_request_time.ticket_reopen"],
+            [c.args[0] for c in mock_gauge.call_args_list],
+        )
+
+        endpoint_stats.reset()
+        self.assertEqual({}, endpoint_stats.get())
+
     def test_empty_expression(self):
         # empty is as empty does
         self.assertEqual("", get_client().expression_migrate(""))
@@ -735,6 +815,57 @@ class MailroomQueueTest(TembaTest):
             },
         )
 
+    def test_task_batch(self):
+        jim = self.create_contact("Jim", phone="+12065551212")
+        bob = self.create_contact("Bob", phone="+12065551313")
+        flow = self.get_flow("favorites")
+        msg1 = self.create_incoming_msg(jim, "Hi")
+        msg2 = self.create_incoming_msg(jim, "There")
+        msg3 = self.create_incoming_msg(bob, "Yo")
+
+        batch = TaskBatch()
+        queue_interrupt(self.org, flow=flow, batch=batch)
+        queue_interrupt(self.org, contacts=[jim], batch=batch)
+        queue_interrupt(self.org2, contacts=[bob], batch=batch)
+        queue_msg_handling(msg1, batch=batch)
+        queue_msg_handling(msg2, batch=batch)
+        queue_msg_handling(msg3, batch=batch)
+
+        self.assertEqual(6, len(batch))
+
+        # nothing queued until batch is flushed
+        r = get_redis_connection()
+        self.assertEqual(0, r.zcard("batch:active"))
+        self.assertEqual(0, r.zcard("handler:active"))
+
+        with patch.object(Pipeline, "zadd", autospec=True, side_effect=Pipeline.zadd) as mock_zadd:
+            batch.flush()
+
+        # one add per org queue
+        self.assertEqual(3, mock_zadd.call_count)
+        self.assertEqual(0, len(batch))
+
+        self.assertEqual(2, r.zcard("batch:active"))
+        self.assertEqual(2, r.zcard(f"batch:{self.org.id}"))
+        self.assertEqual(1, r.zcard(f"batch:{self.org2.id}"))
+
+        tasks = [json.loads(t) for t in r.zrange(f"batch:{self.org.id}", 0, -1)]
+        self.assertEqual(
+            [{"flow_ids": [flow.id]}, {"contact_ids": [jim.id]}],
+            sorted([t["task"] for t in tasks], key=lambda t: "contact_ids" in t),
+        )
+
+        self.assertEqual(1, r.zcard("handler:active"))
+        self.assertEqual(2, r.llen(f"c:{self.org.id}:{jim.id}"))
+        self.assertEqual(1, r.llen(f"c:{self.org.id}:{bob.id}"))
+        self.assertEqual(
+            [msg1.id, msg2.id], [json.loads(t)["task"]["msg_id"] for t in r.lrange(f"c:{self.org.id}:{jim.id}", 0, -1)]
+        )
+
+        # flushing an empty batch is a noop
+        batch.flush()
+        self.assertEqual(2, r.zcard("batch:active"))
+
     def assert_org_queued(self, org, queue):
         r = get_redis_connection()
 
@@ -2,20 +2,17 @@ import logging
 import mimetypes
 import os
 import re
-from array import array
 from datetime import datetime, timedelta
 from fnmatch import fnmatch
 from urllib.parse import unquote, urlparse
 
 import iso8601
 import pytz
-from xlsxlite.writer import XLSXBook
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
 from django.core.files.storage import default_storage
-from django.core.files.temp import NamedTemporaryFile
 from django.db import models
 from django.db.models import Prefetch, Q, Sum
 from django.db.models.functions import Lower
@@ -29,8 +26,8 @@ from temba.contacts.models import Contact, ContactGroup, ContactURN
 from temba.orgs.models import DependencyMixin, Org, TopUp
 from temba.schedules.models import Schedule
 from temba.utils import chunk_list, on_transaction_commit
-from temba.utils.export import BaseExportAssetStore, BaseItemWithContactExport
-from temba.utils.models import JSONAsTextField, SquashableModel, TembaModel, TranslatableField
+from temba.utils.export import BaseExport, BaseExportAssetStore, BaseItemWithContactExport
+from temba.utils.models import JSONAsTextField, SquashableModel, TembaModel, TranslatableField, iter_keyset_batches
 from temba.utils.s3 import public_file_storage
 from temba.utils.text import clean_string
 from temba.utils.uuid import uuid4
@@ -877,6 +874,7 @@ class BroadcastMsgCount(SquashableModel):
     """
 
     squash_over = ("broadcast_id",)
+    squash_batch_size = 1000
 
     broadcast = models.ForeignKey(Broadcast, on_delete=models.PROTECT, related_name="counts", db_index=True)
     count = models.IntegerField(default=0)
@@ -995,6 +993,7 @@ class SystemLabelCount(SquashableModel):
     """
 
     squash_over = ("org_id", "label_type", "is_archived")
+    squash_batch_size = 1000
 
     org = models.ForeignKey(Org, on_delete=models.PROTECT, related_name="system_labels")
     label_type = models.CharField(max_length=1, choices=SystemLabel.TYPE_CHOICES)
@@ -1171,6 +1170,7 @@ class LabelCount(SquashableModel):
     """
 
     squash_over = ("label_id", "is_archived")
+    squash_batch_size = 1000
 
     label = models.ForeignKey(Label, on_delete=models.PROTECT, related_name="counts")
     is_archived = models.BooleanField(default=False)
@@ -1204,41 +1204,6 @@ class LabelCount(SquashableModel):
         return {lb: counts_by_label_id.get(lb.id, 0) for lb in labels}
 
 
-class MsgIterator:
-    """
-    Queryset wrapper to chunk queries and reduce in-memory footprint
-    """
-
-    def __init__(self, ids, order_by=None, select_related=None, prefetch_related=None, max_obj_num=1000):
-        self._ids = ids
-        self._order_by = order_by
-        self._select_related = select_related
-        self._prefetch_related = prefetch_related
-        self._generator = self._setup()
-        self.max_obj_num = max_obj_num
-
-    def _setup(self):
-        for i in range(0, len(self._ids), self.max_obj_num):
-            chunk_queryset = Msg.objects.filter(id__in=self._ids[i : i + self.max_obj_num])
-
-            if self._order_by:
-                chunk_queryset = chunk_queryset.order_by(*self._order_by)
-
-            if self._select_related:
-                chunk_queryset = chunk_queryset.select_related(*self._select_related)
-
-            if self._prefetch_related:
-                chunk_queryset = chunk_queryset.prefetch_related(*self._prefetch_related)
-
-            yield chunk_queryset
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        return next(self._generator)
-
-
 class ExportMessagesTask(BaseItemWithContactExport):
     """
     Wrapper for handling exports of raw messages. This will export all selected messages in
@@ -1260,7 +1225,18 @@ class ExportMessagesTask(BaseItemWithContactExport):
     end_date = models.DateField(null=True)
 
     @classmethod
-    def create(cls, org, user, start_date, end_date, system_label=None, label=None, with_fields=(), with_groups=()):
+    def create(
+        cls,
+        org,
+        user,
+        start_date,
+        end_date,
+        system_label=None,
+        label=None,
+        with_fields=(),
+        with_groups=(),
+        file_format=BaseExport.FORMAT_XLSX,
+    ):
         assert not (label and system_label), "can't specify both label and system label"
 
         export = cls.objects.create(
@@ -1269,6 +1245,7 @@ class ExportMessagesTask(BaseItemWithContactExport):
             label=label,
             start_date=start_date,
             end_date=end_date,
+            file_format=file_format,
             created_by=user,
             modified_by=user,
         )
@@ -1276,39 +1253,26 @@ class ExportMessagesTask(BaseItemWithContactExport):
         export.with_groups.add(*with_groups)
         return export
 
-    def _add_msgs_sheet(self, book):
-        name = "Messages (%d)" % (book.num_msgs_sheets + 1) if book.num_msgs_sheets > 0 else "Messages"
-        sheet = book.add_sheet(name, book.num_msgs_sheets)
-        book.num_msgs_sheets += 1
-
-        self.append_row(sheet, book.headers)
-        return sheet
-
     def write_export(self):
-        book = XLSXBook()
-        book.num_msgs_sheets = 0
-        book.headers = (
+        headers = (
             ["Date"]
             + self._get_contact_headers()
             + ["Flow", "Direction", "Text", "Attachments", "Status", "Channel", "Labels"]
         )
-        book.current_msgs_sheet = self._add_msgs_sheet(book)
+        exporter = self.get_exporter("Messages", headers, numbered_sheets=False)
 
         start_date, end_date = self._get_date_range()
 
         logger.info(f"starting msgs export #{self.id} for org #{self.org.id}")
 
         for batch in self._get_msg_batches(self.system_label, self.label, start_date, end_date):
-            self._write_msgs(book, batch)
+            self._write_msgs(exporter, batch)
 
             # update modified_on so we can see if an export hangs
             self.modified_on = timezone.now()
             self.save(update_fields=("modified_on",))
 
-        temp = NamedTemporaryFile(delete=True, suffix=".xlsx", mode="wb+")
-        book.finalize(to_file=temp)
-        temp.flush()
-        return temp, "xlsx"
+        return exporter.save_file()
 
     def _get_msg_batches(self, system_label, label, start_date, end_date):
         from temba.archives.models import Archive
@@ -1348,26 +1312,26 @@ class ExportMessagesTask(BaseItemWithContactExport):
 
         messages = messages.filter(created_on__gte=start_date, created_on__lte=end_date)
 
-        messages = messages.order_by("created_on").using("readonly")
+        messages = messages.using("readonly")
         if last_created_on:
             messages = messages.filter(created_on__gt=last_created_on)
 
-        all_message_ids = array(str("l"), messages.values_list("id", flat=True))
+        for id_batch in iter_keyset_batches(messages, "created_on"):
+            msg_batch = (
+                Msg.objects.filter(id__in=id_batch)
+                .order_by("created_on", "id")
+                .select_related("channel", "contact_urn")
+                .prefetch_related(
+                    Prefetch("contact", queryset=Contact.objects.only("uuid", "name")),
+                    Prefetch("flow", queryset=Flow.objects.only("uuid", "name")),
+                    Prefetch("labels", queryset=Label.objects.only("uuid", "name").order_by("name")),
+                )
+            )
 
-        for msg_batch in MsgIterator(
-            all_message_ids,
-            order_by=("created_on",),
-            select_related=("channel", "contact_urn"),
-            prefetch_related=(
-                Prefetch("contact", queryset=Contact.objects.only("uuid", "name")),
-                Prefetch("flow", queryset=Flow.objects.only("uuid", "name")),
-                Prefetch("labels", queryset=Label.objects.only("uuid", "name").order_by("name")),
-            ),
-        ):
             # convert this batch of msgs to same format as records in our archives
             yield [msg.as_archive_json() for msg in msg_batch]
 
-    def _write_msgs(self, book, msgs):
+    def _write_msgs(self, exporter, msgs):
         # get all the contacts referenced in this batch
         contact_uuids = {m["contact"]["uuid"] for m in msgs}
         contacts = (
@@ -1378,15 +1342,13 @@ class ExportMessagesTask(BaseItemWithContactExport):
         )
         contacts_by_uuid = {str(c.uuid): c for c in contacts}
 
+        Contact.bulk_boundary_cache_initialize(self.org, contacts, self.with_fields.all())
+
         for msg in msgs:
             contact = contacts_by_uuid.get(msg["contact"]["uuid"])
             flow = msg.get("flow")
 
-            if book.current_msgs_sheet.num_rows >= self.MAX_EXCEL_ROWS:  # pragma: no cover
-                book.current_msgs_sheet = self._add_msgs_sheet(book)
-
-            self.append_row(
-                book.current_msgs_sheet,
+            exporter.write_row(
                 [iso8601.parse_date(msg["created_on"])]
                 + self._get_contact_columns(contact, urn=msg["urn"])
                 + [
@@ -1407,4 +1369,4 @@ class MessageExportAssetStore(BaseExportAssetStore):
     key = "message_export"
     directory = "message_exports"
     permission = "msgs.msg_export"
-    extensions = ("xlsx",)
+    extensions = ("xlsx", "csv.gz")
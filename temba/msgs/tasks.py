@@ -6,7 +6,7 @@ from celery import shared_task
 
 from temba.contacts.models import ContactField, ContactGroup
 from temba.utils import analytics
-from temba.utils.celery import nonoverlapping_task
+from temba.utils.celery import instrumented_task, nonoverlapping_task
 
 from .models import Broadcast, BroadcastMsgCount, ExportMessagesTask, LabelCount, Media, Msg, SystemLabelCount
 
@@ -47,7 +47,7 @@ def fail_old_messages():  # pragma: needs cover
     Msg.fail_old_messages()
 
 
-@shared_task(track_started=True, name="export_sms_task")
+@instrumented_task(track_started=True, name="export_sms_task")
 def export_messages_task(export_id):
     """
     Export messages to a file and e-mail a link to the user
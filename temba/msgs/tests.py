@@ -839,6 +839,37 @@ class MsgTest(TembaTest):
             self.org.timezone,
         )
 
+        # message records don't have modified_on but indexing their archives shouldn't exclude them from exports
+        with patch("temba.utils.s3.client", return_value=mock_s3):
+            for archive in Archive.objects.filter(org=self.org):
+                archive.rebuild_index()
+
+            self.assertEqual(6, Archive.objects.get(url__endswith="archive1.jsonl.gz").index["record_count"])
+
+            workbook = request_export("?l=W", {"export_all": 0, "start_date": "2000-09-01", "end_date": "2022-09-01"})
+
+        self.assertExcelSheet(
+            workbook.worksheets[0],
+            [
+                expected_headers,
+                [
+                    msg2.created_on,
+                    msg2.contact.uuid,
+                    "Frank Blow",
+                    "tel",
+                    "321",
+                    "",
+                    "IN",
+                    "hello 2",
+                    "",
+                    "handled",
+                    "Test Channel",
+                    "",
+                ],
+            ],
+            self.org.timezone,
+        )
+
         self.clear_storage()
 
     @patch("temba.utils.email.send_temba_email")
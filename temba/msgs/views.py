@@ -688,6 +688,7 @@ class MsgCRUDL(SmartCRUDL):
                     label=label,
                     with_fields=with_fields,
                     with_groups=with_groups,
+                    file_format=form.cleaned_data["file_format"],
                 )
 
                 on_transaction_commit(lambda: export_messages_task.delay(export.id))
@@ -281,6 +281,20 @@ class Notification(models.Model):
             **{export.notification_export_type + "_export": export},
         )
 
+    @classmethod
+    def import_finished(cls, imp):
+        """
+        Creates an import finished notification for the creator of the given contact import.
+        """
+
+        cls._create_all(
+            imp.org,
+            ImportFinishedNotificationType.slug,
+            scope=f"contact:{imp.id}",
+            users=[imp.created_by],
+            contact_import=imp,
+        )
+
     @classmethod
     def incident_started(cls, incident):
         """
@@ -382,6 +396,7 @@ class NotificationCount(SquashableModel):
     """
 
     squash_over = ("org_id", "user_id")
+    squash_batch_size = 1000
 
     org = models.ForeignKey(Org, on_delete=models.PROTECT, related_name="notification_counts")
     user = models.ForeignKey(User, on_delete=models.PROTECT, related_name="notification_counts")
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.7 on 2022-09-20 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orgs", "0102_alter_org_brand_alter_org_plan"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="org",
+            name="delete_progress",
+            field=models.JSONField(null=True),
+        ),
+    ]
@@ -1,6 +1,6 @@
-import itertools
 import logging
 import os
+import time
 from abc import ABCMeta
 from collections import defaultdict
 from datetime import timedelta
@@ -21,7 +21,9 @@ from django.conf import settings
 from django.contrib.auth.models import Group, Permission, User as AuthUser
 from django.contrib.postgres.fields import ArrayField
 from django.db import models, transaction
-from django.db.models import Count, F, Prefetch, Q, Sum
+from django.db.models import Count, F, Q, Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.text import slugify
@@ -30,8 +32,8 @@ from django.utils.translation import gettext_lazy as _
 from temba import mailroom
 from temba.archives.models import Archive
 from temba.locations.models import AdminBoundary
-from temba.utils import chunk_list, json, languages
-from temba.utils.cache import get_cacheable_result
+from temba.utils import json, languages, on_transaction_commit
+from temba.utils.cache import get_cacheable, get_cacheable_result
 from temba.utils.dates import datetime_to_str
 from temba.utils.email import send_template_email
 from temba.utils.models import JSONAsTextField, JSONField, SquashableModel
@@ -429,6 +431,11 @@ class Org(SmartModel):
     LIMIT_TEAMS = "teams"
 
     DELETE_DELAY_DAYS = 7  # how many days after releasing that an org is deleted
+    DELETE_BATCH_SIZE = 1000  # how many rows at a time are deleted from high volume tables
+
+    DEPENDENCY_GRAPH_KEY = "org:%d:dependency_graph:%d:%s"
+    DEPENDENCY_GRAPH_VERSION_KEY = "org:%d:dependency_graph_version"
+    DEPENDENCY_GRAPH_TTL = 60 * 60 * 24
 
     BLOCKER_SUSPENDED = _(
         "Sorry, your workspace is currently suspended. To re-enable starting flows and sending messages, please "
@@ -543,6 +550,9 @@ class Org(SmartModel):
     released_on = models.DateTimeField(null=True)
     deleted_on = models.DateTimeField(null=True)
 
+    # checkpoint of bulk deletion so that it can be resumed, and counts of rows deleted per table
+    delete_progress = models.JSONField(null=True)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -1454,69 +1464,116 @@ class Org(SmartModel):
 
         self.save(update_fields=("is_multi_user", "is_multi_org"))
 
-    def generate_dependency_graph(self, include_campaigns=True, include_triggers=False, include_archived=False):
+    def invalidate_dependency_graph(self):
         """
-        Generates a dict of all exportable flows and campaigns for this org with each object's immediate dependencies
+        Invalidates the cached dependency graphs for this org, e.g. because a flow's dependencies have changed
         """
-        from temba.campaigns.models import Campaign, CampaignEvent
-        from temba.contacts.models import ContactField, ContactGroup
-        from temba.flows.models import Flow
+        invalidate_dependency_graph(self.id)
 
-        campaign_prefetches = (
-            Prefetch(
-                "events",
-                queryset=CampaignEvent.objects.filter(is_active=True).exclude(flow__is_system=True),
-                to_attr="flow_events",
-            ),
-            "flow_events__flow",
-        )
+    def _get_dependency_edges(self, include_campaigns: bool, include_triggers: bool, include_archived: bool) -> dict:
+        """
+        Gets the cached dependency graph as a dict of component keys like flow:123 to lists of component keys
+        """
+        r = get_redis_connection()
+        version = int(r.get(self.DEPENDENCY_GRAPH_VERSION_KEY % self.id) or 0)
+        options = "".join(str(int(o)) for o in (include_campaigns, include_triggers, include_archived))
+        cache_key = self.DEPENDENCY_GRAPH_KEY % (self.id, version, options)
 
-        all_flows = self.flows.filter(is_active=True).exclude(is_system=True)
+        def calculate():
+            edges = self._calculate_dependency_edges(include_campaigns, include_triggers, include_archived)
+            return edges, self.DEPENDENCY_GRAPH_TTL
 
-        if include_campaigns:
-            all_campaigns = (
-                self.campaigns.filter(is_active=True).select_related("group").prefetch_related(*campaign_prefetches)
-            )
-        else:
-            all_campaigns = Campaign.objects.none()
+        return get_cacheable(cache_key, calculate, r=r)
+
+    def _calculate_dependency_edges(self, include_campaigns: bool, include_triggers: bool, include_archived: bool):
+        from temba.campaigns.models import CampaignEvent
+        from temba.flows.models import Flow
+
+        all_flows = self.flows.filter(is_active=True, is_system=False)
+        all_campaigns = self.campaigns.filter(is_active=True) if include_campaigns else self.campaigns.none()
 
         if not include_archived:
             all_flows = all_flows.filter(is_archived=False)
             all_campaigns = all_campaigns.filter(is_archived=False)
 
-        # build dependency graph for all flows and campaigns
-        dependencies = defaultdict(set)
-        for flow in all_flows:
-            dependencies[flow] = flow.get_export_dependencies()
-        for campaign in all_campaigns:
-            dependencies[campaign] = set([e.flow for e in campaign.flow_events])
-
-        # replace any dependency on a group with that group's associated campaigns - we're not actually interested
-        # in flow-group-flow relationships - only relationships that go through a campaign
-        campaigns_by_group = defaultdict(list)
+        edges = defaultdict(set)
+
+        # dependencies are symmetric, i.e. if A depends on B, B depends on A
+        def add_edge(a, b):
+            edges[a].add(b)
+            edges[b].add(a)
+
+        for flow_id in all_flows.values_list("id", flat=True):
+            edges.setdefault(f"flow:{flow_id}", set())
+
+        for campaign_id in all_campaigns.values_list("id", flat=True):
+            edges.setdefault(f"campaign:{campaign_id}", set())
+
+        flow_deps = Flow.flow_dependencies.through.objects.filter(from_flow__in=all_flows)
+        for from_id, to_id in flow_deps.values_list("from_flow_id", "to_flow_id"):
+            add_edge(f"flow:{from_id}", f"flow:{to_id}")
+
+        # we're not interested in flow-group-flow relationships - only relationships that go through a campaign
         if include_campaigns:
-            for campaign in self.campaigns.filter(is_active=True).select_related("group"):
-                campaigns_by_group[campaign.group].append(campaign)
-
-        for c, deps in dependencies.items():
-            if isinstance(c, Flow):
-                for d in list(deps):
-                    # not interested in groups or fields for now
-                    if isinstance(d, ContactField):
-                        deps.remove(d)
-                    if isinstance(d, ContactGroup):
-                        deps.remove(d)
-                        deps.update(campaigns_by_group[d])
+            campaigns_by_group = defaultdict(list)
+            for group_id, campaign_id in self.campaigns.filter(is_active=True).values_list("group_id", "id"):
+                campaigns_by_group[group_id].append(campaign_id)
+
+            group_deps = Flow.group_dependencies.through.objects.filter(flow__in=all_flows)
+            for flow_id, group_id in group_deps.values_list("flow_id", "contactgroup_id"):
+                for campaign_id in campaigns_by_group[group_id]:
+                    add_edge(f"flow:{flow_id}", f"campaign:{campaign_id}")
+
+            events = CampaignEvent.objects.filter(campaign__in=all_campaigns, is_active=True).exclude(
+                flow__is_system=True
+            )
+            for campaign_id, flow_id in events.values_list("campaign_id", "flow_id"):
+                add_edge(f"campaign:{campaign_id}", f"flow:{flow_id}")
 
         if include_triggers:
-            all_triggers = self.triggers.filter(is_archived=False, is_active=True).select_related("flow")
-            for trigger in all_triggers:
-                dependencies[trigger] = {trigger.flow}
+            triggers = self.triggers.filter(is_archived=False, is_active=True)
+            for trigger_id, flow_id in triggers.values_list("id", "flow_id"):
+                add_edge(f"trigger:{trigger_id}", f"flow:{flow_id}")
+
+        return {key: sorted(deps) for key, deps in edges.items()}
+
+    def _load_dependency_components(self, keys) -> dict:
+        """
+        Loads the flows, campaigns and triggers for the given component keys
+        """
+        from temba.campaigns.models import Campaign
+        from temba.flows.models import Flow
+        from temba.triggers.models import Trigger
+
+        ids_by_type = defaultdict(list)
+        for key in keys:
+            type_name, obj_id = key.split(":")
+            ids_by_type[type_name].append(int(obj_id))
+
+        querysets = {
+            "flow": lambda ids: Flow.objects.filter(id__in=ids),
+            "campaign": lambda ids: Campaign.objects.filter(id__in=ids).select_related("group"),
+            "trigger": lambda ids: Trigger.objects.filter(id__in=ids).select_related("flow"),
+        }
 
-        # make dependencies symmetric, i.e. if A depends on B, B depends on A
-        for c, deps in dependencies.copy().items():
-            for d in deps:
-                dependencies[d].add(c)
+        components = {}
+        for type_name, ids in ids_by_type.items():
+            for obj in querysets[type_name](ids):
+                components[f"{type_name}:{obj.id}"] = obj
+
+        return components
+
+    def generate_dependency_graph(self, include_campaigns=True, include_triggers=False, include_archived=False):
+        """
+        Generates a dict of all exportable flows and campaigns for this org with each object's immediate dependencies
+        """
+        edges = self._get_dependency_edges(include_campaigns, include_triggers, include_archived)
+        components = self._load_dependency_components(edges.keys())
+
+        dependencies = defaultdict(set)
+        for key, deps in edges.items():
+            if key in components:
+                dependencies[components[key]] = {components[d] for d in deps if d in components}
 
         return dependencies
 
@@ -1526,29 +1583,24 @@ class Org(SmartModel):
         """
         Given a set of flows and and a set of campaigns, returns a new set including all dependencies
         """
-        dependencies = self.generate_dependency_graph(
-            include_campaigns=include_campaigns, include_triggers=include_triggers, include_archived=include_archived
-        )
+        edges = self._get_dependency_edges(include_campaigns, include_triggers, include_archived)
 
-        primary_components = set(itertools.chain(flows, campaigns))
-        all_components = set()
+        primary_components = {f"flow:{f.id}": f for f in flows}
+        primary_components.update({f"campaign:{c.id}": c for c in campaigns})
 
-        def add_component(c):
-            if c in all_components:
-                return
+        # walk the graph with an explicit stack so that long dependency chains can't hit the recursion limit
+        resolved = set()
+        pending = list(primary_components.keys())
+        while pending:
+            key = pending.pop()
+            if key not in resolved:
+                resolved.add(key)
+                pending.extend(edges.get(key, ()))
 
-            all_components.add(c)
-            if c in primary_components:
-                primary_components.remove(c)
+        components = self._load_dependency_components(resolved.difference(primary_components))
+        components.update(primary_components)
 
-            for d in dependencies[c]:
-                add_component(d)
-
-        while primary_components:
-            component = next(iter(primary_components))
-            add_component(component)
-
-        return all_components
+        return set(components.values())
 
     def initialize(self, branding=None, topup_size=None, sample_flows=True):
         """
@@ -1614,14 +1666,92 @@ class Org(SmartModel):
         for org_user in self.users.all():
             self.remove_user(org_user)
 
-    def delete(self):
+    def _get_bulk_delete_steps(self) -> list:
+        """
+        Gets the steps for deleting this org's high volume data as tuples of (name, queryset, before batch callback),
+        ordered so that rows are always deleted before the rows they reference
+        """
+        from temba.campaigns.models import EventFire
+        from temba.channels.models import ChannelEvent, ChannelLog
+        from temba.contacts.models import Contact, ContactURN
+        from temba.flows.models import FlowRun
+        from temba.ivr.models import Call
+        from temba.msgs.models import Attachment, Msg
+
+        def delete_attachments(msg_ids):
+            incoming = Msg.objects.filter(id__in=msg_ids, direction=Msg.DIRECTION_IN).exclude(attachments=None)
+            for attachments in incoming.values_list("attachments", flat=True):
+                for attachment in Attachment.parse_all(attachments):
+                    attachment.delete()
+
+        def delete_from_results(run_ids):
+            FlowRun.objects.filter(id__in=run_ids).update(delete_from_results=True)
+
+        return [
+            ("http_logs", self.http_logs.all(), None),
+            ("webhook_counts", self.webhook_counts.all(), None),
+            ("channel_logs", ChannelLog.objects.filter(channel__org=self), None),
+            ("msgs", self.msgs.all(), delete_attachments),
+            ("channel_events", ChannelEvent.objects.filter(org=self), None),
+            ("runs", self.runs.all(), delete_from_results),
+            ("sessions", self.sessions.all(), None),
+            ("calls", Call.objects.filter(org=self), None),
+            ("ticket_events", self.ticket_events.all(), None),
+            ("tickets", self.tickets.all(), None),
+            ("airtime_transfers", self.airtime_transfers.all(), None),
+            ("campaign_fires", EventFire.objects.filter(contact__org=self), None),
+            ("urns", ContactURN.objects.filter(org=self), None),
+            ("contacts", Contact.objects.filter(org=self), None),
+        ]
+
+    def _bulk_delete(self, deadline: float = None) -> bool:
+        """
+        Deletes this org's high volume data in batches of set-based deletes, checkpointing progress after each step.
+        Returns whether all steps are complete or False if the deadline passed first.
+        """
+        progress = self.delete_progress or {"completed": [], "deleted": {}}
+
+        for name, queryset, before_batch in self._get_bulk_delete_steps():
+            if name in progress["completed"]:
+                continue
+
+            while True:
+                batch_ids = list(queryset.order_by("id").values_list("id", flat=True)[: self.DELETE_BATCH_SIZE])
+                if not batch_ids:
+                    break
+
+                if before_batch:
+                    before_batch(batch_ids)
+
+                # this deletes any cascaded rows too, e.g. many-to-many memberships, and gives us counts per table
+                _, deleted = queryset.model.objects.filter(id__in=batch_ids).delete()
+                for table, count in deleted.items():
+                    progress["deleted"][table] = progress["deleted"].get(table, 0) + count
+
+                if deadline and time.monotonic() >= deadline:
+                    self.delete_progress = progress
+                    self.save(update_fields=("delete_progress",))
+                    return False
+
+            progress["completed"].append(name)
+            self.delete_progress = progress
+            self.save(update_fields=("delete_progress",))
+
+        return True
+
+    def delete(self, *, time_budget: float = None) -> bool:
         """
-        Does an actual delete of this org
+        Does an actual delete of this org. High volume data is deleted first in batches and if a time budget in seconds
+        is given and runs out, we stop and return False so that deletion can be resumed by calling this again.
         """
 
         assert not self.is_active and self.released_on, "can't delete an org which hasn't been released"
         assert not self.deleted_on, "can't delete an org twice"
 
+        deadline = time.monotonic() + time_budget if time_budget else None
+        if not self._bulk_delete(deadline):
+            return False
+
         user = self.modified_by
 
         # delete notifications and exports
@@ -1636,13 +1766,6 @@ class Org(SmartModel):
             label.release(user)
             label.delete()
 
-        msg_ids = self.msgs.all().values_list("id", flat=True)
-
-        # might be a lot of messages, batch this
-        for id_batch in chunk_list(msg_ids, 1000):
-            for msg in self.msgs.filter(id__in=id_batch):
-                msg.delete()
-
         # our system label counts
         self.system_labels.all().delete()
 
@@ -1660,21 +1783,7 @@ class Org(SmartModel):
         for flow_label in self.flow_labels.filter(parent=None):
             flow_label.delete()
 
-        # delete contact-related data
-        self.http_logs.all().delete()
-        self.sessions.all().delete()
-        self.ticket_events.all().delete()
-        self.tickets.all().delete()
         self.topics.all().delete()
-        self.airtime_transfers.all().delete()
-
-        # delete our contacts
-        for contact in self.contacts.all():
-            contact.release(user, immediately=True)
-            contact.delete()
-
-        # delete all our URNs
-        self.urns.all().delete()
 
         # delete our fields
         for contactfield in self.fields.all():
@@ -1747,6 +1856,9 @@ class Org(SmartModel):
         self.surveyor_password = None
         self.save()
 
+        logger.info(f"Deleted org #{self.id}, rows deleted: {self.delete_progress['deleted']}")
+        return True
+
     def as_environment_def(self):
         """
         Returns this org as an environment definition as used by the flow engine
@@ -2057,6 +2169,8 @@ class TopUpCredits(SquashableModel):
     """
 
     squash_over = ("topup_id",)
+    squash_sums = ("used",)
+    squash_batch_size = 1000
 
     topup = models.ForeignKey(TopUp, on_delete=models.PROTECT)
     used = models.IntegerField()  # how many credits were used, can be negative
@@ -2222,3 +2336,21 @@ class OrgActivity(models.Model):
 
     class Meta:
         unique_together = ("org", "day")
+
+
+def invalidate_dependency_graph(org_id: int):
+    # wait for the transaction to commit so that another request can't cache a graph built from pre-commit data under
+    # the new version
+    on_transaction_commit(lambda: get_redis_connection().incr(Org.DEPENDENCY_GRAPH_VERSION_KEY % org_id))
+
+
+@receiver(post_save, sender="flows.Flow")
+@receiver(post_save, sender="campaigns.Campaign")
+@receiver(post_save, sender="triggers.Trigger")
+def invalidate_org_dependency_graph(sender, instance, **kwargs):
+    invalidate_dependency_graph(instance.org_id)
+
+
+@receiver(post_save, sender="campaigns.CampaignEvent")
+def invalidate_campaign_dependency_graph(sender, instance, **kwargs):
+    invalidate_dependency_graph(instance.campaign.org_id)
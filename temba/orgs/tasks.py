@@ -1,6 +1,8 @@
 import logging
+import time
 from datetime import timedelta
 
+from django.conf import settings
 from django.utils import timezone
 
 from celery import shared_task
@@ -11,6 +13,7 @@ from temba.flows.models import ExportFlowResultsTask
 from temba.flows.tasks import export_flow_results_task
 from temba.msgs.models import ExportMessagesTask
 from temba.msgs.tasks import export_messages_task
+from temba.utils import chunk_list
 from temba.utils.celery import nonoverlapping_task
 
 from .models import Invitation, Org, OrgActivity, TopUpCredits
@@ -34,9 +37,25 @@ def normalize_contact_tels_task(org_id):
 
     # do we have an org-level country code? if so, try to normalize any numbers not starting with +
     if org.default_country_code:
-        urns = ContactURN.objects.filter(org=org, scheme=URN.TEL_SCHEME).exclude(path__startswith="+").iterator()
-        for urn in urns:
-            urn.ensure_number_normalization(org.default_country_code)
+        urns = ContactURN.objects.filter(org=org, scheme=URN.TEL_SCHEME).exclude(path__startswith="+")
+
+        for batch in chunk_list(urns.only("id", "identity", "path").iterator(), 1000):
+            normalized = URN.normalize_all([u.identity for u in batch], org.default_country_code)
+            changed = [(u, n) for u, n in zip(batch, normalized) if n.identity and n.identity != u.identity]
+
+            # don't trounce existing contacts with those numbers already
+            existing = ContactURN.objects.filter(org=org, identity__in=[n.identity for u, n in changed])
+            taken = set(existing.values_list("identity", flat=True))
+            updated = []
+
+            for urn, norm in changed:
+                if norm.identity not in taken:
+                    taken.add(norm.identity)
+                    urn.identity = norm.identity
+                    urn.path = URN.to_parts(norm.identity)[1]
+                    updated.append(urn)
+
+            ContactURN.objects.bulk_update(updated, ("identity", "path"))
 
 
 @nonoverlapping_task(track_started=True, name="squash_topupcredits", lock_key="squash_topupcredits", lock_timeout=7200)
@@ -76,10 +95,18 @@ def update_org_activity(now=None):
 
 @nonoverlapping_task(track_started=True, name="delete_orgs_task", lock_key="delete_orgs_task", lock_timeout=7200)
 def delete_orgs_task():
-    # for each org that was released over 7 days ago, delete it for real
+    # for each org that was released over 7 days ago, delete it for real, resuming any partially deleted orgs
     week_ago = timezone.now() - timedelta(days=Org.DELETE_DELAY_DAYS)
-    for org in Org.objects.filter(is_active=False, released_on__lt=week_ago, deleted_on=None):
+    start = time.monotonic()
+
+    for org in Org.objects.filter(is_active=False, released_on__lt=week_ago, deleted_on=None).order_by("released_on"):
+        time_budget = settings.ORG_DELETE_TIME_BUDGET - (time.monotonic() - start)
+        if time_budget <= 0:
+            break
+
         try:
-            org.delete()
+            if not org.delete(time_budget=time_budget):
+                logging.info(f"ran out of time deleting {org.name}, will resume on next run")
+                break
         except Exception:  # pragma: no cover
             logging.exception(f"exception while deleting {org.name}")
@@ -8,6 +8,7 @@ from urllib.parse import urlencode
 import pytz
 from bs4 import BeautifulSoup
 from dateutil.relativedelta import relativedelta
+from django_redis import get_redis_connection
 from smartmin.users.models import FailedLogin, RecoveryToken
 
 from django.conf import settings
@@ -1076,6 +1077,58 @@ class OrgDeleteTest(TembaNonAtomicTest):
         # self.parent_org.clear_credit_cache()
         # self.assertEqual(994, self.parent_org.get_credits_remaining())
 
+    def test_delete_resumable(self):
+        self.parent_org.release(self.customer_support)
+
+        num_msgs = Msg.objects.filter(org=self.parent_org).count()
+        num_runs = FlowRun.objects.filter(org=self.parent_org).count()
+        num_contacts = Contact.objects.filter(org=self.parent_org).count()
+
+        with patch("temba.utils.s3.client", return_value=self.mock_s3):
+            # with a tiny batch size and time budget, we only get through one batch per call
+            with patch("temba.orgs.models.Org.DELETE_BATCH_SIZE", 1):
+                self.assertFalse(self.parent_org.delete(time_budget=0.000001))
+
+                self.parent_org.refresh_from_db()
+                self.assertIsNone(self.parent_org.deleted_on)
+                self.assertEqual(
+                    {"completed": [], "deleted": {"request_logs.HTTPLog": 1}}, self.parent_org.delete_progress
+                )
+
+                num_calls = 1
+                while not self.parent_org.delete(time_budget=0.000001):
+                    num_calls += 1
+
+            self.assertGreater(num_calls, num_msgs + num_runs + num_contacts)
+
+        self.parent_org.refresh_from_db()
+        self.assertIsNotNone(self.parent_org.deleted_on)
+        self.assertEqual(
+            [
+                "http_logs",
+                "webhook_counts",
+                "channel_logs",
+                "msgs",
+                "channel_events",
+                "runs",
+                "sessions",
+                "calls",
+                "ticket_events",
+                "tickets",
+                "airtime_transfers",
+                "campaign_fires",
+                "urns",
+                "contacts",
+            ],
+            self.parent_org.delete_progress["completed"],
+        )
+        self.assertEqual(num_msgs, self.parent_org.delete_progress["deleted"]["msgs.Msg"])
+        self.assertEqual(num_runs, self.parent_org.delete_progress["deleted"]["flows.FlowRun"])
+        self.assertEqual(num_contacts, self.parent_org.delete_progress["deleted"]["contacts.Contact"])
+
+        self.assertFalse(Msg.objects.filter(org=self.parent_org).exists())
+        self.assertFalse(Contact.objects.filter(org=self.parent_org).exists())
+
     def test_delete_task(self):
         # can't delete an unreleased org
         with self.assertRaises(AssertionError):
@@ -3254,9 +3307,10 @@ class OrgCRUDLTest(TembaTest, CRUDLTestMixin):
         self.assertEqual("Staff", menu[0]["name"])
 
         menu = self.client.get(f"{menu_url}staff/").json()["results"]
-        self.assertEqual(2, len(menu))
+        self.assertEqual(3, len(menu))
         self.assertEqual("Workspaces", menu[0]["name"])
         self.assertEqual("Users", menu[1]["name"])
+        self.assertEqual("Tasks", menu[2]["name"])
 
     def test_read(self):
         read_url = reverse("orgs.org_read", args=[self.org.id])
@@ -4584,6 +4638,70 @@ class BulkExportTest(TembaTest):
         self.assertEqual(set(parent.field_dependencies.all()), {age, gender})
         self.assertEqual(set(parent.group_dependencies.all()), {farmers})
 
+    def test_dependency_graph(self):
+        parent = self.create_flow("Parent")
+        child = self.create_flow("Child")
+        other = self.create_flow("Other")
+
+        parent.update_dependencies([{"type": "flow", "uuid": str(child.uuid)}])
+
+        dep_graph = self.org.generate_dependency_graph()
+        self.assertEqual(dep_graph[parent], {child})
+        self.assertEqual(dep_graph[child], {parent})
+        self.assertEqual(dep_graph[other], set())
+
+        # graph is now cached so resolving only needs to load the dependencies
+        with self.assertNumQueries(1):
+            self.assertEqual({parent, child}, self.org.resolve_dependencies([parent], []))
+
+        # updating a flow's dependencies invalidates the cached graph
+        other.update_dependencies([{"type": "flow", "uuid": str(child.uuid)}])
+
+        self.assertEqual({parent, child, other}, self.org.resolve_dependencies([parent], []))
+
+        # as does adding a campaign event or a trigger
+        planting_date = self.create_field("planting_date", "Planting Date", value_type=ContactField.TYPE_DATETIME)
+        campaign = Campaign.create(self.org, self.admin, "Reminders", self.create_group("Farmers", contacts=[]))
+        reminder = self.create_flow("Reminder")
+        CampaignEvent.create_flow_event(self.org, self.admin, campaign, planting_date, 1, "D", reminder)
+        trigger = Trigger.create(self.org, self.admin, Trigger.TYPE_KEYWORD, reminder, keyword="remind")
+
+        self.assertEqual({campaign, reminder}, self.org.resolve_dependencies([reminder], []))
+        self.assertEqual(
+            {campaign, reminder, trigger}, self.org.resolve_dependencies([], [campaign], include_triggers=True)
+        )
+        self.assertEqual({reminder}, self.org.resolve_dependencies([reminder], [], include_campaigns=False))
+
+        # when not in eager mode, invalidation waits for the transaction to commit
+        r = get_redis_connection()
+        version = r.get(Org.DEPENDENCY_GRAPH_VERSION_KEY % self.org.id)
+
+        with override_settings(CELERY_TASK_ALWAYS_EAGER=False):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.org.invalidate_dependency_graph()
+
+                self.assertEqual(version, r.get(Org.DEPENDENCY_GRAPH_VERSION_KEY % self.org.id))
+
+            for callback in callbacks:
+                callback()
+
+        self.assertNotEqual(version, r.get(Org.DEPENDENCY_GRAPH_VERSION_KEY % self.org.id))
+
+        # long chains of dependencies don't hit the recursion limit
+        chain = Flow.objects.bulk_create(
+            [
+                Flow(
+                    org=self.org, name=f"Chain {i}", created_by=self.admin, modified_by=self.admin, saved_by=self.admin
+                )
+                for i in range(1100)
+            ]
+        )
+        through = Flow.flow_dependencies.through
+        through.objects.bulk_create([through(from_flow=f1, to_flow=f2) for f1, f2 in zip(chain[:-1], chain[1:])])
+        self.org.invalidate_dependency_graph()
+
+        self.assertEqual(set(chain), self.org.resolve_dependencies([chain[-1]], []))
+
     @patch("temba.mailroom.client.MailroomClient.flow_inspect")
     def test_import_flow_issues(self, mock_flow_inspect):
         mock_flow_inspect.side_effect = [
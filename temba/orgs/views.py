@@ -1379,6 +1379,12 @@ class OrgCRUDL(SmartCRUDL):
                         icon="users",
                         href=reverse("orgs.user_list"),
                     ),
+                    self.create_menu_item(
+                        menu_id="tasks",
+                        name=_("Tasks"),
+                        icon="activity",
+                        href=reverse("dashboard.dashboard_task_stats"),
+                    ),
                 ]
 
             menu = [
@@ -1530,25 +1536,18 @@ class OrgCRUDL(SmartCRUDL):
             unbucketed = set(dependencies.keys())
             buckets = []
 
-            # helper method to add a component and its dependencies to a bucket
-            def collect_component(c, bucket):
-                if c in bucket:  # pragma: no cover
-                    return
-
-                unbucketed.remove(c)
-                bucket.add(c)
-
-                for d in dependencies[c]:
-                    if d in unbucketed:
-                        collect_component(d, bucket)
-
             while unbucketed:
-                component = next(iter(unbucketed))
-
-                bucket = set()
+                pending = [unbucketed.pop()]
+                bucket = set(pending)
                 buckets.append(bucket)
 
-                collect_component(component, bucket)
+                # add the component and its dependencies to the bucket
+                while pending:
+                    for d in dependencies[pending.pop()]:
+                        if d in unbucketed:
+                            unbucketed.remove(d)
+                            bucket.add(d)
+                            pending.append(d)
 
             # collections with only one non-group component should be merged into a single "everything else" collection
             non_single_buckets = []
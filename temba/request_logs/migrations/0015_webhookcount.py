@@ -0,0 +1,77 @@
+# Generated by Django 4.0.7 on 2022-11-02 14:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+SQL = """
+----------------------------------------------------------------------
+-- Handles insertion of HTTP logs, counting webhook calls by host, hour, status and time bucket. The host excludes
+-- any userinfo so that credentials aren't recorded, and is truncated to fit the column.
+----------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION temba_httplog_on_insert() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO request_logs_webhookcount("org_id", "flow_id", "host", "hour", "status_code", "bucket", "count", "is_squashed")
+  VALUES (
+    NEW.org_id,
+    NEW.flow_id,
+    left(COALESCE(substring(NEW.url FROM '^[A-Za-z][A-Za-z0-9+.-]*://(?:[^@/?#]*@)?([^/?#]*)'), ''), 255),
+    date_trunc('hour', NEW.created_on),
+    COALESCE(NEW.status_code, 0),
+    width_bucket(NEW.request_time, ARRAY[25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 15000, 30000]),
+    1,
+    FALSE
+  );
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER temba_httplog_on_insert
+    AFTER INSERT ON request_logs_httplog
+    FOR EACH ROW WHEN (NEW.flow_id IS NOT NULL) EXECUTE PROCEDURE temba_httplog_on_insert();
+"""
+
+REVERSE_SQL = """
+DROP TRIGGER temba_httplog_on_insert ON request_logs_httplog;
+DROP FUNCTION temba_httplog_on_insert();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flows", "0302_exportflowresultstask_file_format"),
+        ("orgs", "0103_org_delete_progress"),
+        ("request_logs", "0014_squashed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookCount",
+            fields=[
+                ("is_squashed", models.BooleanField(default=False)),
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False)),
+                ("host", models.CharField(max_length=255)),
+                ("hour", models.DateTimeField()),
+                ("status_code", models.IntegerField()),
+                ("bucket", models.IntegerField()),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "flow",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT, related_name="webhook_counts", to="flows.flow"
+                    ),
+                ),
+                (
+                    "org",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT, related_name="webhook_counts", to="orgs.org"
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["org", "hour"], name="request_log_org_id_fd2d2a_idx")],
+            },
+        ),
+        migrations.RunSQL(SQL, REVERSE_SQL),
+    ]
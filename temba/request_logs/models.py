@@ -1,9 +1,10 @@
 import logging
+from collections import defaultdict
 
 import requests
 
 from django.db import models
-from django.db.models import Index, Q
+from django.db.models import Index, Q, Sum
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -15,6 +16,7 @@ from temba.orgs.models import Org
 from temba.tickets.models import Ticketer
 from temba.utils import redact
 from temba.utils.http import HttpLog
+from temba.utils.models import SquashableModel
 
 logger = logging.getLogger(__name__)
 
@@ -157,3 +159,111 @@ class HTTPLog(models.Model):
             # for ticketer specific log view
             Index(fields=("ticketer", "-created_on")),
         )
+
+
+class WebhookCount(SquashableModel):
+    """
+    This model is maintained by Postgres triggers and maintains hourly histograms of webhook call times and status
+    codes for each flow and host. This allows for fast latency and failure summaries without scanning HTTP logs.
+    """
+
+    squash_over = ("org_id", "flow_id", "host", "hour", "status_code", "bucket")
+    squash_batch_size = 1000
+
+    # upper bounds in milliseconds of the time buckets, the last bucket being for anything slower than the last bound,
+    # and which must match the bounds used by the database trigger
+    BUCKET_BOUNDS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 15000, 30000)
+
+    PERCENTILES = (50, 95, 99)
+
+    STATUS_TIMEOUT = -1
+
+    org = models.ForeignKey(Org, on_delete=models.PROTECT, related_name="webhook_counts")
+    flow = models.ForeignKey(Flow, on_delete=models.PROTECT, related_name="webhook_counts")
+    host = models.CharField(max_length=255)
+    hour = models.DateTimeField()
+    status_code = models.IntegerField()
+    bucket = models.IntegerField()  # index of the time bucket, i.e. the number of bounds <= the request time
+    count = models.IntegerField(default=0)
+
+    @classmethod
+    def get_squash_query(cls, distinct_set):  # pragma: no cover
+        sql = """
+        WITH removed as (
+            DELETE FROM %(table)s WHERE "org_id" = %%s AND "flow_id" = %%s AND "host" = %%s AND "hour" = %%s
+            AND "status_code" = %%s AND "bucket" = %%s RETURNING "count"
+        )
+        INSERT INTO %(table)s("org_id", "flow_id", "host", "hour", "status_code", "bucket", "count", "is_squashed")
+        VALUES (%%s, %%s, %%s, %%s, %%s, %%s, GREATEST(0, (SELECT SUM("count") FROM removed)), TRUE);
+        """ % {
+            "table": cls._meta.db_table
+        }
+
+        params = (
+            distinct_set.org_id,
+            distinct_set.flow_id,
+            distinct_set.host,
+            distinct_set.hour,
+            distinct_set.status_code,
+            distinct_set.bucket,
+        ) * 2
+
+        return sql, params
+
+    @classmethod
+    def get_summaries(cls, counts, key: str = "host") -> list:
+        """
+        Summarizes the given counts, grouped by host or flow_id, into times at each percentile and status and failure
+        breakdowns. The time for a percentile is the upper bound of the bucket it falls in, or the last bound if it falls
+        in the bucket of slower calls.
+        """
+        histograms = defaultdict(lambda: [0] * (len(cls.BUCKET_BOUNDS) + 1))
+        status_counts = defaultdict(lambda: defaultdict(int))
+
+        for item_key, status_code, bucket, count in (
+            counts.values_list(key, "status_code", "bucket").annotate(count_sum=Sum("count")).order_by()
+        ):
+            histograms[item_key][bucket] += count
+            status_counts[item_key][status_code] += count
+
+        summaries = []
+        for item_key, histogram in histograms.items():
+            total = sum(histogram)
+            if not total:
+                continue
+
+            statuses = status_counts[item_key]
+            num_timeouts = statuses.get(cls.STATUS_TIMEOUT, 0)
+            num_non200s = sum(c for code, c in statuses.items() if code != cls.STATUS_TIMEOUT and code // 100 != 2)
+
+            summaries.append(
+                {
+                    "key": item_key,
+                    "total": total,
+                    "times": {f"p{p}": cls._get_percentile(histogram, total, p) for p in cls.PERCENTILES},
+                    "statuses": [
+                        {"code": code, "count": c, "%": 100 * c // total}
+                        for code, c in sorted(statuses.items())
+                        if code > 0
+                    ],
+                    "failures": {
+                        "non200": {"count": num_non200s, "%": 100 * num_non200s // total},
+                        "timeouts": {"count": num_timeouts, "%": 100 * num_timeouts // total},
+                    },
+                }
+            )
+
+        return summaries
+
+    @classmethod
+    def _get_percentile(cls, histogram: list, total: int, percentile: int) -> int:
+        rank = -(-total * percentile // 100)  # ceiling of the rank of the percentile value
+        seen = 0
+
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if seen >= rank:
+                return cls.BUCKET_BOUNDS[min(bucket, len(cls.BUCKET_BOUNDS) - 1)]
+
+    class Meta:
+        indexes = (Index(fields=("org", "hour")),)
@@ -4,9 +4,9 @@ from django.conf import settings
 from django.utils import timezone
 from django.utils.timesince import timesince
 
-from temba.utils.celery import nonoverlapping_task
+from temba.utils.celery import nonoverlapping_task, record_rows
 
-from .models import HTTPLog
+from .models import HTTPLog, WebhookCount
 
 logger = logging.getLogger(__name__)
 
@@ -32,3 +32,25 @@ def trim_http_logs_task():
             logger.debug(f" > Deleted {num_deleted} http logs")
 
     logger.info(f"Deleted {num_deleted} http logs in {timesince(start)}")
+    record_rows(num_deleted)
+
+    # webhook counts are kept for longer than the logs they summarize
+    trim_before = timezone.now() - settings.RETENTION_PERIODS["webhookcount"]
+    num_deleted = 0
+
+    while True:
+        count_ids = WebhookCount.objects.filter(hour__lt=trim_before).values_list("id", flat=True)[:1000]
+
+        if not count_ids:
+            break
+
+        WebhookCount.objects.filter(id__in=count_ids).delete()
+        num_deleted += len(count_ids)
+
+    logger.info(f"Deleted {num_deleted} webhook counts")
+    record_rows(num_deleted)
+
+
+@nonoverlapping_task(track_started=True, name="squash_webhookcounts", lock_timeout=7200)
+def squash_webhookcounts():
+    WebhookCount.squash()
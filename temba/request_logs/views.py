@@ -1,7 +1,10 @@
-from smartmin.views import SmartCRUDL, SmartListView, SmartReadView, smart_url
+from datetime import timedelta
+
+from smartmin.views import SmartCRUDL, SmartListView, SmartReadView, SmartTemplateView, smart_url
 
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
@@ -10,7 +13,7 @@ from temba.orgs.views import OrgObjPermsMixin, OrgPermsMixin
 from temba.tickets.models import Ticketer
 from temba.utils.views import ContentMenuMixin, SpaMixin
 
-from .models import HTTPLog
+from .models import HTTPLog, WebhookCount
 
 
 class BaseObjLogsView(SpaMixin, OrgObjPermsMixin, SmartListView):
@@ -54,7 +57,7 @@ class BaseObjLogsView(SpaMixin, OrgObjPermsMixin, SmartListView):
 
 class HTTPLogCRUDL(SmartCRUDL):
     model = HTTPLog
-    actions = ("webhooks", "classifier", "ticketer", "read")
+    actions = ("webhooks", "webhook_stats", "classifier", "ticketer", "read")
 
     class Webhooks(ContentMenuMixin, OrgPermsMixin, SmartListView):
         title = _("Webhook Calls")
@@ -64,10 +67,29 @@ class HTTPLogCRUDL(SmartCRUDL):
 
         def build_content_menu(self, menu):
             menu.add_link(_("Flows"), reverse("flows.flow_list"))
+            menu.add_link(_("Statistics"), reverse("request_logs.httplog_webhook_stats"))
 
         def get_queryset(self, **kwargs):
             return super().get_queryset(**kwargs).filter(org=self.request.org, flow__isnull=False)
 
+    class WebhookStats(ContentMenuMixin, OrgPermsMixin, SmartTemplateView):
+        title = _("Webhook Statistics")
+        permission = "request_logs.httplog_webhooks"
+        period = timedelta(days=7)
+
+        def build_content_menu(self, menu):
+            menu.add_link(_("Webhook Calls"), reverse("request_logs.httplog_webhooks"))
+
+        def get_context_data(self, **kwargs):
+            context = super().get_context_data(**kwargs)
+
+            counts = WebhookCount.objects.filter(org=self.request.org, hour__gt=timezone.now() - self.period)
+            summaries = WebhookCount.get_summaries(counts, key="host")
+
+            context["summaries"] = sorted(summaries, key=lambda s: s["total"], reverse=True)
+            context["period_days"] = self.period.days
+            return context
+
     class Classifier(BaseObjLogsView):
         source_field = "classifier"
         source_url = "uuid@classifiers.classifier_read"
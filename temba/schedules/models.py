@@ -1,6 +1,6 @@
 import calendar
 import logging
-from datetime import time, timedelta
+from datetime import date, datetime, time, timedelta
 
 from dateutil.relativedelta import relativedelta
 from smartmin.models import SmartModel
@@ -138,41 +138,90 @@ class Schedule(SmartModel):
         if self.repeat_period == Schedule.REPEAT_NEVER:
             return None
 
-        tz = self.org.timezone
-        hour = self.repeat_hour_of_day
-        minute = self.repeat_minute_of_hour
+        return self._calculate_next_fire(self.org.timezone, now)
 
-        # start from the trigger date
-        next_fire = now.astimezone(tz)
-        next_fire = tz.normalize(next_fire.replace(hour=hour, minute=minute, second=0, microsecond=0))
+    def _calculate_next_fire(self, tz, now):
+        """
+        Calculates the next fire of this repeating schedule after now directly rather than by stepping through days
+        """
+        today = now.astimezone(tz).date()
 
-        # if monthly, set to the day of the month scheduled and move forward until we are in the future
+        # if monthly, it's either this month's fire or next month's
         if self.repeat_period == Schedule.REPEAT_MONTHLY:
-            while True:
-                (weekday, days) = calendar.monthrange(next_fire.year, next_fire.month)
-                day_of_month = min(days, self.repeat_day_of_month)
-                next_fire = tz.normalize(next_fire.replace(day=day_of_month, hour=hour, minute=minute))
-                if next_fire > now:
-                    break
-
-                next_fire = tz.normalize(next_fire + relativedelta(months=1))
+            next_fire = self._localize(tz, self._day_of_month(today))
+            if next_fire <= now:
+                next_fire = self._localize(tz, self._day_of_month(today + relativedelta(months=1)))
 
             return next_fire
 
-        # if weekly, move forward until we're in the future and on an appropriate day of the week
-        elif self.repeat_period == Schedule.REPEAT_WEEKLY:
+        # daily and weekly schedules can fire today if we're not past the time of day, otherwise tomorrow at the earliest
+        earliest = 0 if self._localize(tz, today) > now else 1
+
+        # if weekly, find the nearest of our days of the week from the earliest day
+        if self.repeat_period == Schedule.REPEAT_WEEKLY:
             assert self.repeat_days_of_week != "" and self.repeat_days_of_week is not None
 
-            while next_fire <= now or self._day_of_week(next_fire) not in self.repeat_days_of_week:
-                next_fire = tz.normalize(tz.normalize(next_fire + timedelta(days=1)).replace(hour=hour, minute=minute))
+            earliest_weekday = (today.weekday() + earliest) % 7
+            days_ahead = earliest + min(
+                (self.DAYS_OF_WEEK_OFFSET.index(d) - earliest_weekday) % 7 for d in self.repeat_days_of_week
+            )
+        else:
+            days_ahead = earliest
 
-            return next_fire
+        return self._localize(tz, today + timedelta(days=days_ahead))
 
-        elif self.repeat_period == Schedule.REPEAT_DAILY:
-            while next_fire <= now:
-                next_fire = tz.normalize(tz.normalize(next_fire + timedelta(days=1)).replace(hour=hour, minute=minute))
+    def _day_of_month(self, d: date) -> date:
+        """
+        Gets the day of the given date's month that this schedule fires on, i.e. the last day for short months
+        """
+        days_in_month = calendar.monthrange(d.year, d.month)[1]
+        return date(d.year, d.month, min(days_in_month, self.repeat_day_of_month))
 
-            return next_fire
+    def _localize(self, tz, d: date) -> datetime:
+        """
+        Gets our time of day on the given local date, skipping forward if that time doesn't exist because of DST
+        """
+        return tz.normalize(
+            tz.localize(datetime.combine(d, time(self.repeat_hour_of_day, self.repeat_minute_of_hour)))
+        )
+
+    @classmethod
+    def get_fire_times(cls, schedules, after, before) -> dict:
+        """
+        Gets all the times the given schedules will fire between after and before, as a dict of schedule ids to lists
+        """
+        schedules = list(schedules)
+        org_model = cls._meta.get_field("org").related_model
+
+        # lookup the timezones of any orgs which aren't already loaded in a single query
+        timezones = {s.org_id: s.org.timezone for s in schedules if cls.org.is_cached(s)}
+        missing_org_ids = {s.org_id for s in schedules} - set(timezones.keys())
+        if missing_org_ids:
+            timezones.update(org_model.objects.filter(id__in=missing_org_ids).values_list("id", "timezone"))
+
+        fire_times = {}
+        for schedule in schedules:
+            times = []
+            next_fire = schedule.next_fire
+            repeats = schedule.repeat_period != cls.REPEAT_NEVER and (
+                schedule.repeat_period != cls.REPEAT_WEEKLY or schedule.repeat_days_of_week
+            )
+
+            if next_fire and next_fire <= after and repeats:
+                next_fire = schedule._calculate_next_fire(timezones[schedule.org_id], after)
+
+            while next_fire and next_fire < before:
+                if next_fire > after:
+                    times.append(next_fire)
+
+                if not repeats:
+                    break
+
+                next_fire = schedule._calculate_next_fire(timezones[schedule.org_id], next_fire)
+
+            fire_times[schedule.id] = times
+
+        return fire_times
 
     def get_repeat_days_display(self):
         return [Schedule.DAYS_OF_WEEK_DISPLAY[d] for d in self.repeat_days_of_week] if self.repeat_days_of_week else []
@@ -217,6 +217,68 @@ class ScheduleTest(TembaTest):
 
             self.assertEqual(tc["display"], sched.get_display(), f"display mismatch for {label}")
 
+    def test_calculate_next_fire_dst(self):
+        tz = pytz.timezone("America/Los_Angeles")
+        self.org.timezone = tz
+
+        # 2:30am doesn't exist on the day DST starts so we fire an hour later
+        sched = Schedule.create_schedule(
+            self.org, self.admin, tz.localize(datetime(2019, 3, 8, 2, 30)), Schedule.REPEAT_DAILY
+        )
+        self.assertEqual(
+            tz.localize(datetime(2019, 3, 10, 3, 30)), sched.calculate_next_fire(tz.localize(datetime(2019, 3, 9, 3)))
+        )
+        self.assertEqual(
+            tz.localize(datetime(2019, 3, 11, 2, 30)),
+            sched.calculate_next_fire(tz.localize(datetime(2019, 3, 10, 3, 30))),
+        )
+
+        # weekly schedules can jump straight to a day far ahead
+        sched = Schedule.create_schedule(
+            self.org, self.admin, tz.localize(datetime(2019, 3, 4, 10)), Schedule.REPEAT_WEEKLY, "M"
+        )
+        self.assertEqual(
+            tz.localize(datetime(2019, 3, 11, 10)), sched.calculate_next_fire(tz.localize(datetime(2019, 3, 4, 10)))
+        )
+        self.assertEqual(
+            tz.localize(datetime(2019, 3, 4, 10)), sched.calculate_next_fire(tz.localize(datetime(2019, 3, 4, 9, 59)))
+        )
+
+    def test_get_fire_times(self):
+        tz = self.org.timezone
+
+        daily = Schedule.create_schedule(
+            self.org, self.admin, tz.localize(datetime(2013, 1, 2, 10)), Schedule.REPEAT_DAILY
+        )
+        weekly = Schedule.create_schedule(
+            self.org, self.admin, tz.localize(datetime(2013, 1, 2, 10)), Schedule.REPEAT_WEEKLY, "RS"
+        )
+        monthly = Schedule.create_schedule(
+            self.org, self.admin, tz.localize(datetime(2012, 12, 31, 9)), Schedule.REPEAT_MONTHLY
+        )
+        once = Schedule.create_schedule(
+            self.org, self.admin, tz.localize(datetime(2013, 1, 4, 12)), Schedule.REPEAT_NEVER
+        )
+        Schedule.objects.filter(id__in=[daily.id, weekly.id, monthly.id, once.id]).update(
+            next_fire=tz.localize(datetime(2013, 1, 2, 10))
+        )
+        Schedule.objects.filter(id=once.id).update(next_fire=tz.localize(datetime(2013, 1, 4, 12)))
+
+        schedules = Schedule.objects.filter(id__in=[daily.id, weekly.id, monthly.id, once.id]).order_by("id")
+
+        # orgs are fetched with a single query, then the schedules themselves
+        with self.assertNumQueries(2):
+            fire_times = Schedule.get_fire_times(
+                schedules, tz.localize(datetime(2013, 1, 2, 11)), tz.localize(datetime(2013, 2, 1))
+            )
+
+        self.assertEqual([tz.localize(datetime(2013, 1, d, 10)) for d in range(3, 32)], fire_times[daily.id])
+        self.assertEqual(
+            [tz.localize(datetime(2013, 1, d, 10)) for d in (3, 5, 10, 12, 17, 19, 24, 26, 31)], fire_times[weekly.id]
+        )
+        self.assertEqual([tz.localize(datetime(2013, 1, 31, 9))], fire_times[monthly.id])
+        self.assertEqual([tz.localize(datetime(2013, 1, 4, 12))], fire_times[once.id])
+
     def test_schedule_ui(self):
         # you can no longer create blank schedules from the UI but they're still out there
         schedule = Schedule.create_schedule(self.org, self.admin, None, Schedule.REPEAT_NEVER)
@@ -79,6 +79,13 @@ AWS_BUCKET_DOMAIN = AWS_STORAGE_BUCKET_NAME + ".s3.amazonaws.com"
 # bucket where archives files are stored
 ARCHIVE_BUCKET = "dl-temba-archives"
 
+# number of archives to fetch and decompress ahead of the one being read when iterating over many archives
+ARCHIVE_PREFETCH = 2
+
+# directory and maximum size in bytes of the local disk cache of archive files, which is disabled if no directory is set
+ARCHIVE_CACHE_DIR = None
+ARCHIVE_CACHE_SIZE = 5 * 1024 * 1024 * 1024  # 5GB
+
 # -----------------------------------------------------------------------------------
 # On Unix systems, a value of None will cause Django to use the same
 # timezone as the operating system.
@@ -911,6 +918,7 @@ CELERY_BEAT_SCHEDULE = {
     "delete-orgs": {"task": "delete_orgs_task", "schedule": crontab(hour=4, minute=0)},
     "fail-old-messages": {"task": "fail_old_messages", "schedule": crontab(hour=0, minute=0)},
     "resolve-twitter-ids-task": {"task": "resolve_twitter_ids_task", "schedule": timedelta(seconds=900)},
+    "reconcile-node-counts": {"task": "reconcile_node_counts", "schedule": timedelta(hours=1)},
     "refresh-whatsapp-tokens": {"task": "refresh_whatsapp_tokens", "schedule": crontab(hour=6, minute=0)},
     "refresh-whatsapp-templates": {"task": "refresh_whatsapp_templates", "schedule": timedelta(seconds=900)},
     "send-notification-emails": {"task": "send_notification_emails", "schedule": timedelta(seconds=60)},
@@ -921,6 +929,7 @@ CELERY_BEAT_SCHEDULE = {
     "squash-notificationcounts": {"task": "squash_notificationcounts", "schedule": timedelta(seconds=60)},
     "squash-topupcredits": {"task": "squash_topupcredits", "schedule": timedelta(seconds=60)},
     "squash-ticketcounts": {"task": "squash_ticketcounts", "schedule": timedelta(seconds=60)},
+    "squash-webhookcounts": {"task": "squash_webhookcounts", "schedule": timedelta(seconds=60)},
     "sync-classifier-intents": {"task": "sync_classifier_intents", "schedule": timedelta(seconds=300)},
     "sync-old-seen-channels": {"task": "sync_old_seen_channels_task", "schedule": timedelta(seconds=600)},
     "track-org-channel-counts": {"task": "track_org_channel_counts", "schedule": crontab(hour=4, minute=0)},
@@ -934,6 +943,12 @@ CELERY_BEAT_SCHEDULE = {
     "update-org-activity": {"task": "update_org_activity_task", "schedule": crontab(hour=3, minute=5)},
 }
 
+# how many seconds each run of the delete orgs task can spend deleting before stopping to resume on its next run
+ORG_DELETE_TIME_BUDGET = 5400
+
+# how many flows are reconciled by each queued node count reconciliation task
+NODE_COUNT_RECONCILE_BATCH_SIZE = 100
+
 # -----------------------------------------------------------------------------------
 # Django-rest-framework configuration
 # -----------------------------------------------------------------------------------
@@ -1154,6 +1169,10 @@ MSG_FIELD_SIZE = 640  # used for broadcast text and message campaign events
 FLOW_START_PARAMS_SIZE = 256  # used for params passed to flow start API endpoint
 GLOBAL_VALUE_SIZE = 10_000  # max length of global values
 
+# number of processes across which contact imports normalize URNs, which can't be used from daemonic processes such as
+# prefork celery workers, and so is off by default
+CONTACT_IMPORT_URN_PROCESSES = 0
+
 ORG_LIMIT_DEFAULTS = {
     "channels": 10,
     "fields": 250,
@@ -1174,6 +1193,7 @@ RETENTION_PERIODS = {
     "flowstart": timedelta(days=7),
     "httplog": timedelta(days=3),
     "syncevent": timedelta(days=7),
+    "webhookcount": timedelta(days=30),
     "webhookevent": timedelta(hours=48),
 }
 
@@ -1182,6 +1202,11 @@ RETENTION_PERIODS = {
 # -----------------------------------------------------------------------------------
 MAILROOM_URL = None
 MAILROOM_AUTH_TOKEN = None
+MAILROOM_POOL_SIZE = 10  # max number of keep-alive connections to mailroom per process
+MAILROOM_TIMEOUT = (5, 60)  # connect and read timeouts in seconds for requests to mailroom
+MAILROOM_PARSE_QUERY_TTL = 10  # seconds for which parsed contact queries are memoized
+CONTACT_SEARCH_SESSION_TTL = 60  # seconds for which pages of contact search results are reused
+CONTACT_SEARCH_SESSION_SETTLE = 10  # seconds after contacts are changed for which search results aren't reused
 
 # To allow manage fields to support up to 1000 fields
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 4000
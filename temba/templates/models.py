@@ -165,5 +165,90 @@ class TemplateTranslation(models.Model):
 
         return existing
 
+    @classmethod
+    def bulk_upsert(cls, channel, specs: list) -> list:
+        """
+        Creates or updates the translations for this channel described by the given specs, which are dicts of the
+        arguments to get_or_create, diffing them against the existing translations so that only new or changed
+        translations are written. Returns the translations for all the specs.
+        """
+        now = timezone.now()
+
+        # if a template is included more than once, the last one wins
+        specs = list({s["external_id"]: s for s in specs}.values())
+
+        existing = {}
+        for tt in cls.objects.filter(channel=channel, external_id__in=[s["external_id"] for s in specs]).order_by(
+            "-id"
+        ):
+            existing[tt.external_id] = tt
+
+        to_create, to_update, touched_template_ids = [], [], set()
+
+        for spec in specs:
+            tt = existing.get(spec["external_id"])
+
+            if not tt:
+                to_create.append(spec)
+            elif (
+                tt.status != spec["status"]
+                or tt.content != spec["content"]
+                or tt.country != spec["country"]
+                or tt.language != spec["language"]
+            ):
+                for field in ("status", "content", "variable_count", "language", "country", "namespace"):
+                    setattr(tt, field, spec[field])
+                tt.is_active = True
+
+                to_update.append(tt)
+                touched_template_ids.add(tt.template_id)
+
+        created = []
+        if to_create:
+            names = {s["name"] for s in to_create}
+            existing_names = set(
+                Template.objects.filter(org=channel.org, name__in=names).values_list("name", flat=True)
+            )
+
+            # channels sharing an account can be syncing the same templates concurrently, so another task may create
+            # any of these first, and we re-select them all afterwards to get their ids
+            Template.objects.bulk_create(
+                [
+                    Template(org=channel.org, name=n, created_on=now, modified_on=now)
+                    for n in names
+                    if n not in existing_names
+                ],
+                ignore_conflicts=True,
+            )
+            templates = {t.name: t for t in Template.objects.filter(org=channel.org, name__in=names)}
+            touched_template_ids.update(t.id for t in templates.values())
+
+            created = cls.objects.bulk_create(
+                [
+                    cls(
+                        template=templates[s["name"]],
+                        channel=channel,
+                        content=s["content"],
+                        variable_count=s["variable_count"],
+                        status=s["status"],
+                        language=s["language"],
+                        country=s["country"],
+                        external_id=s["external_id"],
+                        namespace=s["namespace"],
+                    )
+                    for s in to_create
+                ]
+            )
+
+        if to_update:
+            cls.objects.bulk_update(
+                to_update, ("status", "language", "content", "country", "is_active", "variable_count", "namespace")
+            )
+
+        if touched_template_ids:
+            Template.objects.filter(id__in=touched_template_ids).update(modified_on=now)
+
+        return [existing[s["external_id"]] for s in specs if s["external_id"] in existing] + created
+
     def __str__(self):
         return f"{self.template.name} ({self.language} [{self.country}]) {self.status}: {self.content}"
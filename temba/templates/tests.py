@@ -1,3 +1,7 @@
+from unittest.mock import patch
+
+from django.utils import timezone
+
 from temba.tests import TembaTest
 
 from .models import Template, TemplateTranslation
@@ -38,3 +42,71 @@ class TemplateTest(TembaTest):
         # tt2 should be inactive now
         tt2.refresh_from_db()
         self.assertFalse(tt2.is_active)
+
+    def test_bulk_upsert(self):
+        def spec(name, language, country, content, external_id, status=TemplateTranslation.STATUS_PENDING):
+            return dict(
+                name=name,
+                language=language,
+                country=country,
+                content=content,
+                variable_count=1,
+                status=status,
+                external_id=external_id,
+                namespace="",
+            )
+
+        tt1 = TemplateTranslation.get_or_create(
+            self.channel, "hello", "eng", "US", "Hello {{1}}", 1, TemplateTranslation.STATUS_PENDING, "1234", ""
+        )
+        modified_on = tt1.template.modified_on
+
+        specs = [
+            spec("hello", "eng", "US", "Hello {{1}}", "1234"),
+            spec("hello", "fra", "FR", "Bonjour {{1}}", "5678"),
+            spec("goodbye", "eng", "US", "Goodbye {{1}}", "9012"),
+        ]
+
+        # existing translations, templates, new templates, templates again, new translations and touching of templates
+        with self.assertNumQueries(6):
+            tts = TemplateTranslation.bulk_upsert(self.channel, specs)
+
+        self.assertEqual(["1234", "5678", "9012"], [tt.external_id for tt in tts])
+        self.assertEqual(tt1, tts[0])
+        self.assertEqual(2, Template.objects.filter(org=self.org).count())
+        self.assertEqual(3, TemplateTranslation.objects.filter(channel=self.channel).count())
+        self.assertEqual(tt1.template, TemplateTranslation.objects.get(external_id="5678").template)
+        self.assertTrue(Template.objects.get(name="hello").modified_on > modified_on)
+
+        # nothing has changed so nothing to write
+        with self.assertNumQueries(1):
+            tts = TemplateTranslation.bulk_upsert(self.channel, specs)
+
+        self.assertEqual(["1234", "5678", "9012"], [tt.external_id for tt in tts])
+
+        # change the status of one translation
+        specs[2] = spec("goodbye", "eng", "US", "Goodbye {{1}}", "9012", status=TemplateTranslation.STATUS_APPROVED)
+
+        with self.assertNumQueries(3):
+            TemplateTranslation.bulk_upsert(self.channel, specs)
+
+        tt3 = TemplateTranslation.objects.get(external_id="9012")
+        self.assertEqual(TemplateTranslation.STATUS_APPROVED, tt3.status)
+        self.assertEqual(3, TemplateTranslation.objects.filter(channel=self.channel).count())
+
+        # simulate another channel's sync creating a template between our check for it and our creating it
+        real_bulk_create = Template.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            Template.objects.create(
+                org=self.org, name="welcome", created_on=timezone.now(), modified_on=timezone.now()
+            )
+            return real_bulk_create(objs, **kwargs)
+
+        with patch.object(Template.objects, "bulk_create", side_effect=racing_bulk_create):
+            tts = TemplateTranslation.bulk_upsert(
+                self.channel, [spec("welcome", "eng", "US", "Welcome {{1}}", "3456")]
+            )
+
+        welcome = Template.objects.get(org=self.org, name="welcome")
+        self.assertEqual([welcome], [tt.template for tt in tts])
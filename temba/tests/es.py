@@ -15,7 +15,7 @@ class ESMockWithScroll:
             "timed_out": False,
             "took": 1,
             "_scroll_id": "1",
-            "hits": {"hits": self.data},
+            "hits": {"total": {"value": len(self.data), "relation": "eq"}, "hits": self.data},
         }
         patched_object.scroll.return_value = {
             "_shards": {"failed": 0, "successful": 10, "total": 10},
@@ -41,7 +41,7 @@ class ESMockWithScrollMultiple(ESMockWithScroll):
                 "timed_out": False,
                 "took": 1,
                 "_scroll_id": "1",
-                "hits": {"hits": return_value},
+                "hits": {"total": {"value": len(return_value), "relation": "eq"}, "hits": return_value},
             }
             for return_value in self.data
         ]
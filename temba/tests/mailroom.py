@@ -326,15 +326,16 @@ def _wrap_test_method(f, mock_client: bool, mock_queue: bool, instance, *args, *
             mock_get_client.return_value = TestClient(mocks)
 
         if mock_queue:
-            patch_queue_batch_task = patch("temba.mailroom.queue._queue_batch_task")
+            patch_queue_batch_task = patch("temba.mailroom.queue._queue_batch_tasks")
             mock_queue_batch_task = patch_queue_batch_task.start()
 
-            def queue_batch_task(org_id, task_type, task, priority):
-                mocks.queued_batch_tasks.append(
-                    {"type": task_type.value, "org_id": org_id, "task": task, "queued_on": timezone.now()}
-                )
+            def queue_batch_tasks(tasks):
+                for org_id, task_type, task, priority in tasks:
+                    mocks.queued_batch_tasks.append(
+                        {"type": task_type.value, "org_id": org_id, "task": task, "queued_on": timezone.now()}
+                    )
 
-            mock_queue_batch_task.side_effect = queue_batch_task
+            mock_queue_batch_task.side_effect = queue_batch_tasks
 
         return f(instance, mocks, *args, **kwargs)
     finally:
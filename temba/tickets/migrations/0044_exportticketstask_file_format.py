@@ -0,0 +1,20 @@
+# Generated by Django 4.0.7 on 2026-10-17 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tickets", "0043_exportticketstask_with_groups"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="exportticketstask",
+            name="file_format",
+            field=models.CharField(
+                choices=[("xlsx", "Excel (.xlsx)"), ("csv", "Compressed CSV (.csv.gz)")], default="xlsx", max_length=4
+            ),
+        ),
+    ]
@@ -17,10 +17,9 @@ from temba import mailroom
 from temba.assets.models import register_asset_store
 from temba.contacts.models import Contact
 from temba.orgs.models import DependencyMixin, Org, User, UserSettings
-from temba.utils import chunk_list
 from temba.utils.dates import date_range
-from temba.utils.export import BaseExportAssetStore, BaseItemWithContactExport, MultiSheetExporter
-from temba.utils.models import DailyCountModel, DailyTimingModel, SquashableModel, TembaModel
+from temba.utils.export import BaseExport, BaseExportAssetStore, BaseItemWithContactExport
+from temba.utils.models import DailyCountModel, DailyTimingModel, SquashableModel, TembaModel, iter_keyset_batches
 from temba.utils.uuid import uuid4
 
 logger = logging.getLogger(__name__)
@@ -422,7 +421,8 @@ class TicketCount(SquashableModel):
     Counts of tickets by assignment and status
     """
 
-    SQUASH_OVER = ("org_id", "assignee_id", "status")
+    squash_over = ("org_id", "assignee_id", "status")
+    squash_batch_size = 1000
 
     org = models.ForeignKey(Org, on_delete=models.PROTECT, related_name="ticket_counts")
     assignee = models.ForeignKey(User, null=True, on_delete=models.PROTECT, related_name="ticket_counts")
@@ -641,9 +641,16 @@ class ExportTicketsTask(BaseItemWithContactExport):
     notification_export_type = "ticket"
 
     @classmethod
-    def create(cls, org, user, start_date, end_date, with_fields=(), with_groups=()):
+    def create(
+        cls, org, user, start_date, end_date, with_fields=(), with_groups=(), file_format=BaseExport.FORMAT_XLSX
+    ):
         export = cls.objects.create(
-            org=org, start_date=start_date, end_date=end_date, created_by=user, modified_by=user
+            org=org,
+            start_date=start_date,
+            end_date=end_date,
+            file_format=file_format,
+            created_by=user,
+            modified_by=user,
         )
         export.with_fields.add(*with_fields)
         export.with_groups.add(*with_groups)
@@ -653,27 +660,26 @@ class ExportTicketsTask(BaseItemWithContactExport):
         headers = ["UUID", "Opened On", "Closed On", "Topic", "Assigned To"] + self._get_contact_headers()
         start_date, end_date = self._get_date_range()
 
-        # get the ticket ids, filtered and ordered by opened on
-        ticket_ids = (
-            self.org.tickets.filter(opened_on__gte=start_date, opened_on__lte=end_date)
-            .order_by("opened_on")
-            .values_list("id", flat=True)
-        )
+        # get the tickets, filtered by opened on
+        tickets = self.org.tickets.filter(opened_on__gte=start_date, opened_on__lte=end_date).using("readonly")
 
-        exporter = MultiSheetExporter("Tickets", headers, self.org.timezone)
+        exporter = self.get_exporter("Tickets", headers)
 
-        # add tickets to the export in batches of 1k to limit memory usage
-        for batch_ids in chunk_list(ticket_ids, 1000):
-            tickets = (
+        # add tickets to the export in batches of 1k ordered by opened on, paging through ids to limit memory usage
+        for batch_ids in iter_keyset_batches(tickets, "opened_on"):
+            batch_tickets = (
                 Ticket.objects.filter(id__in=batch_ids)
-                .order_by("opened_on")
+                .order_by("opened_on", "id")
                 .prefetch_related("org", "contact", "contact__org", "contact__groups", "assignee", "topic")
                 .using("readonly")
             )
 
-            Contact.bulk_urn_cache_initialize([t.contact for t in tickets], using="readonly")
+            Contact.bulk_urn_cache_initialize([t.contact for t in batch_tickets], using="readonly")
+            Contact.bulk_boundary_cache_initialize(
+                self.org, [t.contact for t in batch_tickets], self.with_fields.all()
+            )
 
-            for ticket in tickets:
+            for ticket in batch_tickets:
                 values = [
                     str(ticket.uuid),
                     ticket.opened_on,
@@ -697,4 +703,4 @@ class TicketExportAssetStore(BaseExportAssetStore):
     key = "ticket_export"
     directory = "ticket_exports"
     permission = "tickets.ticket_export"
-    extensions = ("xlsx",)
+    extensions = ("xlsx", "csv.gz")
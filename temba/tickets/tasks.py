@@ -1,14 +1,12 @@
 from django.db.models import Prefetch
 
-from celery import shared_task
-
 from temba.contacts.models import ContactField, ContactGroup
-from temba.utils.celery import nonoverlapping_task
+from temba.utils.celery import instrumented_task, nonoverlapping_task
 
 from .models import ExportTicketsTask, TicketCount, TicketDailyCount, TicketDailyTiming
 
 
-@shared_task(track_started=True, name="export_tickets_task")
+@instrumented_task(track_started=True, name="export_tickets_task")
 def export_tickets_task(task_id):
     """
     Export tickets to a file and email a link to the user
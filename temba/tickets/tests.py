@@ -1,3 +1,5 @@
+import csv
+import gzip
 from datetime import date, datetime, timedelta
 from unittest.mock import patch
 
@@ -891,6 +893,56 @@ class TicketCRUDLTest(TembaTest, CRUDLTestMixin):
 
         self.clear_storage()
 
+    def test_export_csv(self):
+        ticketer = Ticketer.create(self.org, self.admin, "internal", "Internal", {})
+        topic = Topic.create(self.org, self.admin, "AFC Richmond")
+        nate = self.create_contact("Nathan Shelley", urns=["twitter:nate"])
+        ticket = self.create_ticket(ticketer, nate, body="Y'ello", topic=topic, opened_on=timezone.now())
+        today = timezone.now().astimezone(self.org.timezone).date()
+
+        self.login(self.admin)
+        self.client.post(
+            reverse("tickets.ticket_export"),
+            {"start_date": today.isoformat(), "end_date": today.isoformat(), "file_format": "csv"},
+        )
+
+        task = ExportTicketsTask.objects.all().order_by("-id").first()
+        self.assertEqual("csv", task.file_format)
+
+        filename = f"{settings.MEDIA_ROOT}/test_orgs/{self.org.id}/ticket_exports/{task.uuid}.csv.gz"
+        with gzip.open(filename, "rt", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+
+        self.assertEqual(
+            [
+                [
+                    "UUID",
+                    "Opened On",
+                    "Closed On",
+                    "Topic",
+                    "Assigned To",
+                    "Contact UUID",
+                    "Contact Name",
+                    "URN Scheme",
+                    "URN Value",
+                ],
+                [
+                    str(ticket.uuid),
+                    ticket.opened_on.astimezone(self.org.timezone).replace(microsecond=0, tzinfo=None).isoformat(),
+                    "",
+                    "AFC Richmond",
+                    "",
+                    str(nate.uuid),
+                    "Nathan Shelley",
+                    "twitter",
+                    "nate",
+                ],
+            ],
+            rows,
+        )
+
+        self.clear_storage()
+
     def test_export_with_too_many_fields_and_groups(self):
         export_url = reverse("tickets.ticket_export")
         today = timezone.now().astimezone(self.org.timezone).date()
@@ -429,7 +429,13 @@ class TicketCRUDL(SmartCRUDL):
                 with_fields = form.cleaned_data["with_fields"]
                 with_groups = form.cleaned_data["with_groups"]
                 export = ExportTicketsTask.create(
-                    org, user, start_date, end_date, with_fields=with_fields, with_groups=with_groups
+                    org,
+                    user,
+                    start_date,
+                    end_date,
+                    with_fields=with_fields,
+                    with_groups=with_groups,
+                    file_format=form.cleaned_data["file_format"],
                 )
 
                 # schedule the export job
@@ -1,7 +1,13 @@
+from collections import OrderedDict, defaultdict
+from typing import NamedTuple
+
+from django_redis import get_redis_connection
 from smartmin.models import SmartModel
 
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -9,6 +15,8 @@ from temba.channels.models import Channel
 from temba.contacts.models import Contact, ContactGroup
 from temba.flows.models import Flow
 from temba.orgs.models import Org
+from temba.utils import on_transaction_commit
+from temba.utils.uuid import uuid4
 
 
 class TriggerType:
@@ -59,6 +67,171 @@ class TriggerType:
                 raise ValueError(f"Field '{field}' is required.")
 
 
+class TriggerIndex:
+    """
+    In-memory index of an org's active non-scheduled triggers which lets us find conflicts without a query per trigger.
+    Triggers are bucketed by (type, channel, casefolded referrer) and then by casefolded keyword.
+    """
+
+    VERSION_KEY = "org:%d:trigger_index_version"
+    VERSION_TTL = 86400
+    MAX_CACHED = 250  # max number of org indexes held by a process
+
+    class Entry(NamedTuple):
+        bucket_key: tuple
+        keyword_key: str
+        group_ids: frozenset
+        is_archived: bool
+
+    def __init__(self):
+        self.entries = {}  # by trigger id
+        self.buckets = defaultdict(lambda: defaultdict(set))
+
+    @classmethod
+    def build(cls, org_id: int):
+        index = cls()
+
+        trigger_groups = defaultdict(set)
+        for trigger_id, group_id in Trigger.groups.through.objects.filter(
+            trigger__org_id=org_id, trigger__is_active=True
+        ).values_list("trigger_id", "contactgroup_id"):
+            trigger_groups[trigger_id].add(group_id)
+
+        triggers = (
+            Trigger.objects.filter(org_id=org_id, is_active=True)
+            .exclude(trigger_type=Trigger.TYPE_SCHEDULE)
+            .values_list("id", "trigger_type", "channel_id", "keyword", "referrer_id", "is_archived")
+        )
+        for trigger_id, trigger_type, channel_id, keyword, referrer_id, is_archived in triggers:
+            index.put(
+                trigger_id, trigger_type, channel_id, keyword, referrer_id, is_archived, trigger_groups[trigger_id]
+            )
+
+        return index
+
+    def put(self, trigger_id: int, trigger_type: str, channel_id, keyword, referrer_id, is_archived: bool, group_ids):
+        self.remove(trigger_id)
+
+        entry = self.Entry(
+            (trigger_type, channel_id, (referrer_id or "").casefold()),
+            (keyword or "").casefold(),
+            frozenset(group_ids),
+            is_archived,
+        )
+        self.entries[trigger_id] = entry
+        self.buckets[entry.bucket_key][entry.keyword_key].add(trigger_id)
+
+    def remove(self, trigger_id: int):
+        entry = self.entries.pop(trigger_id, None)
+        if entry:
+            self.buckets[entry.bucket_key][entry.keyword_key].discard(trigger_id)
+
+    def get_group_ids(self, trigger_id: int) -> frozenset:
+        entry = self.entries.get(trigger_id)
+        return entry.group_ids if entry else frozenset()
+
+    def set_group_ids(self, trigger_id: int, group_ids):
+        if trigger_id in self.entries:
+            self.entries[trigger_id] = self.entries[trigger_id]._replace(group_ids=frozenset(group_ids))
+
+    def set_archived(self, trigger_ids, is_archived: bool):
+        for trigger_id in trigger_ids:
+            if trigger_id in self.entries:
+                self.entries[trigger_id] = self.entries[trigger_id]._replace(is_archived=is_archived)
+
+    def get_conflicts(
+        self, trigger_type: str, channel_id, group_ids, keyword: str, referrer_id: str, include_archived: bool
+    ) -> list[int]:
+        """
+        Gets the ids of the triggers that would conflict with the given trigger field values
+        """
+        bucket = self.buckets.get((trigger_type, channel_id, (referrer_id or "").casefold()), {})
+        if keyword:
+            candidates = bucket.get(keyword.casefold(), ())
+        else:
+            candidates = [trigger_id for ids in bucket.values() for trigger_id in ids]
+
+        group_ids = frozenset(group_ids)
+        conflicts = []
+        for trigger_id in candidates:
+            entry = self.entries[trigger_id]
+
+            if entry.is_archived and not include_archived:
+                continue
+
+            # any overlap in groups is a conflict, and triggers without groups only conflict with each other
+            if (group_ids and group_ids & entry.group_ids) or (not group_ids and not entry.group_ids):
+                conflicts.append(trigger_id)
+
+        return sorted(conflicts)
+
+
+# trigger indexes held by this process, by org id, along with the version they were built for, least recently used first
+_trigger_indexes = OrderedDict()
+
+
+def _cache_trigger_index(org_id: int, version: str, index: TriggerIndex):
+    _trigger_indexes[org_id] = (version, index)
+    _trigger_indexes.move_to_end(org_id)
+
+    while len(_trigger_indexes) > TriggerIndex.MAX_CACHED:
+        _trigger_indexes.popitem(last=False)
+
+
+def get_trigger_index(org_id: int) -> TriggerIndex:
+    """
+    Gets the trigger index for the given org, building it if we don't have one for the current version
+    """
+    r = get_redis_connection()
+    version_key = TriggerIndex.VERSION_KEY % org_id
+    r.set(version_key, str(uuid4()), ex=TriggerIndex.VERSION_TTL, nx=True)
+    version = r.get(version_key).decode()
+
+    cached = _trigger_indexes.get(org_id)
+    if cached and cached[0] == version:
+        _cache_trigger_index(org_id, version, cached[1])
+        return cached[1]
+
+    index = TriggerIndex.build(org_id)
+    _cache_trigger_index(org_id, version, index)
+    return index
+
+
+def update_trigger_index(org_id: int, update=None):
+    """
+    Changes the version of the trigger index for the given org so that other processes rebuild theirs. If this process
+    has an index for the previous version, it's kept by applying the given update function to it. Both happen once the
+    current transaction commits, so that no process can rebuild from uncommitted state and a rollback changes nothing.
+    """
+
+    def apply():
+        r = get_redis_connection()
+        version = str(uuid4())
+        previous = r.getset(TriggerIndex.VERSION_KEY % org_id, version)
+        r.expire(TriggerIndex.VERSION_KEY % org_id, TriggerIndex.VERSION_TTL)
+
+        cached = _trigger_indexes.pop(org_id, None)
+        if update and cached and previous and cached[0] == previous.decode():
+            update(cached[1])
+            _cache_trigger_index(org_id, version, cached[1])
+
+    apply.trigger_index_org_id = org_id
+
+    on_transaction_commit(apply)
+
+
+def has_pending_trigger_changes(org_id: int) -> bool:
+    """
+    Whether the current transaction has changed triggers for the given org which won't be in the index until it commits
+    """
+    pending = transaction.get_connection().run_on_commit
+    return any(getattr(p[1], "trigger_index_org_id", None) == org_id for p in pending)
+
+
+def invalidate_trigger_index(org_id: int):
+    update_trigger_index(org_id)
+
+
 class Trigger(SmartModel):
     """
     A Trigger is used to start a user in a flow based on an event. For example, triggers might fire for missed calls,
@@ -214,11 +387,18 @@ class Trigger(SmartModel):
         Archives any triggers that conflict with this one
         """
 
-        conflicts = self.get_conflicts(
+        conflict_ids = self._get_conflict_ids(
             self.org, self.trigger_type, self.channel, self.groups.all(), self.keyword, self.referrer_id
-        ).exclude(id=self.id)
+        )
+        conflict_ids = [c for c in conflict_ids if c != self.id]
+
+        if conflict_ids:
+            Trigger.objects.filter(id__in=conflict_ids).update(
+                is_archived=True, modified_on=timezone.now(), modified_by=user
+            )
+            update_trigger_index(self.org_id, lambda index: index.set_archived(conflict_ids, True))
 
-        conflicts.update(is_archived=True, modified_on=timezone.now(), modified_by=user)
+        self.org.invalidate_dependency_graph()
 
     @classmethod
     def get_conflicts(
@@ -235,18 +415,39 @@ class Trigger(SmartModel):
         Gets the triggers that would conflict with the given trigger field values
         """
 
+        conflict_ids = cls._get_conflict_ids(
+            org, trigger_type, channel, groups, keyword, referrer_id, include_archived=include_archived
+        )
+        return cls.objects.filter(id__in=conflict_ids)
+
+    @classmethod
+    def _get_conflict_ids(
+        cls, org, trigger_type: str, channel, groups, keyword: str, referrer_id: str, include_archived=False
+    ) -> list[int]:
         if trigger_type == Trigger.TYPE_SCHEDULE:  # schedule triggers never conflict
-            return cls.objects.none()
+            return []
+
+        # the index won't include changes made earlier in this transaction so in that case we have to query for them
+        if has_pending_trigger_changes(org.id):
+            return cls._query_conflict_ids(org, trigger_type, channel, groups, keyword, referrer_id, include_archived)
+
+        return get_trigger_index(org.id).get_conflicts(
+            trigger_type,
+            channel.id if channel else None,
+            [g.id for g in groups or ()],
+            keyword,
+            referrer_id,
+            include_archived,
+        )
 
-        conflicts = org.triggers.filter(is_active=True, trigger_type=trigger_type)
+    @classmethod
+    def _query_conflict_ids(
+        cls, org, trigger_type: str, channel, groups, keyword: str, referrer_id: str, include_archived: bool
+    ) -> list[int]:
+        conflicts = org.triggers.filter(is_active=True, trigger_type=trigger_type, channel=channel)
         if not include_archived:
             conflicts = conflicts.filter(is_archived=False)
 
-        if channel:
-            conflicts = conflicts.filter(channel=channel)
-        else:
-            conflicts = conflicts.filter(channel=None)
-
         if groups:
             conflicts = conflicts.filter(groups__in=groups)  # any overlap in groups is a conflict
         else:
@@ -260,7 +461,7 @@ class Trigger(SmartModel):
         else:
             conflicts = conflicts.filter(Q(referrer_id=None) | Q(referrer_id=""))
 
-        return conflicts
+        return sorted(set(conflicts.values_list("id", flat=True)))
 
     @classmethod
     def validate_import_def(cls, trigger_def: dict):
@@ -423,3 +624,46 @@ class Trigger(SmartModel):
     class Meta:
         verbose_name = _("Trigger")
         verbose_name_plural = _("Triggers")
+
+
+@receiver(post_save, sender=Trigger)
+def update_trigger_index_on_save(sender, instance, **kwargs):
+    def update(index):
+        if instance.is_active and instance.trigger_type != Trigger.TYPE_SCHEDULE:
+            index.put(
+                instance.id,
+                instance.trigger_type,
+                instance.channel_id,
+                instance.keyword,
+                instance.referrer_id,
+                instance.is_archived,
+                index.get_group_ids(instance.id),
+            )
+        else:
+            index.remove(instance.id)
+
+    update_trigger_index(instance.org_id, update)
+
+
+@receiver(m2m_changed, sender=Trigger.groups.through)
+def update_trigger_index_on_groups_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+
+    # changes made from the group side could affect any number of triggers
+    if reverse:
+        invalidate_trigger_index(instance.org_id)
+        return
+
+    def update(index):
+        group_ids = set(index.get_group_ids(instance.id))
+        if action == "post_add":
+            group_ids |= pk_set
+        elif action == "post_remove":
+            group_ids -= pk_set
+        else:
+            group_ids = set()
+
+        index.set_group_ids(instance.id, group_ids)
+
+    update_trigger_index(instance.org_id, update)
@@ -3,6 +3,7 @@ from unittest.mock import patch
 
 import pytz
 
+from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils import timezone
 
@@ -14,7 +15,7 @@ from temba.orgs.models import Org
 from temba.schedules.models import Schedule
 from temba.tests import CRUDLTestMixin, MigrationTest, TembaTest
 
-from .models import Trigger
+from .models import Trigger, get_trigger_index, invalidate_trigger_index
 from .types import KeywordTriggerType
 
 
@@ -90,6 +91,100 @@ class TriggerTest(TembaTest):
 
             assert_conflict_resolution(archived=[trigger1], unchanged=[trigger2])
 
+    def test_get_conflicts(self):
+        flow = self.create_flow("Test")
+        group1 = self.create_group("Group 1", contacts=[])
+        group2 = self.create_group("Group 2", contacts=[])
+        channel = self.create_channel("FB", "FB Channel", "12345")
+
+        join = Trigger.create(self.org, self.admin, Trigger.TYPE_KEYWORD, flow, keyword="join")
+        join_group1 = Trigger.create(self.org, self.admin, Trigger.TYPE_KEYWORD, flow, keyword="join", groups=[group1])
+        referral = Trigger.create(
+            self.org, self.admin, Trigger.TYPE_REFERRAL, flow, channel=channel, referrer_id="Abc"
+        )
+
+        def assert_conflicts(expected, *args, **kwargs):
+            self.assertEqual(set(expected), set(Trigger.get_conflicts(self.org, *args, **kwargs)))
+
+        # index is built once and then conflicts can be found without any queries
+        get_trigger_index(self.org.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [join.id], get_trigger_index(self.org.id).get_conflicts("K", None, [], "JOIN", None, False)
+            )
+
+        assert_conflicts([join], Trigger.TYPE_KEYWORD, keyword="Join")
+        assert_conflicts([join_group1], Trigger.TYPE_KEYWORD, keyword="join", groups=[group1, group2])
+        assert_conflicts([], Trigger.TYPE_KEYWORD, keyword="join", groups=[group2])
+        assert_conflicts([join, join_group1], Trigger.TYPE_KEYWORD)
+        assert_conflicts([referral], Trigger.TYPE_REFERRAL, channel=channel, referrer_id="abc")
+        assert_conflicts([], Trigger.TYPE_REFERRAL, channel=channel)
+        assert_conflicts([], Trigger.TYPE_SCHEDULE)
+
+        # index is updated when triggers are archived, restored, regrouped or released
+        join.archive(self.admin)
+        assert_conflicts([], Trigger.TYPE_KEYWORD, keyword="join")
+        assert_conflicts([join], Trigger.TYPE_KEYWORD, keyword="join", include_archived=True)
+
+        join.restore(self.admin)
+        assert_conflicts([join], Trigger.TYPE_KEYWORD, keyword="join")
+
+        join_group1.groups.add(group2)
+        assert_conflicts([join_group1], Trigger.TYPE_KEYWORD, keyword="join", groups=[group2])
+
+        join_group1.groups.remove(group1)
+        assert_conflicts([], Trigger.TYPE_KEYWORD, keyword="join", groups=[group1])
+
+        referral.release(self.admin)
+        assert_conflicts([], Trigger.TYPE_REFERRAL, channel=channel, referrer_id="abc")
+
+        # creating a conflicting trigger archives the existing one
+        join2 = Trigger.create(self.org, self.admin, Trigger.TYPE_KEYWORD, flow, keyword="JOIN")
+        assert_conflicts([join2], Trigger.TYPE_KEYWORD, keyword="join")
+
+        # changes made in other processes cause the index to be rebuilt
+        index = get_trigger_index(self.org.id)
+        Trigger.objects.filter(id=join2.id).update(is_archived=True)
+        invalidate_trigger_index(self.org.id)
+
+        self.assertIsNot(index, get_trigger_index(self.org.id))
+        assert_conflicts([], Trigger.TYPE_KEYWORD, keyword="join")
+
+        # when not in eager mode, index changes wait for the transaction to commit but conflicts are found by querying
+        # until then so that changes made earlier in the transaction are seen
+        with override_settings(CELERY_TASK_ALWAYS_EAGER=False):
+            with self.captureOnCommitCallbacks() as callbacks:
+                join3 = Trigger.create(self.org, self.admin, Trigger.TYPE_KEYWORD, flow, keyword="join")
+
+                self.assertEqual([], get_trigger_index(self.org.id).get_conflicts("K", None, [], "join", None, False))
+                assert_conflicts([join3], Trigger.TYPE_KEYWORD, keyword="join")
+                assert_conflicts([], Trigger.TYPE_KEYWORD, keyword="join", groups=[group1])
+
+                # and a second conflicting trigger in the same transaction archives the first
+                join4 = Trigger.create(self.org, self.admin, Trigger.TYPE_KEYWORD, flow, keyword="join")
+                assert_conflicts([join4], Trigger.TYPE_KEYWORD, keyword="join")
+
+            for callback in callbacks:
+                callback()
+
+        self.assertEqual([join4.id], get_trigger_index(self.org.id).get_conflicts("K", None, [], "join", None, False))
+
+    def test_trigger_index_lru(self):
+        flow = self.create_flow("Test")
+        Trigger.create(self.org, self.admin, Trigger.TYPE_KEYWORD, flow, keyword="join")
+
+        index1 = get_trigger_index(self.org.id)
+        index2 = get_trigger_index(self.org2.id)
+
+        # least recently used indexes are evicted once there are too many
+        with patch("temba.triggers.models.TriggerIndex.MAX_CACHED", 2):
+            self.assertIs(index1, get_trigger_index(self.org.id))
+
+            get_trigger_index(self.org2.id + 1000)
+
+            self.assertIs(index1, get_trigger_index(self.org.id))
+            self.assertIsNot(index2, get_trigger_index(self.org2.id))
+
     def _export_trigger(self, trigger: Trigger) -> dict:
         components = self.org.resolve_dependencies([trigger.flow], [], include_triggers=True)
         return self.org.export_definitions("http://rapidpro.io", components)
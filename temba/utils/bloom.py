@@ -0,0 +1,46 @@
+import base64
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    A simple bloom filter of strings which can be serialized to JSON
+    """
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: bytearray = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def create(cls, capacity: int, error_rate: float = 0.01):
+        """
+        Creates an empty filter sized to hold the given number of items with the given false positive rate
+        """
+        capacity = max(capacity, 1)
+        num_bits = max(int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))), 8)
+        num_hashes = max(int(round(num_bits / capacity * math.log(2))), 1)
+
+        return cls(num_bits, num_hashes)
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(item))
+
+    def _positions(self, item: str):
+        # derive all our hashes from two halves of a single digest (Kirsch-Mitzenmacher)
+        digest = hashlib.md5(item.encode()).digest()
+        h1, h2 = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big")
+
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def as_json(self) -> dict:
+        return {"num_bits": self.num_bits, "num_hashes": self.num_hashes, "bits": base64.b64encode(self.bits).decode()}
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(data["num_bits"], data["num_hashes"], bytearray(base64.b64decode(data["bits"])))
@@ -1,16 +1,189 @@
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
 from functools import wraps
 
 from django_redis import get_redis_connection
 
+from django.db import connections
+from django.utils import timezone
+
 from celery import shared_task
 
+from . import analytics
+
 # for tasks using a redis lock to prevent overlapping this is the default timeout for the lock
 DEFAULT_TASK_LOCK_TIMEOUT = 900
 
+# instrumentation stats are kept in a hash per task per day, with a set of the names of all instrumented tasks
+TASK_STATS_KEY = "task_stats:%s:%s"
+TASK_STATS_NAMES_KEY = "task_stats_names"
+TASK_STATS_DAYS = 7  # number of days of stats that are reported
+TASK_STATS_TTL = (TASK_STATS_DAYS + 1) * 24 * 60 * 60
+
+_current = threading.local()
+
+
+class TaskInvocation:
+    """
+    The measurements of a single invocation of an instrumented task
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.duration = 0.0
+        self.num_rows = 0
+        self.num_queries = 0
+        self.peak_memory = 0
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.num_queries += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def instrument_task(name: str):
+    """
+    Context manager which measures the duration, rows processed, DB queries and peak memory growth of a task invocation
+    and records them as gauges and in the task stats. Memory is measured with tracemalloc if it's tracing, and otherwise
+    as the growth in the process's max RSS, which is zero for a task that doesn't exceed a previous task's peak.
+    """
+    invocation = TaskInvocation(name)
+    previous = getattr(_current, "invocation", None)
+    _current.invocation = invocation
+    start = time.perf_counter()
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        start_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    else:
+        start_maxrss = _get_maxrss()
+
+    try:
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(invocation._count_query))
+
+            yield invocation
+    finally:
+        _current.invocation = previous
+        invocation.duration = time.perf_counter() - start
+        if tracing:
+            invocation.peak_memory = max(tracemalloc.get_traced_memory()[1] - start_memory, 0)
+        else:
+            invocation.peak_memory = _get_maxrss() - start_maxrss
+
+        _record_invocation(invocation)
+
+
+def _get_maxrss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KB on Linux
+
+
+def record_rows(num_rows: int):
+    """
+    Records rows processed by the instrumented task currently running in this thread, if there is one
+    """
+    invocation = getattr(_current, "invocation", None)
+    if invocation:
+        invocation.num_rows += num_rows
+
+
+def _record_invocation(invocation: TaskInvocation):
+    analytics.gauge(f"temba.task_duration.{invocation.name}", invocation.duration)
+    analytics.gauge(f"temba.task_rows.{invocation.name}", invocation.num_rows)
+    analytics.gauge(f"temba.task_queries.{invocation.name}", invocation.num_queries)
+    analytics.gauge(f"temba.task_peak_memory.{invocation.name}", invocation.peak_memory)
+
+    r = get_redis_connection()
+    key = TASK_STATS_KEY % (invocation.name, timezone.now().date().isoformat())
+    prev_max_duration, prev_peak_memory = r.hmget(key, "max_duration", "peak_memory")
+
+    with r.pipeline() as pipe:
+        pipe.sadd(TASK_STATS_NAMES_KEY, invocation.name)
+        pipe.hincrby(key, "count", 1)
+        pipe.hincrbyfloat(key, "total_duration", invocation.duration)
+        pipe.hincrby(key, "total_rows", invocation.num_rows)
+        pipe.hincrby(key, "total_queries", invocation.num_queries)
+        pipe.hset(key, "last_duration", invocation.duration)
+        pipe.hset(key, "last_run", timezone.now().isoformat())
+        pipe.hset(key, "max_duration", max(invocation.duration, float(prev_max_duration or 0)))
+        pipe.hset(key, "peak_memory", max(invocation.peak_memory, int(prev_peak_memory or 0)))
+        pipe.expire(key, TASK_STATS_TTL)
+        pipe.expire(TASK_STATS_NAMES_KEY, TASK_STATS_TTL)
+        pipe.execute()
+
+
+def get_task_stats() -> list:
+    """
+    Gets the recorded stats of all instrumented tasks over the last TASK_STATS_DAYS days, ordered by the total time
+    they've taken
+    """
+    r = get_redis_connection()
+    names = sorted(n.decode() for n in r.smembers(TASK_STATS_NAMES_KEY))
+    today = timezone.now().date()
+    days = [(today - timedelta(days=d)).isoformat() for d in range(TASK_STATS_DAYS)]
+
+    with r.pipeline() as pipe:
+        for name in names:
+            for day in days:
+                pipe.hgetall(TASK_STATS_KEY % (name, day))
+        results = pipe.execute()
+
+    stats = []
+    for n, name in enumerate(names):
+        buckets = [
+            {k.decode(): v.decode() for k, v in b.items()} for b in results[n * len(days) : (n + 1) * len(days)]
+        ]
+        buckets = [b for b in buckets if b]
+        if not buckets:
+            continue
+
+        count = sum(int(b["count"]) for b in buckets)
+        total_duration = sum(float(b["total_duration"]) for b in buckets)
+        last = buckets[0]  # buckets are newest first
+
+        stats.append(
+            {
+                "name": name,
+                "count": count,
+                "total_duration": total_duration,
+                "avg_duration": total_duration / count,
+                "max_duration": max(float(b["max_duration"]) for b in buckets),
+                "last_duration": float(last["last_duration"]),
+                "avg_rows": sum(int(b["total_rows"]) for b in buckets) // count,
+                "avg_queries": sum(int(b["total_queries"]) for b in buckets) // count,
+                "peak_memory": max(int(b["peak_memory"]) for b in buckets),
+                "last_run": last["last_run"],
+            }
+        )
+
+    return sorted(stats, key=lambda s: s["total_duration"], reverse=True)
+
+
+def instrumented_task(*task_args, **task_kwargs):
+    """
+    Decorator to create a task whose invocations are instrumented
+    """
+
+    def _instrumented_task(task_func):
+        @wraps(task_func)
+        def wrapper(*exec_args, **exec_kwargs):
+            with instrument_task(task_kwargs.get("name", task_func.__name__)):
+                return task_func(*exec_args, **exec_kwargs)
+
+        return shared_task(*task_args, **task_kwargs)(wrapper)
+
+    return _instrumented_task
+
 
 def nonoverlapping_task(*task_args, **task_kwargs):
     """
-    Decorator to create an task whose executions are prevented from overlapping by a redis lock
+    Decorator to create an instrumented task whose executions are prevented from overlapping by a redis lock
     """
 
     def _nonoverlapping_task(task_func):
@@ -32,7 +205,8 @@ def nonoverlapping_task(*task_args, **task_kwargs):
                 print("Skipping task %s to prevent overlapping" % task_name)
             else:
                 with r.lock(lock_key, timeout=lock_timeout):
-                    task_func(*exec_args, **exec_kwargs)
+                    with instrument_task(task_name):
+                        task_func(*exec_args, **exec_kwargs)
 
         return shared_task(*task_args, **task_kwargs)(wrapper)
 
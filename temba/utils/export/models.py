@@ -1,4 +1,7 @@
+import csv
 import gc
+import gzip
+import io
 import logging
 import os
 import time
@@ -16,6 +19,7 @@ from django.utils.translation import gettext_lazy as _
 
 from temba.assets.models import BaseAssetStore, get_asset_store
 from temba.utils import analytics
+from temba.utils.celery import record_rows
 from temba.utils.models import TembaUUIDMixin
 from temba.utils.text import clean_string
 
@@ -54,6 +58,10 @@ class BaseExport(TembaUUIDMixin, SmartModel):
         (STATUS_FAILED, _("Failed")),
     )
 
+    FORMAT_XLSX = "xlsx"
+    FORMAT_CSV = "csv"
+    FORMAT_CHOICES = ((FORMAT_XLSX, _("Excel (.xlsx)")), (FORMAT_CSV, _("Compressed CSV (.csv.gz)")))
+
     # log progress after this number of exported objects have been exported
     LOG_PROGRESS_PER_ROWS = 10000
 
@@ -63,6 +71,8 @@ class BaseExport(TembaUUIDMixin, SmartModel):
 
     status = models.CharField(max_length=1, default=STATUS_PENDING, choices=STATUS_CHOICES)
 
+    file_format = models.CharField(max_length=4, default=FORMAT_XLSX, choices=FORMAT_CHOICES)
+
     def perform(self):
         """
         Performs the actual export. If export generation throws an exception it's caught here and the task is marked
@@ -110,6 +120,17 @@ class BaseExport(TembaUUIDMixin, SmartModel):
         """
         pass
 
+    def get_exporter(self, base_sheet_name: str, headers: list, numbered_sheets: bool = True):
+        """
+        Gets an exporter to write rows to in the file format of this export
+        """
+        if self.file_format == self.FORMAT_CSV:
+            return CSVExporter(headers, self.org.timezone)
+
+        return MultiSheetExporter(
+            base_sheet_name, headers, self.org.timezone, numbered_sheets=numbered_sheets, max_rows=self.MAX_EXCEL_ROWS
+        )
+
     def update_status(self, status):
         self.status = status
         self.save(update_fields=("status", "modified_on"))
@@ -249,13 +270,15 @@ def prepare_value(value, tz=None):
 class MultiSheetExporter:
     """
     Utility to aid writing a stream of rows which may exceed the 1048576 limit on rows per sheet, and require adding
-    new sheets.
+    new sheets. Sheets are named like "Contacts 1", "Contacts 2" or, if not numbered, like "Runs", "Runs (2)".
     """
 
-    def __init__(self, base_sheet_name: str, headers: list, tz):
+    def __init__(self, base_sheet_name: str, headers: list, tz, numbered_sheets: bool = True, max_rows: int = None):
         self.base_sheet_name = base_sheet_name
         self.headers = headers
         self.tz = tz
+        self.numbered_sheets = numbered_sheets
+        self.max_rows = max_rows
 
         self.current_sheet = 0
         self.current_row = 0
@@ -267,8 +290,15 @@ class MultiSheetExporter:
     def _add_sheet(self):
         self.sheet_number += 1
 
+        if self.numbered_sheets:
+            sheet_name = f"{self.base_sheet_name} {self.sheet_number}"
+        elif self.sheet_number > 1:
+            sheet_name = f"{self.base_sheet_name} ({self.sheet_number})"
+        else:
+            sheet_name = self.base_sheet_name
+
         # add our sheet
-        self.sheet = self.workbook.add_sheet(f"{self.base_sheet_name} {self.sheet_number}")
+        self.sheet = self.workbook.add_sheet(sheet_name)
         self.sheet.append_row(*self.headers)
         self.sheet_row = 2
 
@@ -280,11 +310,12 @@ class MultiSheetExporter:
         assert len(values) == len(self.headers), "need same number of column values as column headers"
 
         # time for a new sheet? do it
-        if self.sheet_row > BaseExport.MAX_EXCEL_ROWS:
+        if self.sheet_row > (self.max_rows or BaseExport.MAX_EXCEL_ROWS):
             self._add_sheet()
 
         self.sheet.append_row(*[prepare_value(v, self.tz) for v in values])
         self.sheet_row += 1
+        record_rows(1)
 
     def save_file(self):
         """
@@ -314,3 +345,44 @@ def response_from_workbook(workbook, filename: str) -> HttpResponse:
     )
     response["Content-Disposition"] = f"attachment; filename={filename}"
     return response
+
+
+class CSVExporter:
+    """
+    Utility to write a stream of rows directly to a gzipped CSV file, so memory usage is constant regardless of the
+    number of rows, and there's no limit on the number of rows.
+    """
+
+    extension = "csv.gz"
+
+    def __init__(self, headers: list, tz):
+        self.headers = headers
+        self.tz = tz
+
+        self.temp_file = NamedTemporaryFile(delete=False, suffix=f".{self.extension}", mode="wb+")
+        self.stream = io.TextIOWrapper(gzip.GzipFile(fileobj=self.temp_file, mode="wb"), encoding="utf-8", newline="")
+        self.writer = csv.writer(self.stream)
+        self.writer.writerow(headers)
+
+    def write_row(self, values):
+        """
+        Writes the passed in row to the file
+        """
+
+        assert len(values) == len(self.headers), "need same number of column values as column headers"
+
+        self.writer.writerow([self._prepare_value(v) for v in values])
+        record_rows(1)
+
+    def _prepare_value(self, value):
+        value = prepare_value(value, self.tz)
+        return value.isoformat() if isinstance(value, datetime) else value
+
+    def save_file(self):
+        """
+        Finishes writing our file, returning the file and the extension
+        """
+        self.stream.close()  # closes the gzip stream but not the underlying file
+        self.temp_file.flush()
+
+        return self.temp_file, self.extension
@@ -1,3 +1,5 @@
+import csv
+import gzip
 import os
 from datetime import datetime
 from unittest.mock import PropertyMock, patch
@@ -8,7 +10,7 @@ from openpyxl import load_workbook
 from temba.contacts.models import ExportContactsTask
 from temba.tests import TembaTest
 
-from .models import MultiSheetExporter, prepare_value
+from .models import CSVExporter, MultiSheetExporter, prepare_value
 
 
 class ExportTest(TembaTest):
@@ -106,3 +108,36 @@ class ExportTest(TembaTest):
         self.assertEqual(32 + 16, len(list(sheet2.columns)))
 
         os.unlink(temp_file.name)
+
+    def test_csvexporter(self):
+        tz = pytz.timezone("Africa/Nairobi")
+        exporter = CSVExporter(["Name", "Joined", "Active", "Age"], tz)
+
+        for i in range(1500):
+            exporter.write_row([f"Bob {i}", datetime(2022, 1, 2, 10, 30, 15, 123456, pytz.UTC), True, i])
+        exporter.write_row(["=SUM(A1:A3)", None, False, 1.5])
+
+        with self.assertRaises(AssertionError):
+            exporter.write_row(["Too", "Few"])
+
+        temp_file, file_ext = exporter.save_file()
+        self.assertEqual("csv.gz", file_ext)
+
+        with gzip.open(temp_file.name, "rt", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+
+        self.assertEqual(1502, len(rows))
+        self.assertEqual(["Name", "Joined", "Active", "Age"], rows[0])
+        self.assertEqual(["Bob 0", "2022-01-02T13:30:15", "True", "0"], rows[1])
+        self.assertEqual(["'=SUM(A1:A3)", "", "False", "1.5"], rows[1501])
+
+        os.unlink(temp_file.name)
+
+    def test_get_exporter(self):
+        self.assertIsInstance(self.task.get_exporter("Contacts", ["Name"]), MultiSheetExporter)
+
+        self.task.file_format = ExportContactsTask.FORMAT_CSV
+        exporter = self.task.get_exporter("Contacts", ["Name"])
+        self.assertIsInstance(exporter, CSVExporter)
+
+        os.unlink(exporter.save_file()[0].name)
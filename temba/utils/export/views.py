@@ -9,7 +9,9 @@ from django.utils.translation import gettext_lazy as _
 
 from temba.contacts.models import ContactField, ContactGroup
 from temba.orgs.views import ModalMixin, OrgPermsMixin
-from temba.utils.fields import SelectMultipleWidget, TembaDateField
+from temba.utils.fields import SelectMultipleWidget, SelectWidget, TembaDateField
+
+from .models import BaseExport
 
 
 class BaseExportView(ModalMixin, OrgPermsMixin, SmartFormView):
@@ -39,6 +41,15 @@ class BaseExportView(ModalMixin, OrgPermsMixin, SmartFormView):
             ),
         )
 
+        file_format = forms.ChoiceField(
+            choices=BaseExport.FORMAT_CHOICES,
+            initial=BaseExport.FORMAT_XLSX,
+            required=False,
+            label=_("Format"),
+            help_text=_("Compressed CSV has no limit on rows per sheet and is better suited to very large exports."),
+            widget=SelectWidget(),
+        )
+
         def __init__(self, org, *args, **kwargs):
             super().__init__(*args, **kwargs)
 
@@ -57,6 +68,9 @@ class BaseExportView(ModalMixin, OrgPermsMixin, SmartFormView):
 
             return data
 
+        def clean_file_format(self):
+            return self.cleaned_data["file_format"] or BaseExport.FORMAT_XLSX
+
         def clean_with_groups(self):
             data = self.cleaned_data["with_groups"]
             if data and len(data) > self.MAX_GROUPS_COLS:
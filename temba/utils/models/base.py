@@ -5,6 +5,7 @@ from smartmin.models import SmartModel
 
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 
 from temba.utils.fields import NameValidator
@@ -25,6 +26,38 @@ def patch_queryset_count(qs, function):
     qs.count = types.MethodType(lambda s: function(), qs)
 
 
+def iter_keyset_batches(queryset, sort_field: str, *, batch_size: int = 1000):
+    """
+    Iterates over the ids of the given queryset in batches ordered by (sort_field, id), fetching each page with a keyset
+    condition rather than an offset so only one page of ids is ever held in memory. Postgres sorts NULLs last in
+    ascending order, so rows with a null sort key are paged through by id after all non-null keys.
+    """
+    nullable = queryset.model._meta.get_field(sort_field).null
+    queryset = queryset.order_by(sort_field, "id")
+    last = None
+
+    while True:
+        page = queryset
+        if last:
+            last_key, last_id = last
+            if last_key is None:
+                page = page.filter(**{f"{sort_field}__isnull": True, "id__gt": last_id})
+            else:
+                after = Q(**{f"{sort_field}__gt": last_key}) | Q(**{sort_field: last_key, "id__gt": last_id})
+                if nullable:
+                    after |= Q(**{f"{sort_field}__isnull": True})
+                page = page.filter(after)
+
+        rows = list(page.values_list(sort_field, "id")[:batch_size])
+        if rows:
+            yield [r[1] for r in rows]
+
+        if len(rows) < batch_size:
+            break
+
+        last = rows[-1]
+
+
 class LegacyUUIDMixin(SmartModel):
     """
     Model mixin for things with an old-style VARCHAR(36) UUID
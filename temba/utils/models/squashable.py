@@ -2,9 +2,14 @@ import logging
 import time
 from abc import abstractmethod
 
+from django_redis import get_redis_connection
+
 from django.db import connection, models
 from django.db.models import Sum
 
+from temba.utils.celery import record_rows
+from temba.utils.uuid import uuid4
+
 
 class SquashableModel(models.Model):
     """
@@ -13,6 +18,20 @@ class SquashableModel(models.Model):
 
     squash_over = ()
 
+    # the fields which are summed when a set is squashed
+    squash_sums = ("count",)
+
+    # subclasses can opt in to set-based squashing, where each statement squashes up to this many distinct sets
+    squash_batch_size = None
+
+    # the maximum number of distinct sets squashed by a single call to squash()
+    squash_max_sets = 5000
+
+    # subclasses can opt in to watermarks which are moved for each value of this field with counts that were squashed,
+    # so that summaries of those counts can be cached until the watermark moves. Must be one of squash_over.
+    squash_watermark_over = None
+    squash_watermark_ttl = 7 * 24 * 60 * 60  # 1 week
+
     id = models.BigAutoField(auto_created=True, primary_key=True)
     is_squashed = models.BooleanField(default=False)
 
@@ -21,11 +40,47 @@ class SquashableModel(models.Model):
         return cls.objects.filter(is_squashed=False)
 
     @classmethod
-    def squash(cls):
+    def squash(cls, batch_size: int = None, max_sets: int = None) -> tuple:
+        """
+        Squashes unsquashed distinct sets, returning a tuple of the number of sets squashed and the number of rows
+        removed. Sets are squashed in batches if this model has opted in to set-based squashing, or a batch size is
+        provided, otherwise one at a time.
+        """
         start = time.time()
+        batch_size = batch_size or cls.squash_batch_size
+        max_sets = max_sets or cls.squash_max_sets
+
+        if batch_size:
+            num_sets, num_rows, watermark_ids = cls._squash_batched(batch_size, max_sets)
+        else:
+            num_sets, num_rows, watermark_ids = cls._squash_individually(max_sets)
+
+        if watermark_ids:
+            cls._move_watermarks(watermark_ids)
+
+        record_rows(num_rows)
+
+        time_taken = time.time() - start
+        sets_per_sec = num_sets / time_taken if time_taken else 0
+        rows_per_sec = num_rows / time_taken if time_taken else 0
+
+        logging.debug(
+            "Squashed %d distinct sets (%d rows) of %s in %0.3fs (%d sets/s, %d rows/s)"
+            % (num_sets, num_rows, cls.__name__, time_taken, sets_per_sec, rows_per_sec)
+        )
+
+        return num_sets, num_rows
+
+    @classmethod
+    def _squash_individually(cls, max_sets: int) -> tuple:
+        """
+        Squashes each distinct set with its own query. We don't know how many rows each query removes so we can only
+        report the number of sets.
+        """
         num_sets = 0
+        watermark_ids = set()
 
-        for distinct_set in cls.get_unsquashed().order_by(*cls.squash_over).distinct(*cls.squash_over)[:5000]:
+        for distinct_set in cls.get_unsquashed().order_by(*cls.squash_over).distinct(*cls.squash_over)[:max_sets]:
             with connection.cursor() as cursor:
                 sql, params = cls.get_squash_query(distinct_set)
 
@@ -33,15 +88,107 @@ class SquashableModel(models.Model):
 
             num_sets += 1
 
-        time_taken = time.time() - start
+            if cls.squash_watermark_over:
+                watermark_ids.add(getattr(distinct_set, cls.squash_watermark_over))
+
+        return num_sets, 0, watermark_ids
+
+    @classmethod
+    def _squash_batched(cls, batch_size: int, max_sets: int) -> tuple:
+        """
+        Squashes distinct sets in batches, each batch with a single statement
+        """
+        num_sets, num_rows = 0, 0
+        watermark_ids = set()
 
-        logging.debug("Squashed %d distinct sets of %s in %0.3fs" % (num_sets, cls.__name__, time_taken))
+        while num_sets < max_sets:
+            with connection.cursor() as cursor:
+                sql, params = cls.get_batch_squash_query(min(batch_size, max_sets - num_sets))
+
+                cursor.execute(sql, params)
+                batch_sets, batch_rows, batch_watermark_ids = cursor.fetchone()
+
+            num_sets += batch_sets
+            num_rows += batch_rows
+            watermark_ids.update(batch_watermark_ids or ())
+
+            if batch_sets < batch_size:
+                break
+
+        return num_sets, num_rows, watermark_ids
+
+    @classmethod
+    def get_watermark(cls, watermark_id) -> str:
+        """
+        Gets the current watermark for the given value of squash_watermark_over
+        """
+        r = get_redis_connection()
+        key = cls._get_watermark_key(watermark_id)
+
+        watermark = r.get(key)
+        if not watermark:
+            r.set(key, str(uuid4()), ex=cls.squash_watermark_ttl, nx=True)
+            watermark = r.get(key)
+
+        return watermark.decode()
+
+    @classmethod
+    def _move_watermarks(cls, watermark_ids):
+        r = get_redis_connection()
+        with r.pipeline() as pipe:
+            for watermark_id in watermark_ids:
+                pipe.set(cls._get_watermark_key(watermark_id), str(uuid4()), ex=cls.squash_watermark_ttl)
+            pipe.execute()
+
+    @classmethod
+    def _get_watermark_key(cls, watermark_id) -> str:
+        return f"squash_watermark:{cls._meta.db_table}:{watermark_id}"
 
     @classmethod
     @abstractmethod
     def get_squash_query(cls, distinct_set) -> tuple:  # pragma: no cover
         pass
 
+    @classmethod
+    def get_batch_squash_query(cls, num_sets: int) -> tuple:
+        """
+        Gets a single query which squashes up to the given number of distinct unsquashed sets, and which returns the
+        number of sets squashed, the number of rows removed and the distinct watermark values of the squashed sets.
+        """
+        table = cls._meta.db_table
+        over_cols = ", ".join(f'"{c}"' for c in cls.squash_over)
+        removed_cols = ", ".join(f't."{c}"' for c in cls.squash_over + cls.squash_sums)
+        sum_cols = ", ".join(f'"{c}"' for c in cls.squash_sums)
+        sum_exprs = ", ".join(f'GREATEST(0, SUM("{c}"))' for c in cls.squash_sums)
+
+        conditions = []
+        for col in cls.squash_over:
+            if cls._meta.get_field(col).null:
+                conditions.append(f'(t."{col}" = s."{col}" OR (t."{col}" IS NULL AND s."{col}" IS NULL))')
+            else:
+                conditions.append(f't."{col}" = s."{col}"')
+        join = " AND ".join(conditions)
+
+        if cls.squash_watermark_over:
+            watermarks = f'(SELECT ARRAY_AGG(DISTINCT "{cls.squash_watermark_over}") FROM inserted)'
+        else:
+            watermarks = "NULL"
+
+        sql = f"""
+        WITH sets AS (
+            SELECT DISTINCT {over_cols} FROM {table} WHERE "is_squashed" = FALSE LIMIT %s
+        ), removed AS (
+            DELETE FROM {table} t USING sets s WHERE {join} RETURNING {removed_cols}
+        ), inserted AS (
+            INSERT INTO {table}({over_cols}, {sum_cols}, "is_squashed")
+            SELECT {over_cols}, {sum_exprs}, TRUE FROM removed GROUP BY {over_cols}
+            RETURNING {over_cols}
+        )
+        SELECT (SELECT COUNT(*) FROM inserted), (SELECT COUNT(*) FROM removed), {watermarks};
+        """
+
+        return sql, (num_sets,)
+
     @classmethod
     def sum(cls, instances) -> int:
         count_sum = instances.aggregate(count_sum=Sum("count"))["count_sum"]
@@ -56,7 +203,7 @@ class ScopedCountModel(SquashableModel):
     Base for scoped count squashable models
     """
 
-    SQUASH_OVER = ("count_type", "scope")
+    squash_over = ("count_type", "scope")
 
     count_type = models.CharField(max_length=1)
     scope = models.CharField(max_length=32)
@@ -112,7 +259,8 @@ class DailyCountModel(ScopedCountModel):
     Base for daily scoped count squashable models
     """
 
-    SQUASH_OVER = ("count_type", "scope", "day")
+    squash_over = ("count_type", "scope", "day")
+    squash_batch_size = 1000
 
     day = models.DateField()
 
@@ -168,6 +316,8 @@ class DailyTimingModel(DailyCountModel):
     Base for daily scoped count+seconds squashable models
     """
 
+    squash_sums = ("count", "seconds")
+
     seconds = models.BigIntegerField()
 
     @classmethod
@@ -1,15 +1,20 @@
+from datetime import date
 from decimal import Decimal
+from unittest.mock import patch
 
 from django.contrib.auth.models import User
 from django.core import checks
 from django.db import connection, models
 from django.test import TestCase
+from django.utils import timezone
 
+from temba.channels.models import ChannelCount
 from temba.contacts.models import Contact
-from temba.flows.models import Flow
+from temba.flows.models import Flow, FlowCategoryCount, FlowPathCount
 from temba.tests import TembaTest
+from temba.utils.uuid import uuid4
 
-from .base import patch_queryset_count
+from .base import iter_keyset_batches, patch_queryset_count
 from .es import IDSliceQuerySet
 from .fields import JSONAsTextField
 
@@ -25,6 +30,132 @@ class ModelsTest(TembaTest):
 
             self.assertEqual(qs.count(), 33)
 
+    def test_iter_keyset_batches(self):
+        ann = self.create_contact("Ann", urns=["twitter:ann"])
+        bob1 = self.create_contact("Bob", urns=["twitter:bob1"])
+        bob2 = self.create_contact("Bob", urns=["twitter:bob2"])
+        cat = self.create_contact("Cat", urns=["twitter:cat"])
+        nameless1 = self.create_contact(None, urns=["twitter:nameless1"])
+        nameless2 = self.create_contact(None, urns=["twitter:nameless2"])
+        nameless3 = self.create_contact(None, urns=["twitter:nameless3"])
+
+        contacts = Contact.objects.filter(org=self.org)
+
+        # each page is a single query, and a short page means we're done
+        with self.assertNumQueries(4):
+            batches = list(iter_keyset_batches(contacts, "name", batch_size=2))
+
+        self.assertEqual([[ann.id, bob1.id], [bob2.id, cat.id], [nameless1.id, nameless2.id], [nameless3.id]], batches)
+
+        # a full last page needs one more query to find out that there are no more
+        with self.assertNumQueries(3):
+            batches = list(iter_keyset_batches(contacts.exclude(id=nameless3.id), "name", batch_size=3))
+
+        self.assertEqual([[ann.id, bob1.id, bob2.id], [cat.id, nameless1.id, nameless2.id]], batches)
+
+        # non-nullable sort field
+        batches = list(iter_keyset_batches(contacts.exclude(name=None), "created_on", batch_size=3))
+        self.assertEqual([[ann.id, bob1.id, bob2.id], [cat.id]], batches)
+
+        self.assertEqual([], list(iter_keyset_batches(contacts.none(), "name")))
+
+
+class SquashableModelTest(TembaTest):
+    def _create_counts(self):
+        ChannelCount.objects.all().delete()
+
+        for day in (date(2022, 5, 1), date(2022, 5, 2), None):
+            for count in (3, 2, -1):
+                ChannelCount.objects.create(
+                    channel=self.channel, count_type=ChannelCount.INCOMING_MSG_TYPE, day=day, count=count
+                )
+        ChannelCount.objects.create(
+            channel=self.channel, count_type=ChannelCount.OUTGOING_MSG_TYPE, day=date(2022, 5, 1), count=-2
+        )
+
+    def _get_counts(self):
+        return list(ChannelCount.objects.order_by("count_type", "day").values_list("count_type", "day", "count"))
+
+    def test_squash(self):
+        expected = [
+            ("IM", date(2022, 5, 1), 4),
+            ("IM", date(2022, 5, 2), 4),
+            ("IM", None, 4),
+            ("OM", date(2022, 5, 1), 0),
+        ]
+
+        # squash one set at a time
+        self._create_counts()
+        with patch.object(ChannelCount, "squash_batch_size", None):
+            self.assertEqual((4, 0), ChannelCount.squash())
+        self.assertEqual(expected, self._get_counts())
+
+        # squash in batches which don't divide the number of sets evenly
+        self._create_counts()
+        with self.assertNumQueries(3):
+            self.assertEqual((4, 10), ChannelCount.squash(batch_size=2))
+        self.assertEqual(expected, self._get_counts())
+        self.assertFalse(ChannelCount.get_unsquashed().exists())
+
+        # squashing again is a noop
+        self.assertEqual((0, 0), ChannelCount.squash())
+        self.assertEqual(expected, self._get_counts())
+
+        # number of sets squashed in a single call can be limited
+        self._create_counts()
+        self.assertEqual(3, ChannelCount.squash(batch_size=2, max_sets=3)[0])
+        self.assertEqual(1, ChannelCount.get_unsquashed().count())
+
+    def test_squash_watermarks(self):
+        flow1 = self.create_flow("Flow 1")
+        flow2 = self.create_flow("Flow 2")
+        flow3 = self.create_flow("Flow 3")
+        period = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+        def create_path_counts(*flows):
+            for flow in flows:
+                FlowPathCount.objects.create(
+                    flow=flow, from_uuid=uuid4(), to_uuid=uuid4(), period=period, count=1, is_squashed=False
+                )
+
+        def create_category_counts(*flows):
+            for flow in flows:
+                FlowCategoryCount.objects.create(
+                    flow=flow, node_uuid=uuid4(), result_key="color", result_name="Color", category_name="Red", count=1
+                )
+
+        def get_watermarks(model):
+            return [model.get_watermark(f.id) for f in (flow1, flow2, flow3)]
+
+        # batched squashing only moves the watermarks of flows whose counts were actually squashed
+        create_path_counts(flow1, flow2, flow3)
+        before = get_watermarks(FlowPathCount)
+
+        FlowPathCount.squash(batch_size=2, max_sets=2)
+        after = get_watermarks(FlowPathCount)
+
+        squashed_ids = set(FlowPathCount.objects.filter(is_squashed=True).values_list("flow_id", flat=True))
+        moved_ids = {f.id for f, b, a in zip((flow1, flow2, flow3), before, after) if b != a}
+        self.assertEqual(2, len(squashed_ids))
+        self.assertEqual(squashed_ids, moved_ids)
+
+        (unsquashed_id,) = {flow1.id, flow2.id, flow3.id} - squashed_ids
+        unsquashed_watermark = FlowPathCount.get_watermark(unsquashed_id)
+
+        FlowPathCount.squash()
+        self.assertNotEqual(unsquashed_watermark, FlowPathCount.get_watermark(unsquashed_id))
+
+        # as does squashing one set at a time
+        create_category_counts(flow1, flow3)
+        before = get_watermarks(FlowCategoryCount)
+
+        FlowCategoryCount.squash()
+        after = get_watermarks(FlowCategoryCount)
+
+        self.assertNotEqual(before[0], after[0])
+        self.assertEqual(before[1], after[1])
+        self.assertNotEqual(before[2], after[2])
+
 
 class IDSliceQuerySetTest(TembaTest):
     def test_fields(self):
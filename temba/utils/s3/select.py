@@ -1,5 +1,7 @@
 from datetime import datetime
 
+import iso8601
+
 LOOKUPS = {"gt": ">", "gte": ">=", "lte": "<=", "lt": "<", "in": "IN"}
 
 
@@ -54,3 +56,46 @@ def _compile_value(val) -> str:
     if isinstance(val, (list, tuple)):
         return f"({', '.join([_compile_value(v) for v in val])})"
     return str(val)
+
+
+def matches_where(record: dict, where: dict) -> bool:
+    """
+    Evaluates the conditions of a where dict against a record locally, as S3 select would. Raw conditions can't be
+    evaluated locally.
+    """
+    for field, val in where.items():
+        assert field != "__raw__", "can't evaluate raw conditions locally"
+
+        lookup = "="
+        field_parts = field.split("__")
+        if field_parts[-1] in LOOKUPS:
+            lookup = field_parts.pop()
+
+        actual = record
+        for part in field_parts:
+            if not isinstance(actual, dict) or part not in actual:
+                return False
+            actual = actual[part]
+
+        if actual is None:
+            return False
+        if isinstance(val, datetime):
+            actual = iso8601.parse_date(actual)
+
+        if lookup == "=":
+            matched = actual == val
+        elif lookup == "in":
+            matched = actual in val
+        elif lookup == "gt":
+            matched = actual > val
+        elif lookup == "gte":
+            matched = actual >= val
+        elif lookup == "lt":
+            matched = actual < val
+        else:
+            matched = actual <= val
+
+        if not matched:
+            return False
+
+    return True
@@ -6,7 +6,7 @@ import pytz
 
 from temba.tests import TembaTest
 from temba.tests.s3 import MockEventStream, MockS3Client
-from temba.utils.s3 import EventStreamReader, compile_select, get_body, split_url
+from temba.utils.s3 import EventStreamReader, compile_select, get_body, matches_where, split_url
 
 
 class S3Test(TembaTest):
@@ -85,3 +85,24 @@ class SelectTest(TembaTest):
             "SELECT s.* FROM s3object s WHERE '1ccf09f6-3fe8-4c0d-a073-981632be5a30' IN s.labels[*].uuid[*]",
             compile_select(where={"__raw__": "'1ccf09f6-3fe8-4c0d-a073-981632be5a30' IN s.labels[*].uuid[*]"}),
         )
+
+    def test_select_matches(self):
+        record = {
+            "id": 3,
+            "responded": True,
+            "flow": {"uuid": "1234", "name": "Favorites"},
+            "created_on": "2020-08-01T10:00:00+00:00",
+            "exited_on": None,
+        }
+
+        self.assertTrue(matches_where(record, {}))
+        self.assertTrue(matches_where(record, {"id": 3, "responded": True}))
+        self.assertFalse(matches_where(record, {"id": 3, "responded": False}))
+        self.assertTrue(matches_where(record, {"id__gt": 2, "id__lte": 3}))
+        self.assertFalse(matches_where(record, {"id__lt": 3}))
+        self.assertTrue(matches_where(record, {"flow__uuid__in": ["1234", "2345"]}))
+        self.assertFalse(matches_where(record, {"flow__uuid__in": ["2345"]}))
+        self.assertFalse(matches_where(record, {"flow__id": 1}))
+        self.assertFalse(matches_where(record, {"exited_on__gte": datetime(2020, 8, 1, 9, 0, 0, 0, pytz.UTC)}))
+        self.assertTrue(matches_where(record, {"created_on__gte": datetime(2020, 8, 1, 9, 0, 0, 0, pytz.UTC)}))
+        self.assertFalse(matches_where(record, {"created_on__gte": datetime(2020, 8, 1, 11, 0, 0, 0, pytz.UTC)}))
@@ -1,6 +1,7 @@
 import copy
 import datetime
 import io
+import tracemalloc
 from collections import OrderedDict
 from datetime import date
 from decimal import Decimal
@@ -26,8 +27,9 @@ from temba.utils import json, uuid
 from temba.utils.templatetags.temba import format_datetime, icon
 
 from . import chunk_list, countries, format_number, languages, percentage, redact, sizeof_fmt, str_to_bool
+from .bloom import BloomFilter
 from .cache import get_cacheable_result, incrby_existing
-from .celery import nonoverlapping_task
+from .celery import get_task_stats, instrument_task, instrumented_task, nonoverlapping_task, record_rows
 from .dates import date_range, datetime_to_str, datetime_to_timestamp, timestamp_to_datetime
 from .email import is_valid_address, send_simple_email
 from .fields import NameValidator, validate_external_url
@@ -409,6 +411,34 @@ class TemplateTagTestSimple(TestCase):
         )
 
 
+class BloomFilterTest(TestCase):
+    def test_filter(self):
+        bloom = BloomFilter.create(100)
+        self.assertEqual(959, bloom.num_bits)
+        self.assertEqual(7, bloom.num_hashes)
+
+        items = [str(uuid.uuid4()) for i in range(100)]
+        for item in items:
+            bloom.add(item)
+
+        for item in items:
+            self.assertIn(item, bloom)
+
+        # unseen items should mostly not be found
+        false_positives = sum(1 for i in range(1000) if str(uuid.uuid4()) in bloom)
+        self.assertLess(false_positives, 50)
+
+        # check serialization round trip
+        restored = BloomFilter.from_json(json.loads(json.dumps(bloom.as_json())))
+        self.assertEqual(bloom.bits, restored.bits)
+        for item in items:
+            self.assertIn(item, restored)
+
+        # empty filters contain nothing
+        empty = BloomFilter.create(0)
+        self.assertNotIn("foo", empty)
+
+
 class CacheTest(TembaTest):
     def test_get_cacheable_result(self):
         self.create_contact("Bob", phone="1234")
@@ -643,6 +673,85 @@ class CeleryTest(TembaTest):
         self.assertEqual(mock_redis_lock.call_count, 0)
         self.assertEqual(task_calls, ["1-11-12", "2-21-22", "3-31-32"])
 
+    @patch("temba.utils.analytics.gauge")
+    def test_instrument_task(self, mock_gauge):
+        self.assertEqual([], get_task_stats())
+
+        # rows recorded outside of an instrumented task are ignored
+        record_rows(5)
+
+        with instrument_task("task1") as invocation:
+            list(Contact.objects.all())
+            list(Flow.objects.all())
+            record_rows(3)
+            record_rows(2)
+
+        self.assertEqual(5, invocation.num_rows)
+        self.assertEqual(2, invocation.num_queries)
+        self.assertGreaterEqual(invocation.peak_memory, 0)
+
+        mock_gauge.assert_any_call("temba.task_duration.task1", invocation.duration)
+        mock_gauge.assert_any_call("temba.task_rows.task1", 5)
+        mock_gauge.assert_any_call("temba.task_queries.task1", 2)
+        mock_gauge.assert_any_call("temba.task_peak_memory.task1", invocation.peak_memory)
+
+        @instrumented_task(name="task2")
+        def test_task2(num):
+            record_rows(num)
+
+        self.assertIsInstance(test_task2, Task)
+
+        test_task2(4)
+        test_task2(6)
+
+        # invocations are still recorded if task errors
+        with self.assertRaises(ValueError):
+            with instrument_task("task1"):
+                record_rows(1)
+                raise ValueError("boom")
+
+        stats = {s["name"]: s for s in get_task_stats()}
+
+        self.assertEqual({"task1", "task2"}, set(stats.keys()))
+        self.assertEqual(2, stats["task1"]["count"])
+        self.assertEqual(3, stats["task1"]["avg_rows"])
+        self.assertEqual(1, stats["task1"]["avg_queries"])
+        self.assertEqual(2, stats["task2"]["count"])
+        self.assertEqual(5, stats["task2"]["avg_rows"])
+        self.assertEqual(0, stats["task2"]["avg_queries"])
+        self.assertGreaterEqual(stats["task1"]["max_duration"], stats["task1"]["avg_duration"])
+
+        # stats are kept per day and only the last week of days are reported
+        with patch("django.utils.timezone.now", return_value=timezone.now() - datetime.timedelta(days=3)):
+            with instrument_task("task2"):
+                record_rows(11)
+
+        with patch("django.utils.timezone.now", return_value=timezone.now() - datetime.timedelta(days=7)):
+            with instrument_task("task3"):
+                record_rows(1)
+
+        stats = {s["name"]: s for s in get_task_stats()}
+
+        self.assertEqual({"task1", "task2"}, set(stats.keys()))
+        self.assertEqual(3, stats["task2"]["count"])
+        self.assertEqual(7, stats["task2"]["avg_rows"])
+
+        # memory is measured as growth during the invocation, using tracemalloc if it's tracing
+        tracemalloc.start()
+        try:
+            with instrument_task("task4") as invocation:
+                data = bytearray(10_000_000)
+                del data
+
+            self.assertGreaterEqual(invocation.peak_memory, 10_000_000)
+
+            with instrument_task("task4") as invocation:
+                pass
+
+            self.assertLess(invocation.peak_memory, 10_000_000)
+        finally:
+            tracemalloc.stop()
+
 
 class MiddlewareTest(TembaTest):
     def test_org(self):
@@ -13,13 +13,16 @@ from temba.channels.models import Channel
 from temba.contacts.models import URN, Contact, ContactURN
 from temba.request_logs.models import HTTPLog
 from temba.templates.models import TemplateTranslation
-from temba.utils import chunk_list
+from temba.utils import analytics, chunk_list
 
 from . import update_api_version
 from .constants import LANGUAGE_MAPPING, STATUS_MAPPING
 
 logger = logging.getLogger(__name__)
 
+# how long a single channel's templates refresh can take before it's killed
+CHANNEL_TEMPLATES_TIMEOUT = 300
+
 
 @shared_task(track_started=True, name="refresh_whatsapp_contacts")
 def refresh_whatsapp_contacts(channel_id):
@@ -93,8 +96,8 @@ def _calculate_variable_count(content):
 def update_local_templates(channel, templates_data):
 
     channel_namespace = channel.config.get("fb_namespace", "")
-    # run through all our templates making sure they are present in our DB
-    seen = []
+    # run through all our templates building the specs of the translations which should be present in our DB
+    specs = []
     for template in templates_data:
 
         template_status = template["status"]
@@ -135,19 +138,21 @@ def update_local_templates(channel, templates_data):
             language = template["language"]
 
         missing_external_id = f"{template['language']}/{template['name']}"
-        translation = TemplateTranslation.get_or_create(
-            channel=channel,
-            name=template["name"],
-            language=language,
-            country=country,
-            content=content,
-            variable_count=variable_count,
-            status=status,
-            external_id=template.get("id", missing_external_id),
-            namespace=template.get("namespace", channel_namespace),
+        specs.append(
+            dict(
+                name=template["name"],
+                language=language,
+                country=country,
+                content=content,
+                variable_count=variable_count,
+                status=status,
+                external_id=template.get("id", missing_external_id),
+                namespace=template.get("namespace", channel_namespace),
+            )
         )
 
-        seen.append(translation)
+    # create or update translations that are new or have changed
+    seen = TemplateTranslation.bulk_upsert(channel, specs)
 
     # trim any translations we didn't see
     TemplateTranslation.trim(channel, seen)
@@ -156,7 +161,8 @@ def update_local_templates(channel, templates_data):
 @shared_task(track_started=True, name="refresh_whatsapp_templates")
 def refresh_whatsapp_templates():
     """
-    Runs across all WhatsApp templates that have connected FB accounts and syncs the templates which are active.
+    Runs across all WhatsApp templates that have connected FB accounts and queues a refresh of each channel's
+    templates, so that channels are synced concurrently by the worker pool and one slow provider can't hold up the rest
     """
 
     r = get_redis_connection()
@@ -164,21 +170,56 @@ def refresh_whatsapp_templates():
         return
 
     with r.lock("refresh_whatsapp_templates", 1800):
-        # for every whatsapp channel
-        for channel in Channel.objects.filter(is_active=True, channel_type__in=["WA", "D3", "WAC"]):
+        channel_ids = Channel.objects.filter(is_active=True, channel_type__in=["WA", "D3", "WAC"]).values_list(
+            "id", flat=True
+        )
+
+        for channel_id in channel_ids:
+            refresh_whatsapp_channel_templates.delay(channel_id)
+
+
+@shared_task(
+    track_started=True,
+    name="refresh_whatsapp_channel_templates",
+    soft_time_limit=CHANNEL_TEMPLATES_TIMEOUT,
+    time_limit=CHANNEL_TEMPLATES_TIMEOUT + 30,
+)
+def refresh_whatsapp_channel_templates(channel_id):
+    """
+    Syncs the templates of a single WhatsApp channel
+    """
+
+    r = get_redis_connection()
+    key = "refresh_whatsapp_templates:%d" % channel_id
+
+    if r.get(key):  # pragma: no cover
+        return
+
+    channel = Channel.objects.filter(id=channel_id, is_active=True).first()
+    if not channel:  # pragma: no cover
+        return
+
+    with r.lock(key, CHANNEL_TEMPLATES_TIMEOUT + 30):
+        start = time.perf_counter()
+
+        # update the version only when have it set in the config
+        if channel.config.get("version"):
+            # fetches API version and saves on channel.config
+            update_api_version(channel)
+
+        # fetch all our templates
+        try:
+            templates_data, valid = channel.type.get_api_templates(channel)
+            if not valid:
+                return
 
-            # update the version only when have it set in the config
-            if channel.config.get("version"):
-                # fetches API version and saves on channel.config
-                update_api_version(channel)
-            # fetch all our templates
-            try:
+            update_local_templates(channel, templates_data)
 
-                templates_data, valid = channel.type.get_api_templates(channel)
-                if not valid:
-                    continue
+        except Exception as e:
+            logger.error(f"Error refreshing whatsapp templates: {str(e)}", exc_info=True)
 
-                update_local_templates(channel, templates_data)
+        finally:
+            duration = time.perf_counter() - start
 
-            except Exception as e:
-                logger.error(f"Error refreshing whatsapp templates: {str(e)}", exc_info=True)
+            analytics.gauge(f"temba.whatsapp_templates_sync.{channel.channel_type.lower()}", duration)
+            logger.info(f"Synced whatsapp templates for channel {channel.uuid} in {duration:.3f}s")